@@ -4,20 +4,45 @@ from datetime import datetime, timedelta, timezone
 import random
 import string
 import json
+import shutil
+import subprocess
+import hashlib
+import gzip
+import zlib
+import mimetypes
 import uuid  # Import uuid for generating unique IDs
 import base64  # Needed for base64 decoding camera/voice note data
 import re  # Needed for process_mentions_and_links
+import threading
+import socket
+import time
+import atexit
+from collections import Counter, OrderedDict
 from pathlib import Path
 
 import firebase_admin
 from firebase_admin import credentials, firestore, initialize_app  # initialize_app is needed if credentials path exists
 
-from flask import Flask, render_template, Blueprint, request, redirect, url_for, g, flash, session, abort, jsonify, send_from_directory
+from flask import Flask, render_template, Blueprint, request, redirect, url_for, g, flash, session, abort, jsonify, send_from_directory, send_file, make_response, has_app_context
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash  # Corrected: Removed extra 'werk'
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join  # Corrected: Removed extra 'werk'
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_moment import Moment
 from functools import wraps  # For admin_required decorator
+import click
+from flask.cli import AppGroup
+
+try:
+    from PIL import Image, ImageOps, features as pil_features
+except ImportError:  # Pillow is optional: without it every image size class serves the original upload
+    Image = None
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional: without it static assets and responses use gzip only
+    brotli = None
 
 import config  # Your configuration file
 
@@ -38,6 +63,14 @@ app.config['STORY_MEDIA_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'st
 app.config['VOICE_NOTES_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'voice_notes')
 app.config['CHAT_MEDIA_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'chat_media')
 app.config['CHAT_BACKGROUND_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'chat_backgrounds')
+# Content-addressed store that all new uploads are saved into (see save_uploaded_file)
+app.config['MEDIA_STORE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'media')
+# Chunks of in-progress resumable uploads; kept outside static/ so partial files are never served
+app.config['RESUMABLE_UPLOADS_FOLDER'] = os.path.join(os.path.dirname(DATABASE), 'resumable_uploads')
+# Files moved aside by 'flask media gc --quarantine'; outside static/ so they are never served
+app.config['MEDIA_QUARANTINE_FOLDER'] = os.path.join(os.path.dirname(DATABASE), 'media_quarantine')
+# Fingerprinted and precompressed copies of static/css, static/js and static/img (see build_static_assets)
+app.config['ASSET_BUILD_FOLDER'] = os.path.join(os.path.dirname(DATABASE), 'static_build')
 
 # Ensure upload directories exist
 for folder in [
@@ -47,7 +80,9 @@ for folder in [
     app.config['STORY_MEDIA_FOLDER'],
     app.config['VOICE_NOTES_FOLDER'],
     app.config['CHAT_MEDIA_FOLDER'],
-    app.config['CHAT_BACKGROUND_FOLDER']
+    app.config['CHAT_BACKGROUND_FOLDER'],
+    app.config['MEDIA_STORE_FOLDER'],
+    app.config['RESUMABLE_UPLOADS_FOLDER']
 ]:
     Path(folder).mkdir(exist_ok=True)
 
@@ -57,6 +92,14 @@ ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'} # Added webm for camera capture
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'webm'} # Added webm for voice notes
 
+# Upload size limits. The per-type limits are enforced while each file is streamed to disk;
+# MAX_CONTENT_LENGTH rejects request bodies that can't fit any upload before Werkzeug parses them.
+MAX_IMAGE_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_VIDEO_UPLOAD_BYTES = 100 * 1024 * 1024
+MAX_AUDIO_UPLOAD_BYTES = 20 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read and written per step when saving an upload
+app.config['MAX_CONTENT_LENGTH'] = MAX_VIDEO_UPLOAD_BYTES + 1024 * 1024  # Largest file plus form fields
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -156,8 +199,796 @@ def init_db():
             app.logger.info(f"Admin user '{config.ADMIN_USERNAME}' already exists.")
 
         db.commit()  # Commit all changes after script and admin creation
+        apply_schema_migrations(db)  # Mark migrations already covered by schema.sql as applied
     app.logger.info("Database initialized/updated from schema.sql.")
 
+
+# --- Content-Addressed Media Store ---
+# Uploaded files are stored once per distinct content, at a path derived from their SHA-256
+# (static/uploads/media/ab/cd/<sha256>.<ext>), so the same image forwarded to ten chats or
+# re-uploaded as a profile photo takes disk space once. media_blobs counts the references to
+# each stored file; the file is deleted when the last reference is released.
+MEDIA_STORE_PATH = 'static/uploads/media'
+
+# Every column that holds a stored upload path
+MEDIA_REFERENCE_COLUMNS = [
+    ('users', 'chat_background_image_path'),
+    ('members', 'profilePhoto'),
+    ('groups', 'profilePhoto'),
+    ('chat_messages', 'media_path'),
+    ('posts', 'media_path'),
+    ('reels', 'media_path'),
+    ('reels', 'audio_path'),
+    ('stories', 'media_path'),
+    ('stories', 'background_audio_path'),
+]
+
+
+def static_path_filesystem(stored_path):
+    """Returns the absolute filesystem path for a stored path like 'static/uploads/...'."""
+    return os.path.join(app.root_path, stored_path)
+
+
+def hash_file(file_path):
+    """Returns (sha256 hex digest, size in bytes) of a file on disk, read in UPLOAD_CHUNK_SIZE chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def content_addressed_path(digest, extension):
+    return f'{MEDIA_STORE_PATH}/{digest[:2]}/{digest[2:4]}/{digest}.{extension}'
+
+
+def is_stored_media(stored_path):
+    return bool(stored_path) and stored_path.startswith(MEDIA_STORE_PATH + '/')
+
+
+def store_media_file(source_path, digest, size, extension, db=None):
+    """Moves source_path into the media store and takes a reference to it. If the same content is
+    already stored, source_path is discarded instead (it may be None if the content is known to
+    be stored). Returns the stored path.
+
+    Doesn't commit: the reference joins the caller's transaction, so it's only kept if the row
+    that references the file is committed with it. A file placed by a transaction that rolls back
+    is unreferenced and is removed by the orphaned media collector after its grace period. The
+    reference is taken before the file is placed, so the write lock serializes this with
+    remove_released_media() deleting the same file.
+    """
+    db = db or get_db()
+    stored_path = content_addressed_path(digest, extension)
+    db.execute(
+        """
+        INSERT INTO media_blobs (path, sha256, size, ref_count) VALUES (?, ?, ?, 1)
+        ON CONFLICT(path) DO UPDATE SET ref_count = ref_count + 1
+        """,
+        (stored_path, digest, size)
+    )
+    try:
+        target_path = static_path_filesystem(stored_path)
+        if os.path.exists(target_path):
+            if source_path:
+                os.remove(source_path)
+            os.utime(target_path)  # Restarts the orphaned media collector's grace period
+        elif source_path:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(source_path, target_path)
+        else:
+            raise FileNotFoundError(f"{stored_path} is not in the media store")
+    except Exception:
+        # Undo only this reference; the rest of the caller's transaction is left to the caller
+        db.execute("UPDATE media_blobs SET ref_count = ref_count - 1 WHERE path = ?", (stored_path,))
+        db.execute("DELETE FROM media_blobs WHERE path = ? AND ref_count <= 0", (stored_path,))
+        raise
+    return stored_path
+
+
+def release_stored_media(stored_path, db=None):
+    """Drops one reference to a stored file in the caller's transaction. Doesn't commit.
+
+    Returns stored_path if that was the last reference, otherwise None. The file itself is only
+    deleted by remove_released_media(), called with the returned paths once the caller has
+    committed. Paths outside the media store (uploads saved before it existed) are left alone.
+    """
+    if not is_stored_media(stored_path):
+        return None
+    db = db or get_db()
+    db.execute("UPDATE media_blobs SET ref_count = ref_count - 1 WHERE path = ? AND ref_count > 0", (stored_path,))
+    deleted = db.execute("DELETE FROM media_blobs WHERE path = ? AND ref_count <= 0", (stored_path,)).rowcount
+    return stored_path if deleted else None
+
+
+def remove_released_media(stored_paths, db=None):
+    """Deletes the files (and their derivatives) that release_stored_media() returned, after the
+    releasing transaction committed. Commits.
+
+    Runs under the write lock and skips any path that has a media_blobs row again, so content
+    re-uploaded since the release (store_media_file() takes the lock first) is never deleted. If
+    the process dies before this runs, the orphaned media collector removes the files.
+    """
+    stored_paths = [stored_path for stored_path in stored_paths if stored_path]
+    if not stored_paths:
+        return
+    db = db or get_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for stored_path in stored_paths:
+            if db.execute("SELECT 1 FROM media_blobs WHERE path = ?", (stored_path,)).fetchone():
+                continue
+            try:
+                os.remove(static_path_filesystem(stored_path))
+            except OSError:
+                pass
+            remove_media_derivatives(stored_path)
+    finally:
+        db.commit()
+
+
+def count_media_references(db):
+    """Returns {stored path: number of rows referencing it} for files in the media store."""
+    selects = ' UNION ALL '.join(
+        f"SELECT {column} AS path FROM {table}" for table, column in MEDIA_REFERENCE_COLUMNS
+        if _table_exists(db, table) and _column_exists(db, table, column)
+    )
+    rows = db.execute(
+        f"SELECT path, COUNT(*) AS refs FROM ({selects}) WHERE path LIKE ? GROUP BY path",
+        (MEDIA_STORE_PATH + '/%',)
+    ).fetchall()
+    return {row['path']: row['refs'] for row in rows}
+
+
+# --- Schema Migrations ---
+# schema.sql is only executed against a fresh database, so schema changes made after a
+# database already exists are applied here. Every migration must be idempotent (it also
+# runs right after schema.sql on a fresh database) and is recorded in schema_migrations
+# so it only runs once per database.
+def _table_exists(db, table_name):
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone() is not None
+
+def _column_exists(db, table_name, column_name):
+    return any(row['name'] == column_name for row in db.execute(f"PRAGMA table_info({table_name})"))
+
+def migrate_comments_table(db):
+    """Creates the comments table (missing from older databases) and its thread index."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            comment_text TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_comments_post_id_id ON comments (post_id, id)")
+
+def migrate_reference_reposts(db):
+    """Adds repost reference columns and converts reposts that were stored as full copies."""
+    if not _column_exists(db, 'posts', 'original_post_id'):
+        db.execute("ALTER TABLE posts ADD COLUMN original_post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE")
+    if not _column_exists(db, 'posts', 'reposts_count'):
+        db.execute("ALTER TABLE posts ADD COLUMN reposts_count INTEGER DEFAULT 0")
+
+    # Copied reposts carry the original's media_path, and upload filenames are unique,
+    # so a later post sharing a media_path with an earlier one is a copy of it.
+    db.execute(
+        """
+        UPDATE posts
+        SET original_post_id = (
+            SELECT MIN(o.id) FROM posts o
+            WHERE o.media_path = posts.media_path AND o.id < posts.id AND o.original_post_id IS NULL
+        )
+        WHERE original_post_id IS NULL
+          AND media_path IS NOT NULL
+          AND EXISTS (
+            SELECT 1 FROM posts o
+            WHERE o.media_path = posts.media_path AND o.id < posts.id AND o.original_post_id IS NULL
+          )
+        """
+    )
+    # Reposts are references only: drop the copied content
+    db.execute(
+        "UPDATE posts SET description = NULL, media_path = NULL, media_type = NULL WHERE original_post_id IS NOT NULL"
+    )
+    # Keep a single repost per user and original before the unique index is created
+    db.execute(
+        """
+        DELETE FROM posts
+        WHERE original_post_id IS NOT NULL
+          AND id NOT IN (
+            SELECT MIN(id) FROM posts WHERE original_post_id IS NOT NULL GROUP BY user_id, original_post_id
+          )
+        """
+    )
+    db.execute(
+        "UPDATE posts SET reposts_count = (SELECT COUNT(*) FROM posts r WHERE r.original_post_id = posts.id)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_original_post_id ON posts (original_post_id)")
+    db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_posts_unique_repost ON posts (user_id, original_post_id) WHERE original_post_id IS NOT NULL"
+    )
+
+def migrate_reel_views_table(db):
+    """Creates the table used to deduplicate buffered reel views."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reel_views (
+            reel_id INTEGER NOT NULL,
+            viewer_id INTEGER NOT NULL,
+            view_window INTEGER NOT NULL,
+            PRIMARY KEY (reel_id, viewer_id, view_window),
+            FOREIGN KEY (reel_id) REFERENCES reels(id) ON DELETE CASCADE,
+            FOREIGN KEY (viewer_id) REFERENCES users(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_reel_views_view_window ON reel_views (view_window)")
+
+def migrate_upload_sessions_table(db):
+    """Creates the table that tracks resumable upload sessions."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            total_size INTEGER NOT NULL,
+            status TEXT DEFAULT 'active',
+            sha256 TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at ON upload_sessions (updated_at)")
+
+def migrate_content_addressed_media(db):
+    """Creates media_blobs and moves existing uploads into the content-addressed media store.
+
+    Identical files collapse into one stored copy, every path column is rewritten, and reference
+    counts are computed from the rewritten columns. Originals are deleted only after the rewrite
+    is committed; if that step is interrupted, re-running finds nothing left to move.
+    """
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_blobs (
+            path TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    moved = {}  # legacy stored path -> content-addressed stored path
+    blobs = {}  # content-addressed stored path -> (sha256, size)
+    for table, column in MEDIA_REFERENCE_COLUMNS:
+        if not _table_exists(db, table) or not _column_exists(db, table, column):
+            continue
+        rows = db.execute(
+            f"SELECT DISTINCT {column} AS path FROM {table} WHERE {column} LIKE 'static/uploads/%'"
+        ).fetchall()
+        for row in rows:
+            legacy_path = row['path']
+            if legacy_path in moved or is_stored_media(legacy_path):
+                continue
+            legacy_file = static_path_filesystem(legacy_path)
+            if not os.path.isfile(legacy_file):
+                continue  # Missing file: leave the reference as it is
+            digest, size = hash_file(legacy_file)
+            extension = legacy_path.rsplit('.', 1)[-1].lower() if '.' in os.path.basename(legacy_path) else 'bin'
+            stored_path = content_addressed_path(digest, extension)
+            target_file = static_path_filesystem(stored_path)
+            if not os.path.exists(target_file):
+                os.makedirs(os.path.dirname(target_file), exist_ok=True)
+                # Copy rather than move so a failed migration leaves every legacy path intact
+                try:
+                    os.link(legacy_file, target_file)
+                except OSError:
+                    shutil.copy2(legacy_file, target_file)
+            moved[legacy_path] = stored_path
+            blobs[stored_path] = (digest, size)
+
+    for table, column in MEDIA_REFERENCE_COLUMNS:
+        if moved and _table_exists(db, table) and _column_exists(db, table, column):
+            db.executemany(
+                f"UPDATE {table} SET {column} = ? WHERE {column} = ?",
+                [(stored_path, legacy_path) for legacy_path, stored_path in moved.items()]
+            )
+    db.executemany(
+        "INSERT OR IGNORE INTO media_blobs (path, sha256, size) VALUES (?, ?, ?)",
+        [(stored_path, digest, size) for stored_path, (digest, size) in blobs.items()]
+    )
+    references = count_media_references(db)
+    db.execute("UPDATE media_blobs SET ref_count = 0")
+    db.executemany(
+        "UPDATE media_blobs SET ref_count = ? WHERE path = ?",
+        [(count, path) for path, count in references.items()]
+    )
+    db.commit()
+
+    for legacy_path in moved:
+        try:
+            os.remove(static_path_filesystem(legacy_path))
+        except OSError:
+            pass
+
+def migrate_video_metadata_columns(db):
+    """Adds the poster frame and video metadata columns to media_blobs."""
+    for column, column_type in [('poster_path', 'TEXT'), ('duration_seconds', 'REAL'), ('width', 'INTEGER'),
+                                ('height', 'INTEGER'), ('bitrate', 'INTEGER'), ('probed_at', 'TIMESTAMP')]:
+        if not _column_exists(db, 'media_blobs', column):
+            db.execute(f"ALTER TABLE media_blobs ADD COLUMN {column} {column_type}")
+
+# Tables whose content_versions counter is kept by triggers (see content_version_tag)
+CONTENT_VERSION_TABLES = ['users', 'members', 'friendships', 'posts', 'reels', 'stories', 'media_blobs']
+
+
+def migrate_content_versions(db):
+    """Creates content_versions with a counter per table and the triggers that bump them."""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS content_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    for table in CONTENT_VERSION_TABLES:
+        db.execute("INSERT OR IGNORE INTO content_versions (table_name) VALUES (?)", (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            db.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_content_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = '{table}'; END
+                """
+            )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_stories_expires_at ON stories (expires_at)")
+
+
+def migrate_notifications_receiver_index(db):
+    """Indexes notifications for the per-user, newest-first pages."""
+    db.execute("CREATE INDEX IF NOT EXISTS idx_notifications_receiver_id ON notifications (receiver_id, id)")
+
+
+def migrate_notification_coalescing(db):
+    """Adds the columns and index send_system_notification() uses to coalesce notifications."""
+    for column, column_type in [('group_key', 'TEXT'), ('event_count', 'INTEGER NOT NULL DEFAULT 1'),
+                                ('actor_id', 'INTEGER')]:
+        if not _column_exists(db, 'notifications', column):
+            db.execute(f"ALTER TABLE notifications ADD COLUMN {column} {column_type}")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notifications_group_key ON notifications (receiver_id, group_key) "
+        "WHERE group_key IS NOT NULL"
+    )
+
+
+def migrate_notification_retention(db):
+    """Creates the read watermark and archive tables used by mark-all-read and retention."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS notification_read_state (
+            user_id INTEGER PRIMARY KEY,
+            read_up_to_id INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS notifications_archive (
+            id INTEGER PRIMARY KEY,
+            receiver_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            link TEXT,
+            timestamp TIMESTAMP,
+            event_count INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+
+
+def migrate_jobs(db):
+    """Creates the background job queue table."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            unique_key TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_at TIMESTAMP NOT NULL,
+            locked_by TEXT,
+            locked_until TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at)")
+    db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_unique_key ON jobs (unique_key) "
+        "WHERE unique_key IS NOT NULL AND status != 'failed'"
+    )
+
+
+def migrate_user_deletions(db):
+    """Creates the table tracking background account deletions."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_deletions (
+            user_id INTEGER PRIMARY KEY,
+            requested_by INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            current_step TEXT,
+            rows_deleted INTEGER NOT NULL DEFAULT 0,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+
+
+# name -> (table, column, condition on that column) for counters kept equal to the number of
+# matching rows by triggers, so headline numbers are primary key lookups instead of COUNT(*) scans.
+# A column of None counts every row.
+COUNTER_DEFINITIONS = {
+    'users': ('users', None, None),
+    'groups': ('groups', None, None),
+    'posts': ('posts', 'original_post_id', 'IS NULL'),  # Reposts are reference rows, not posts
+    'reels': ('reels', None, None),
+    'stories': ('stories', None, None),
+    'pending_reports': ('reports', 'status', "= 'pending'"),
+    'active_warnings': ('warnings', 'status', "= 'active'"),
+    'active_bans': ('users', 'ban_status', "!= 'none'"),
+}
+
+
+def counter_trigger_statements(name):
+    """Returns the CREATE TRIGGER statements that maintain one counter."""
+    table, column, condition = COUNTER_DEFINITIONS[name]
+    bump = f"UPDATE counters SET value = value {{}} WHERE name = '{name}'"
+    if column is None:
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS counter_{name}_insert AFTER INSERT ON {table} "
+            f"BEGIN {bump.format('+ 1')}; END",
+            f"CREATE TRIGGER IF NOT EXISTS counter_{name}_delete AFTER DELETE ON {table} "
+            f"BEGIN {bump.format('- 1')}; END",
+        ]
+    new_matches = f"IFNULL(NEW.{column} {condition}, 0)"
+    old_matches = f"IFNULL(OLD.{column} {condition}, 0)"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS counter_{name}_insert AFTER INSERT ON {table} WHEN {new_matches} "
+        f"BEGIN {bump.format('+ 1')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS counter_{name}_delete AFTER DELETE ON {table} WHEN {old_matches} "
+        f"BEGIN {bump.format('- 1')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS counter_{name}_update AFTER UPDATE OF {column} ON {table} "
+        f"WHEN {new_matches} != {old_matches} BEGIN {bump.format(f'+ {new_matches} - {old_matches}')}; END",
+    ]
+
+
+def count_counter_rows(db, name):
+    """Counts a counter's rows the slow way, for seeding and checking the maintained value."""
+    table, column, condition = COUNTER_DEFINITIONS[name]
+    where = f"WHERE {column} {condition}" if column else ""
+    return db.execute(f"SELECT COUNT(*) FROM {table} {where}").fetchone()[0]
+
+
+def migrate_counters(db):
+    """Creates the counters table, seeds it from the current rows and adds its triggers."""
+    db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
+    for name in COUNTER_DEFINITIONS:
+        db.execute(
+            "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, count_counter_rows(db, name))
+        )
+        for statement in counter_trigger_statements(name):
+            db.execute(statement)
+
+
+def get_counters(db, names):
+    """Returns {name: value} for the given counters (0 for unknown ones)."""
+    rows = db.execute(
+        f"SELECT name, value FROM counters WHERE name IN ({','.join('?' * len(names))})", list(names)
+    ).fetchall()
+    counters = dict.fromkeys(names, 0)
+    counters.update({row['name']: row['value'] for row in rows})
+    return counters
+
+
+def reconcile_counter(db, name):
+    """Resets a counter to its slow count. Returns whether it had drifted. Doesn't commit."""
+    expected = count_counter_rows(db, name)
+    stored = db.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+    if stored is not None and stored[0] == expected:
+        return False
+    db.execute("INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, expected))
+    return True
+
+
+# Per user counters shown on profiles, kept in user_counters by triggers like the ones above.
+# name -> list of (table, user id column, amount, condition); {row} in the amount and condition
+# stands for the row (NEW/OLD in triggers). A user's value is the sum over every source. Counts
+# include friendships with users they have since blocked, which the friends page hides.
+USER_COUNTER_DEFINITIONS = {
+    'friends': [
+        ('friendships', 'user1_id', '1', "{row}.status = 'accepted'"),
+        ('friendships', 'user2_id', '1', "{row}.status = 'accepted'"),
+    ],
+    'following': [('friendships', 'user1_id', '1', "{row}.status = 'accepted'")],
+    'followers': [('friendships', 'user2_id', '1', "{row}.status = 'accepted'")],
+    'posts': [('posts', 'user_id', '1', '{row}.original_post_id IS NULL')],  # Reposts aren't counted
+    'likes': [('posts', 'user_id', 'IFNULL({row}.likes_count, 0)', None)],  # Likes received
+}
+
+
+def _user_counter_amount(amount, condition, row):
+    amount = amount.format(row=row)
+    if condition is None:
+        return amount
+    return f"(CASE WHEN {condition.format(row=row)} THEN {amount} ELSE 0 END)"
+
+
+def user_counter_trigger_statements(name):
+    """Returns the CREATE TRIGGER statements that maintain one per user counter."""
+    statements = []
+    for table, user_column, amount, condition in USER_COUNTER_DEFINITIONS[name]:
+        prefix = f"user_counter_{name}_{table}_{user_column}"
+        new_amount = _user_counter_amount(amount, condition, 'NEW')
+        old_amount = _user_counter_amount(amount, condition, 'OLD')
+        bump = (
+            "INSERT INTO user_counters (user_id, name, value) VALUES ({user}, " f"'{name}'" ", {delta}) "
+            "ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value"
+        )
+        add_new = bump.format(user=f"NEW.{user_column}", delta=new_amount)
+        remove_old = bump.format(user=f"OLD.{user_column}", delta=f"-{old_amount}")
+        if amount == '1' and condition is None:
+            statements += [
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}_insert AFTER INSERT ON {table} BEGIN {add_new}; END",
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}_delete AFTER DELETE ON {table} BEGIN {remove_old}; END",
+            ]
+            continue
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {prefix}_insert AFTER INSERT ON {table} WHEN {new_amount} != 0 "
+            f"BEGIN {add_new}; END",
+            f"CREATE TRIGGER IF NOT EXISTS {prefix}_delete AFTER DELETE ON {table} WHEN {old_amount} != 0 "
+            f"BEGIN {remove_old}; END",
+            f"CREATE TRIGGER IF NOT EXISTS {prefix}_update AFTER UPDATE ON {table} "
+            f"WHEN {new_amount} != {old_amount} OR NEW.{user_column} != OLD.{user_column} "
+            f"BEGIN {remove_old}; {add_new}; END",
+        ]
+    return statements
+
+
+def count_user_counter_rows(db, name):
+    """Computes a per user counter the slow way. Returns {user_id: value} without zeros."""
+    sources = " UNION ALL ".join(
+        f"SELECT {user_column} AS user_id, {_user_counter_amount(amount, condition, table)} AS value FROM {table}"
+        for table, user_column, amount, condition in USER_COUNTER_DEFINITIONS[name]
+    )
+    rows = db.execute(
+        f"SELECT user_id, SUM(value) FROM ({sources}) GROUP BY user_id HAVING SUM(value) != 0"
+    ).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+def reconcile_user_counter(db, name):
+    """Resets every user's value of a counter to its slow count. Returns the number of users whose
+    value had drifted. Doesn't commit."""
+    expected = count_user_counter_rows(db, name)
+    stored = {row[0]: row[1] for row in db.execute(
+        "SELECT user_id, value FROM user_counters WHERE name = ?", (name,)
+    ).fetchall()}
+    drifted = 0
+    for user_id in expected.keys() | stored.keys():
+        value = expected.get(user_id, 0)
+        if stored.get(user_id, 0) == value:
+            continue
+        drifted += 1
+        if value:
+            db.execute(
+                "INSERT OR REPLACE INTO user_counters (user_id, name, value) VALUES (?, ?, ?)", (user_id, name, value)
+            )
+        else:
+            db.execute("DELETE FROM user_counters WHERE user_id = ? AND name = ?", (user_id, name))
+    return drifted
+
+
+def migrate_user_counters(db):
+    """Creates the user_counters table, seeds it from the current rows and adds its triggers."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, name)
+        ) WITHOUT ROWID
+    """)
+    for name in USER_COUNTER_DEFINITIONS:
+        reconcile_user_counter(db, name)
+        for statement in user_counter_trigger_statements(name):
+            db.execute(statement)
+
+
+def get_user_counters(db, user_id):
+    """Returns {name: value} of every per user counter for one user."""
+    counters = dict.fromkeys(USER_COUNTER_DEFINITIONS, 0)
+    counters.update({row['name']: row['value'] for row in db.execute(
+        "SELECT name, value FROM user_counters WHERE user_id = ?", (user_id,)
+    ).fetchall()})
+    return counters
+
+
+def open_support_threads(db, admin_user_id, chat_room_id=None):
+    """Adds the support_threads rows missing for 1-on-1 rooms with the admin (only chat_room_id,
+    if given), worked out from the room's messages. Doesn't commit."""
+    room_filter = "AND cr.id = ?" if chat_room_id is not None else ""
+    db.execute(
+        f"""
+        INSERT OR IGNORE INTO support_threads (chat_room_id, user_id, last_message_id, last_activity_at, unread_for_admin)
+        SELECT cr.id, crm_user.user_id,
+               (SELECT MAX(id) FROM chat_messages WHERE chat_room_id = cr.id),
+               COALESCE((SELECT MAX(timestamp) FROM chat_messages WHERE chat_room_id = cr.id), cr.created_at),
+               (SELECT COUNT(*) FROM chat_messages cm
+                WHERE cm.chat_room_id = cr.id AND cm.sender_id = crm_user.user_id
+                  AND cm.timestamp > crm_admin.last_read_message_timestamp)
+        FROM chat_rooms cr
+        JOIN chat_room_members crm_admin ON cr.id = crm_admin.chat_room_id AND crm_admin.user_id = ?
+        JOIN chat_room_members crm_user ON cr.id = crm_user.chat_room_id AND crm_user.user_id != ?
+        WHERE cr.is_group = 0 {room_filter}
+        """,
+        (admin_user_id, admin_user_id, *([chat_room_id] if chat_room_id is not None else []))
+    )
+
+
+def migrate_support_threads(db):
+    """Creates the support_threads table and its trigger, and adds the existing support chats."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS support_threads (
+            chat_room_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            last_message_id INTEGER,
+            last_activity_at TIMESTAMP,
+            unread_for_admin INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_support_threads_activity ON support_threads (last_activity_at)")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_support_threads_unread ON support_threads (unread_for_admin, last_activity_at)"
+    )
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS support_threads_message AFTER INSERT ON chat_messages
+        BEGIN
+            UPDATE support_threads
+            SET last_message_id = NEW.id,
+                last_activity_at = NEW.timestamp,
+                unread_for_admin = CASE WHEN NEW.sender_id = user_id THEN unread_for_admin + 1 ELSE 0 END
+            WHERE chat_room_id = NEW.chat_room_id;
+        END
+    """)
+    admin_user = db.execute("SELECT id FROM users WHERE username = ?", (config.ADMIN_USERNAME,)).fetchone()
+    if admin_user:
+        open_support_threads(db, admin_user[0])
+
+
+def migrate_pending_reports_index(db):
+    """Indexes pending reports by target for the moderation queue."""
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reports_pending_target ON reports (reported_item_type, reported_item_id) "
+        "WHERE status = 'pending'"
+    )
+
+
+def migrate_upload_session_offsets(db):
+    """Adds received_bytes to upload_sessions, taking the offset of existing sessions from their
+    chunk files."""
+    if _column_exists(db, 'upload_sessions', 'received_bytes'):
+        return
+    db.execute("ALTER TABLE upload_sessions ADD COLUMN received_bytes INTEGER NOT NULL DEFAULT 0")
+    for row in db.execute("SELECT id FROM upload_sessions").fetchall():
+        try:
+            received_bytes = os.path.getsize(os.path.join(app.config['RESUMABLE_UPLOADS_FOLDER'], row[0] + '.part'))
+        except OSError:
+            continue
+        db.execute("UPDATE upload_sessions SET received_bytes = ? WHERE id = ?", (received_bytes, row[0]))
+
+
+def migrate_original_posts_counters(db):
+    """Rebuilds the posts counter triggers so reposts aren't counted, and recounts both counters."""
+    for (name,) in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND "
+        "(name LIKE 'counter\\_posts\\_%' ESCAPE '\\' OR name LIKE 'user\\_counter\\_posts\\_%' ESCAPE '\\')"
+    ).fetchall():
+        db.execute(f"DROP TRIGGER {name}")
+    for statement in counter_trigger_statements('posts') + user_counter_trigger_statements('posts'):
+        db.execute(statement)
+    reconcile_counter(db, 'posts')
+    reconcile_user_counter(db, 'posts')
+
+
+def migrate_unfinished_job_keys(db):
+    """Limits the unique_key index on jobs to unfinished jobs, so a key whose job failed for good
+    can be queued again."""
+    db.execute("DROP INDEX IF EXISTS idx_jobs_unique_key")
+    db.execute(
+        "CREATE UNIQUE INDEX idx_jobs_unique_key ON jobs (unique_key) "
+        "WHERE unique_key IS NOT NULL AND status != 'failed'"
+    )
+
+
+def migrate_reel_rank_snapshots(db):
+    """Creates the table that keeps each viewer's ranked reels order while they scroll."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS reel_rank_snapshots (
+            id TEXT PRIMARY KEY,
+            viewer_id INTEGER NOT NULL,
+            reel_ids TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (viewer_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_reel_rank_snapshots_created_at ON reel_rank_snapshots (created_at)")
+
+
+def migrate_admin_table_sort_indexes(db):
+    """Indexes the name columns the admin user and group tables sort by."""
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_original_name ON users (originalName)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_groups_name ON groups (name)")
+
+
+def bump_content_version(db, table_name):
+    """For changes the triggers can't see, e.g. image variants appearing on disk. Doesn't commit."""
+    db.execute("UPDATE content_versions SET version = version + 1 WHERE table_name = ?", (table_name,))
+
+# Ordered list of (name, function). Append new migrations to the end; never rename or reorder.
+SCHEMA_MIGRATIONS = [
+    ('0001_comments_table', migrate_comments_table),
+    ('0002_reference_reposts', migrate_reference_reposts),
+    ('0003_reel_views_table', migrate_reel_views_table),
+    ('0004_upload_sessions_table', migrate_upload_sessions_table),
+    ('0005_content_addressed_media', migrate_content_addressed_media),
+    ('0006_video_metadata_columns', migrate_video_metadata_columns),
+    ('0007_content_versions', migrate_content_versions),
+    ('0008_notifications_receiver_index', migrate_notifications_receiver_index),
+    ('0009_notification_coalescing', migrate_notification_coalescing),
+    ('0010_notification_retention', migrate_notification_retention),
+    ('0011_jobs', migrate_jobs),
+    ('0012_user_deletions', migrate_user_deletions),
+    ('0013_counters', migrate_counters),
+    ('0014_user_counters', migrate_user_counters),
+    ('0015_support_threads', migrate_support_threads),
+    ('0016_pending_reports_index', migrate_pending_reports_index),
+    ('0017_upload_session_offsets', migrate_upload_session_offsets),
+    ('0018_original_posts_counters', migrate_original_posts_counters),
+    ('0019_unfinished_job_keys', migrate_unfinished_job_keys),
+    ('0020_reel_rank_snapshots', migrate_reel_rank_snapshots),
+    ('0021_admin_table_sort_indexes', migrate_admin_table_sort_indexes),
+]
+
+def apply_schema_migrations(db):
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    applied = {row['name'] for row in db.execute("SELECT name FROM schema_migrations").fetchall()}
+    for name, migration in SCHEMA_MIGRATIONS:
+        if name in applied:
+            continue
+        try:
+            migration(db)
+            db.execute("INSERT INTO schema_migrations (name) VALUES (?)", (name,))
+            db.commit()
+            app.logger.info(f"Applied schema migration {name}.")
+        except Exception as e:
+            db.rollback()
+            app.logger.error(f"Schema migration {name} failed: {e}")
+            raise
+
 # Register close_db with the app context
 app.teardown_appcontext(close_db)
 
@@ -175,6 +1006,8 @@ with app.app_context():
         cursor.execute("SELECT id FROM users WHERE username = ?", (config.ADMIN_USERNAME,))
         if not cursor.fetchone():
             init_db()  # Call init_db to create admin even if tables exist
+        else:
+            apply_schema_migrations(db)  # Bring existing databases up to date
     db.close()
 
 
@@ -206,7 +1039,11 @@ class User(UserMixin):
 @login_manager.user_loader
 def load_user(user_id):
     db = get_db()
-    user_data = db.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    # Accounts queued for deletion are logged out right away, before their rows are gone
+    user_data = db.execute(
+        'SELECT * FROM users WHERE id = ? AND NOT EXISTS (SELECT 1 FROM user_deletions WHERE user_id = users.id)',
+        (user_id,)
+    ).fetchone()
     if user_data:
         # Fetch member details to get email if available
         member_data = db.execute('SELECT email FROM members WHERE user_id = ?', (user_id,)).fetchone()
@@ -243,30 +1080,607 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def save_uploaded_file(file, upload_folder):
-    if file and allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS.union(ALLOWED_VIDEO_EXTENSIONS).union(ALLOWED_AUDIO_EXTENSIONS)):
-        filename = secure_filename(file.filename)
-        unique_filename = str(uuid.uuid4()) + '_' + filename
-        file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
-        # Store relative path for database, correctly structured
-        relative_path = os.path.join('static', 'uploads', os.path.basename(upload_folder), unique_filename)
-        return relative_path.replace("\\", "/")  # Ensure forward slashes for URLs
-    return None
+class UploadTooLargeError(RequestEntityTooLarge):
+    """Raised when an uploaded file exceeds the size limit for its media type."""
+
+
+def upload_size_limit(filename):
+    extension = filename.rsplit('.', 1)[1].lower()
+    # Checked first because 'webm' is both a video and an audio extension
+    if extension in ALLOWED_VIDEO_EXTENSIONS:
+        return MAX_VIDEO_UPLOAD_BYTES
+    if extension in ALLOWED_AUDIO_EXTENSIONS:
+        return MAX_AUDIO_UPLOAD_BYTES
+    return MAX_IMAGE_UPLOAD_BYTES
+
+
+def _upload_too_large(file, max_bytes):
+    return UploadTooLargeError(
+        f"'{file.filename}' is too large. The limit for this file type is {max_bytes // (1024 * 1024)} MB."
+    )
+
+
+def stream_upload_to_file(file, destination_path, max_bytes):
+    """Copies an uploaded file to destination_path in UPLOAD_CHUNK_SIZE chunks, hashing it on the way.
+
+    Returns (sha256 hex digest, size in bytes). Data is written to a '.part' file that is only
+    renamed into place once complete, so an oversized or failed upload never leaves a partial file.
+    """
+    stream = file.stream
+    # Werkzeug has usually spooled the part already; if so, reject it before writing anything
+    if stream.seekable():
+        stream.seek(0, os.SEEK_END)
+        if stream.tell() > max_bytes:
+            raise _upload_too_large(file, max_bytes)
+        stream.seek(0)
+
+    temp_path = destination_path + '.part'
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as destination:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _upload_too_large(file, max_bytes)
+                digest.update(chunk)
+                destination.write(chunk)
+        os.replace(temp_path, destination_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return digest.hexdigest(), size
 
 
+def save_uploaded_file(file):
+    """Saves an uploaded file into the media store and returns its stored path, or None if the
+    file type isn't allowed. Identical content is only stored once.
+
+    The reference to the stored file is taken in the open transaction on get_db() (see
+    store_media_file()): commit it together with the row that stores the path, and roll back if
+    that row isn't written.
+
+    Raises UploadTooLargeError (a 413) if the file exceeds the limit for its media type.
+    """
+    if isinstance(file, ResumableUpload):
+        stored_path = store_resumable_upload(file.upload_session)
+    elif file and allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS.union(ALLOWED_VIDEO_EXTENSIONS).union(ALLOWED_AUDIO_EXTENSIONS)):
+        extension = secure_filename(file.filename).rsplit('.', 1)[-1].lower()
+        # Streamed next to its final location so moving it into place is a rename
+        incoming_path = os.path.join(static_path_filesystem(MEDIA_STORE_PATH), f'.incoming-{uuid.uuid4().hex}')
+        digest, size = stream_upload_to_file(file, incoming_path, upload_size_limit(file.filename))
+        try:
+            stored_path = store_media_file(incoming_path, digest, size, extension)
+        except Exception:
+            if os.path.exists(incoming_path):
+                os.remove(incoming_path)
+            raise
+    else:
+        return None
+    if stored_path and supports_image_variants(stored_path):
+        enqueue_image_variants(stored_path)
+    elif stored_path and supports_video_metadata(stored_path):
+        enqueue_media_job('video_metadata', stored_path)
+    return stored_path
+
+
+# --- Background Jobs ---
+# Slow work (media processing, notification fan-out, account deletion) is queued in the jobs table
+# so request handlers can return right away. Jobs are run by `flask jobs work`, which can be
+# started as any number of processes, and, unless JOB_WORKER_IN_PROCESS=0, by a daemon thread in
+# each app process. A worker leases the job it claims for JOB_VISIBILITY_TIMEOUT_SECONDS; if it
+# dies, the job becomes claimable again once the lease runs out. Failed jobs are retried with
+# exponential backoff until max_attempts, then kept as 'failed' for the admin dashboard.
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_SECONDS = 30
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_VISIBILITY_TIMEOUT_SECONDS = 300
+JOB_POLL_INTERVAL_SECONDS = 2
+JOB_WORKER_IN_PROCESS = os.environ.get('JOB_WORKER_IN_PROCESS', '1') != '0'
+FAILED_JOBS_SHOWN = 20  # Most recent failed jobs listed on the admin dashboard
+
+JOB_HANDLERS = {}
+
+
+class RequeueJob(Exception):
+    """Raised by a handler that stopped early (e.g. at a time budget) to have the job run again
+    right away, without counting as a failed attempt."""
+
+NIGHTLY_JOBS = {}  # job type -> hour (UTC) it runs at each night; see schedule_nightly_jobs()
+
+_job_wakeup = threading.Event()
+_job_worker = None
+_job_worker_lock = threading.Lock()
+
+
+def job_handler(job_type):
+    """Registers the decorated function as the handler for job_type. It is called with the job's
+    payload as keyword arguments, inside an app context."""
+    def register(handler):
+        JOB_HANDLERS[job_type] = handler
+        return handler
+    return register
+
+
+def _job_connection():
+    db = sqlite3.connect(DATABASE, timeout=10)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def enqueue_job(job_type, payload=None, unique_key=None, max_attempts=JOB_MAX_ATTEMPTS, run_at=None):
+    """Queues a job and returns whether it was added. In an app context the job joins the open
+    transaction on get_db(), so it's only queued if that commits, or is committed right away if
+    there is none. With unique_key, nothing is added while a job with that key is unfinished.
+    The job isn't run before run_at (an aware datetime), if given."""
+    sql = "INSERT OR IGNORE INTO jobs (type, payload, unique_key, max_attempts, run_at) VALUES (?, ?, ?, ?, ?)"
+    params = (job_type, json.dumps(payload or {}), unique_key, max_attempts, run_at or datetime.now(timezone.utc))
+    if has_app_context():
+        db = get_db()
+        in_transaction = db.in_transaction
+        added = db.execute(sql, params).rowcount > 0
+        if not in_transaction:
+            db.commit()
+    else:
+        db = _job_connection()
+        try:
+            added = db.execute(sql, params).rowcount > 0
+            db.commit()
+        finally:
+            db.close()
+
+    _ensure_job_worker()
+    _job_wakeup.set()
+    return added
+
+
+def _claim_job(db, worker_id):
+    now = datetime.now(timezone.utc)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # Jobs whose worker died on their last attempt won't be run again
+        db.execute(
+            """
+            UPDATE jobs SET status = 'failed', last_error = 'Worker lease expired', locked_by = NULL, locked_until = NULL
+            WHERE status = 'running' AND locked_until <= ? AND attempts >= max_attempts
+            """,
+            (now,)
+        )
+        job = db.execute(
+            """
+            SELECT * FROM jobs
+            WHERE (status = 'queued' AND run_at <= ?) OR (status = 'running' AND locked_until <= ?)
+            ORDER BY run_at, id
+            LIMIT 1
+            """,
+            (now, now)
+        ).fetchone()
+        if job:
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = ?, locked_until = ? WHERE id = ?",
+                (worker_id, now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT_SECONDS), job['id'])
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return job
+
+
+def run_next_job(worker_id):
+    """Claims and runs one due job. Returns False if there was none."""
+    db = _job_connection()
+    try:
+        job = _claim_job(db, worker_id)
+        if job is None:
+            return False
+
+        attempts = job['attempts'] + 1
+        handler = JOB_HANDLERS.get(job['type'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job type {job['type']}")
+            with app.app_context():
+                handler(**json.loads(job['payload']))
+        except RequeueJob:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, run_at = ?, locked_by = NULL, locked_until = NULL "
+                "WHERE id = ? AND locked_by = ?",
+                (datetime.now(timezone.utc), job['id'], worker_id)
+            )
+            db.commit()
+        except Exception as e:
+            if handler is None or attempts >= job['max_attempts']:
+                db.execute(
+                    "UPDATE jobs SET status = 'failed', last_error = ?, locked_by = NULL, locked_until = NULL "
+                    "WHERE id = ? AND locked_by = ?",
+                    (str(e), job['id'], worker_id)
+                )
+            else:
+                retry_at = datetime.now(timezone.utc) + timedelta(
+                    seconds=min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+                )
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', last_error = ?, run_at = ?, locked_by = NULL, locked_until = NULL "
+                    "WHERE id = ? AND locked_by = ?",
+                    (str(e), retry_at, job['id'], worker_id)
+                )
+            db.commit()
+            app.logger.error(f"Job {job['id']} ({job['type']}) failed on attempt {attempts}: {e}")
+        else:
+            # The lease check keeps a worker that overran its lease from touching a reclaimed job
+            db.execute("DELETE FROM jobs WHERE id = ? AND locked_by = ?", (job['id'], worker_id))
+            db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def work_jobs(worker_id, burst=False, poll_interval=JOB_POLL_INTERVAL_SECONDS):
+    """Runs jobs until stopped, or with burst until none are due. Returns the number run."""
+    try:
+        schedule_nightly_jobs()
+    except sqlite3.Error as e:
+        app.logger.error(f"Job worker {worker_id} could not schedule nightly jobs: {e}")
+    processed = 0
+    while True:
+        try:
+            ran = run_next_job(worker_id)
+        except sqlite3.Error as e:  # E.g. the database stayed locked past the timeout
+            app.logger.error(f"Job worker {worker_id} could not claim a job: {e}")
+            ran = False
+        if ran:
+            processed += 1
+            continue
+        if burst:
+            return processed
+        _job_wakeup.wait(poll_interval)
+        _job_wakeup.clear()
+
+
+def schedule_nightly_jobs():
+    """Queues the next run of every nightly job. Each run is keyed by its date, so this is safe to
+    call from every worker; nightly job handlers call it too, to queue the following night."""
+    now = datetime.now(timezone.utc)
+    for job_type, hour in NIGHTLY_JOBS.items():
+        run_at = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        enqueue_job(job_type, unique_key=f"{job_type}:{run_at.date().isoformat()}", run_at=run_at)
+
+
+def _ensure_job_worker():
+    global _job_worker
+    if not JOB_WORKER_IN_PROCESS:
+        return
+    with _job_worker_lock:
+        if _job_worker is None or not _job_worker.is_alive():
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:in-process"
+            _job_worker = threading.Thread(target=work_jobs, args=(worker_id,), name='jobs', daemon=True)
+            _job_worker.start()
+
+
+@app.before_request
+def start_job_worker():
+    if _job_worker is None:
+        _ensure_job_worker()
+
+
+def job_queue_stats(db):
+    """Returns rows of (type, status, count, oldest_run_at) for the admin dashboard."""
+    return [dict(row) for row in db.execute(
+        """
+        SELECT type, status, COUNT(*) AS count, MIN(run_at) AS oldest_run_at
+        FROM jobs
+        GROUP BY type, status
+        ORDER BY type, status
+        """
+    ).fetchall()]
+
+
+jobs_cli = AppGroup('jobs', help='Run and inspect background jobs.')
+app.cli.add_command(jobs_cli)
+
+
+@jobs_cli.command('work')
+@click.option('--burst', is_flag=True, help='Exit once no jobs are due instead of waiting for more.')
+@click.option('--poll-interval', default=JOB_POLL_INTERVAL_SECONDS, show_default=True, type=click.FloatRange(min=0.1),
+              help='Seconds to wait between checks when the queue is empty.')
+def jobs_work_command(burst, poll_interval):
+    """Runs queued background jobs. Start several for more throughput."""
+    global JOB_WORKER_IN_PROCESS
+    JOB_WORKER_IN_PROCESS = False  # This process is the worker; jobs queued by handlers land here too
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    click.echo(f"Job worker {worker_id} started.")
+    processed = work_jobs(worker_id, burst=burst, poll_interval=poll_interval)
+    click.echo(f"Ran {processed} jobs.")
+
+
+@jobs_cli.command('status')
+def jobs_status_command():
+    """Shows the queue depth per job type and status."""
+    stats = job_queue_stats(get_db())
+    if not stats:
+        click.echo("The job queue is empty.")
+    for row in stats:
+        click.echo(f"{row['type']:<28} {row['status']:<8} {row['count']:>6}  oldest due {row['oldest_run_at']}")
+
+
+def enqueue_media_job(kind, stored_path):
+    return enqueue_job(kind, {'stored_path': stored_path}, unique_key=f"{kind}:{stored_path}")
+
+
+# --- Counter Reconciliation ---
+# The counter triggers keep counters and user_counters exact as long as every write goes through
+# SQLite with them in place. A nightly job recomputes them the slow way and corrects drift, e.g.
+# after rows were edited with the triggers dropped or a database was restored from a backup.
+COUNTER_RECONCILE_HOUR_UTC = int(os.environ.get('COUNTER_RECONCILE_HOUR_UTC', 3))
+NIGHTLY_JOBS['reconcile_counters'] = COUNTER_RECONCILE_HOUR_UTC
+
+
+def reconcile_all_counters(db):
+    """Reconciles every counter, each in its own short write transaction so the site's writes
+    aren't held up for the whole run. Returns the number of values that had drifted."""
+    drifted = 0
+    for reconcile, names in ((reconcile_counter, COUNTER_DEFINITIONS),
+                             (reconcile_user_counter, USER_COUNTER_DEFINITIONS)):
+        for name in names:
+            db.execute("BEGIN IMMEDIATE")  # No trigger updates between counting and writing
+            try:
+                drifted += reconcile(db, name)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+    return drifted
+
+
+@job_handler('reconcile_counters')
+def reconcile_counters_job():
+    schedule_nightly_jobs()
+    drifted = reconcile_all_counters(get_db())
+    if drifted:
+        app.logger.warning(f"Reconciled {drifted} drifted counter values.")
+
+
+counters_cli = AppGroup('counters', help='Maintain the counters tables.')
+app.cli.add_command(counters_cli)
+
+
+@counters_cli.command('reconcile')
+def counters_reconcile_command():
+    """Recomputes every counter now and corrects the ones that drifted."""
+    drifted = reconcile_all_counters(get_db())
+    click.echo(f"Reconciled {drifted} drifted counter values.")
+
+
+# --- Image Variants ---
+# Resized copies of uploaded images for each size class, generated by a background job after
+# upload and stored next to the original (<sha256>.<size_class>.webp). Variants are re-encoded
+# without EXIF or other metadata, after applying the EXIF orientation. Until a variant exists,
+# media_variant_url() returns the original, so requests never wait on the pipeline. Rendering
+# never writes: variants are queued once at upload, and `flask media variants` queues the ones
+# still missing (uploads from before variants existed, jobs that failed for good).
+IMAGE_VARIANT_SIZES = {'avatar': 160, 'card': 720, 'full': 1600}  # Longest edge in pixels
+IMAGE_VARIANT_EXTENSIONS = {'png', 'jpg', 'jpeg'}  # GIFs are served as uploaded to keep their animation
+IMAGE_VARIANT_QUALITY = 82
+if Image is not None and pil_features.check('webp'):
+    IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_EXTENSION = 'WEBP', 'webp'
+else:
+    IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_EXTENSION = 'JPEG', 'jpg'
+
+def supports_image_variants(stored_path):
+    return (
+        Image is not None
+        and is_stored_media(stored_path)
+        and stored_path.rsplit('.', 1)[-1].lower() in IMAGE_VARIANT_EXTENSIONS
+    )
+
+
+def image_variant_path(stored_path, size_class):
+    return f"{stored_path.rsplit('.', 1)[0]}.{size_class}.{IMAGE_VARIANT_EXTENSION}"
+
+
+def media_variant_url(stored_path, size_class):
+    """URL of the size_class variant of a stored image, or of the original while the variant isn't
+    ready (or for media that has no variants, like videos). Also available in templates."""
+    if not stored_path:
+        return None
+    if size_class in IMAGE_VARIANT_SIZES and supports_image_variants(stored_path):
+        variant_path = image_variant_path(stored_path, size_class)
+        if os.path.exists(static_path_filesystem(variant_path)):
+            return static_path_url(variant_path)
+    return static_path_url(stored_path)
+
+app.add_template_global(media_variant_url)
+
+
+@job_handler('image_variants')
+def generate_image_variants(stored_path):
+    """Writes every size class variant of a stored image."""
+    with Image.open(static_path_filesystem(stored_path)) as original:
+        image = ImageOps.exif_transpose(original)  # Bake in the orientation before EXIF is dropped
+        if IMAGE_VARIANT_FORMAT == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        for size_class, max_edge in IMAGE_VARIANT_SIZES.items():
+            variant = image.copy()
+            variant.info.clear()  # Drop EXIF, XMP and comments carried over from the original
+            variant.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            target_path = static_path_filesystem(image_variant_path(stored_path, size_class))
+            variant.save(target_path + '.part', format=IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY)
+            os.replace(target_path + '.part', target_path)
+
+    # Responses tagged before the variants existed link the original; have clients refetch them
+    db = sqlite3.connect(DATABASE, timeout=10)
+    try:
+        bump_content_version(db, 'media_blobs')
+        db.commit()
+    finally:
+        db.close()
+
+
+def enqueue_image_variants(stored_path):
+    return enqueue_media_job('image_variants', stored_path)
+
+
+# --- Video Metadata ---
+# Poster frame, duration, dimensions and bitrate of uploaded videos, extracted in the background
+# with ffprobe/ffmpeg and stored on the video's media_blobs row (so a video shared by several
+# posts, reels or stories is probed once). Without the tools installed, videos are simply served
+# without metadata. Videos are queued for probing at upload; `flask media probe` queues the ones
+# never probed (e.g. uploaded before this existed). Listings only read what's stored.
+FFPROBE_BIN = os.getenv('FFPROBE_PATH') or shutil.which('ffprobe')
+FFMPEG_BIN = os.getenv('FFMPEG_PATH') or shutil.which('ffmpeg')
+VIDEO_TOOL_TIMEOUT_SECONDS = 60
+VIDEO_POSTER_MAX_WIDTH = 720
+
+# Columns to select (with "LEFT JOIN media_blobs mb ON mb.path = <media path column>") for
+# take_video_metadata()
+VIDEO_METADATA_COLUMNS = """
+    mb.poster_path AS video_poster_path, mb.duration_seconds AS video_duration, mb.width AS video_width,
+    mb.height AS video_height, mb.bitrate AS video_bitrate, mb.probed_at AS video_probed_at
+"""
+
+
+def supports_video_metadata(stored_path):
+    return (
+        FFPROBE_BIN is not None
+        and is_stored_media(stored_path)
+        and stored_path.rsplit('.', 1)[-1].lower() in ALLOWED_VIDEO_EXTENSIONS
+    )
+
+
+def video_poster_path(stored_path):
+    return f"{stored_path.rsplit('.', 1)[0]}.poster.jpg"
+
+
+def probe_video(file_path):
+    """Returns {'duration_seconds', 'width', 'height', 'bitrate'} (values may be None) from ffprobe."""
+    result = subprocess.run(
+        [FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0',
+         '-show_entries', 'stream=width,height,bit_rate:format=duration,bit_rate', '-of', 'json', file_path],
+        capture_output=True, text=True, timeout=VIDEO_TOOL_TIMEOUT_SECONDS, check=True
+    )
+    probe = json.loads(result.stdout or '{}')
+    stream = (probe.get('streams') or [{}])[0]
+    container = probe.get('format') or {}
+
+    def number(value, cast):
+        try:
+            return cast(float(value))
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        'duration_seconds': number(container.get('duration'), float),
+        'width': number(stream.get('width'), int),
+        'height': number(stream.get('height'), int),
+        'bitrate': number(stream.get('bit_rate') or container.get('bit_rate'), int)
+    }
+
+
+def extract_poster_frame(file_path, poster_file_path, duration_seconds):
+    """Writes a JPEG frame from about a second in (or the middle of short clips). Returns success."""
+    seek_to = min(1.0, duration_seconds / 2) if duration_seconds else 0
+    result = subprocess.run(
+        [FFMPEG_BIN, '-v', 'error', '-y', '-ss', f'{seek_to:.2f}', '-i', file_path, '-frames:v', '1',
+         '-vf', f"scale='min({VIDEO_POSTER_MAX_WIDTH},iw)':-2", '-f', 'image2', poster_file_path + '.part'],
+        capture_output=True, timeout=VIDEO_TOOL_TIMEOUT_SECONDS
+    )
+    if result.returncode != 0 or not os.path.exists(poster_file_path + '.part'):
+        return False
+    os.replace(poster_file_path + '.part', poster_file_path)
+    return True
+
+
+@job_handler('video_metadata')
+def extract_video_metadata(stored_path):
+    file_path = static_path_filesystem(stored_path)
+    metadata = {'duration_seconds': None, 'width': None, 'height': None, 'bitrate': None}
+    poster_path = None
+    try:
+        metadata = probe_video(file_path)
+        # Audio-only files (e.g. webm voice notes) have no video stream and so no frame to grab
+        if FFMPEG_BIN and metadata['width']:
+            poster_path = video_poster_path(stored_path)
+            if not extract_poster_frame(file_path, static_path_filesystem(poster_path), metadata['duration_seconds']):
+                poster_path = None
+    except (subprocess.SubprocessError, OSError, ValueError) as e:
+        app.logger.error(f"Error extracting video metadata for {stored_path}: {e}")
+
+    # Uses its own connection so the update is committed whatever the caller's transaction holds.
+    # probed_at is set even on failure so broken files aren't probed again on every listing.
+    db = sqlite3.connect(DATABASE, timeout=10)
+    try:
+        db.execute(
+            """
+            UPDATE media_blobs
+            SET poster_path = ?, duration_seconds = ?, width = ?, height = ?, bitrate = ?, probed_at = CURRENT_TIMESTAMP
+            WHERE path = ?
+            """,
+            (poster_path, metadata['duration_seconds'], metadata['width'], metadata['height'], metadata['bitrate'], stored_path)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def take_video_metadata(row_dict, media_path):
+    """Removes the VIDEO_METADATA_COLUMNS keys from a row dict and returns them as API fields
+    (poster_url, duration, width, height, bitrate); they're None until the video is probed."""
+    row_dict.pop('video_probed_at')
+    return {
+        'poster_url': static_path_url(row_dict.pop('video_poster_path')),
+        'duration': row_dict.pop('video_duration'),
+        'width': row_dict.pop('video_width'),
+        'height': row_dict.pop('video_height'),
+        'bitrate': row_dict.pop('video_bitrate')
+    }
+
+
+def remove_media_derivatives(stored_path):
+    """Deletes the image variants and video poster generated from a stored file."""
+    derived_paths = [image_variant_path(stored_path, size_class) for size_class in IMAGE_VARIANT_SIZES]
+    derived_paths.append(video_poster_path(stored_path))
+    for derived_path in derived_paths:
+        try:
+            os.remove(static_path_filesystem(derived_path))
+        except OSError:
+            pass
+
+
+def static_path_url(stored_path):
+    """Converts a stored path like 'static/uploads/...' into a URL (the media route for uploads)."""
+    if not stored_path:
+        return None
+    # Uploads are served by the media route, which knows how to cache them
+    if stored_path.startswith('static/uploads/'):
+        return url_for('media_file', filename=stored_path[len('static/uploads/'):])
+    # Only take the part after 'static/' for url_for's filename
+    if stored_path.startswith('static/'):
+        return url_for('static', filename=stored_path[len('static/'):])
+    # Fallback if path doesn't start with static/, though it should if saved by save_uploaded_file
+    return url_for('static', filename=stored_path)
+
+
+def profile_pic_url(profile_photo):
+    """Returns the avatar URL for an already-fetched members.profilePhoto value, or the default picture."""
+    if profile_photo:
+        return media_variant_url(profile_photo, 'avatar')
+    return url_for('static', filename='img/default_profile.png')
+
 def get_member_profile_pic(user_id):
     db = get_db()
     member = db.execute("SELECT profilePhoto FROM members WHERE user_id = ?", (user_id,)).fetchone()
-    if member and member['profilePhoto']:
-        # Ensure the path is relative to 'static/' as expected by url_for
-        # The stored path should already be like 'static/uploads/profile_photos/...'
-        if member['profilePhoto'].startswith('static/'):
-            # Only take the part after 'static/' for url_for's filename
-            return url_for('static', filename=member['profilePhoto'][len('static/'):])
-        # Fallback if path doesn't start with static/, though it should if saved by save_uploaded_file
-        return url_for('static', filename=member['profilePhoto'])
-    return url_for('static', filename='img/default_profile.png')
+    return profile_pic_url(member['profilePhoto'] if member else None)
 
 def get_member_from_user_id(user_id):
     db = get_db()
@@ -358,6 +1772,14 @@ def get_mutual_friends_count(user1_id, user2_id):
     count = db.execute(query, (user1_id, user1_id, user1_id, user2_id, user2_id, user2_id)).fetchone()[0]
     return count
 
+def can_view_post(post, viewer_id):
+    """Applies the same visibility rules as the feed to a single post row (needs user_id and visibility)."""
+    if post['user_id'] == viewer_id or post['visibility'] == 'public':
+        return True
+    if post['visibility'] == 'friends':
+        return get_relationship_status(viewer_id, post['user_id']) == 'friend'
+    return False
+
 # --- Global Context Processor for Navbar Icons ---
 @app.context_processor
 def inject_navbar_data():
@@ -367,9 +1789,9 @@ def inject_navbar_data():
 
         # Check for unread notifications
         db = get_db()
-        unread_notifications = db.execute(
-            "SELECT COUNT(*) FROM notifications WHERE receiver_id = ? AND is_read = 0",
-            (current_user.id,)
+        has_unread_notifications = db.execute(
+            "SELECT EXISTS (SELECT 1 FROM notifications WHERE receiver_id = ? AND id > ? AND is_read = 0)",
+            (current_user.id, get_notification_read_watermark(db, current_user.id))
         ).fetchone()[0]
 
         # Check for unread messages (assuming chat_room_members has unread status)
@@ -385,7 +1807,7 @@ def inject_navbar_data():
 
         return {
             'navbar_profile_photo': profile_photo_path,
-            'has_unread_notifications': unread_notifications > 0,
+            'has_unread_notifications': bool(has_unread_notifications),
             'has_unread_messages': unread_messages_count > 0,
             'is_admin_user': current_user.is_admin
         }
@@ -397,14 +1819,136 @@ def inject_navbar_data():
     }
 
 
+# --- Notification Preferences ---
+# Each user's notify_* settings are packed into one integer, a bit per setting, and cached per
+# worker so send_system_notification() can drop a notification the receiver turned off without
+# touching the database. Saving settings invalidates the entry in this worker; other workers pick
+# the change up once their entry is NOTIFICATION_PREFERENCES_CACHE_TTL seconds old.
+NOTIFICATION_PREFERENCE_BITS = {
+    'notify_friend_requests': 1 << 0,
+    'notify_friend_acceptance': 1 << 1,
+    'notify_post_likes': 1 << 2,
+    'notify_new_messages': 1 << 3,
+    'notify_group_invites': 1 << 4,
+    'notify_comments': 1 << 5,
+    'notify_tags': 1 << 6,
+}
+NOTIFICATION_TYPE_PREFERENCES = {  # Types not listed here (warnings, system messages) are always sent
+    'friend_request': 'notify_friend_requests',
+    'friend_accepted': 'notify_friend_acceptance',
+    'post_liked': 'notify_post_likes',
+    'message_received': 'notify_new_messages',
+    'group_invite': 'notify_group_invites',
+    'comment_received': 'notify_comments',
+    'tagged': 'notify_tags',
+}
+ALL_NOTIFICATION_PREFERENCES = sum(NOTIFICATION_PREFERENCE_BITS.values())
+NOTIFICATION_PREFERENCES_CACHE_SIZE = 4096
+NOTIFICATION_PREFERENCES_CACHE_TTL = 60
+
+_notification_preferences_cache = OrderedDict()  # user_id -> (bitmap, loaded_at)
+_notification_preferences_lock = threading.Lock()
+
+
+def load_notification_preferences(user_ids):
+    """Returns {user_id: bitmap} for user_ids, loading every uncached user in one query."""
+    now = time.monotonic()
+    preferences = {}
+    with _notification_preferences_lock:
+        for user_id in set(user_ids):
+            cached = _notification_preferences_cache.get(user_id)
+            if cached and now - cached[1] < NOTIFICATION_PREFERENCES_CACHE_TTL:
+                _notification_preferences_cache.move_to_end(user_id)
+                preferences[user_id] = cached[0]
+    missing = [user_id for user_id in set(user_ids) if user_id not in preferences]
+    if not missing:
+        return preferences
+
+    columns = ', '.join(NOTIFICATION_PREFERENCE_BITS)
+    rows = get_db().execute(
+        f"SELECT id, {columns} FROM users WHERE id IN ({','.join('?' * len(missing))})", missing
+    ).fetchall()
+    loaded = {user_id: ALL_NOTIFICATION_PREFERENCES for user_id in missing}  # Unknown users: nothing is suppressed
+    for row in rows:
+        loaded[row['id']] = sum(
+            bit for column, bit in NOTIFICATION_PREFERENCE_BITS.items() if row[column] is None or row[column]
+        )
+    with _notification_preferences_lock:
+        for user_id, bitmap in loaded.items():
+            _notification_preferences_cache[user_id] = (bitmap, now)
+            _notification_preferences_cache.move_to_end(user_id)
+        while len(_notification_preferences_cache) > NOTIFICATION_PREFERENCES_CACHE_SIZE:
+            _notification_preferences_cache.popitem(last=False)
+    preferences.update(loaded)
+    return preferences
+
+
+def wants_notification(user_id, type):
+    """Whether user_id's notify_* settings allow notifications of this type."""
+    preference = NOTIFICATION_TYPE_PREFERENCES.get(type)
+    if preference is None:
+        return True
+    return bool(load_notification_preferences([user_id])[user_id] & NOTIFICATION_PREFERENCE_BITS[preference])
+
+
+def invalidate_notification_preferences(user_id):
+    with _notification_preferences_lock:
+        _notification_preferences_cache.pop(user_id, None)
+
+
 # --- System Notification & Messaging Functions ---
-def send_system_notification(receiver_id, message, link=None, type='system_message'):
+# Notifications passed a group_key (e.g. every message in one chat room) are folded into the
+# receiver's unread notification with the same type and key from the last
+# NOTIFICATION_COALESCE_WINDOW_MINUTES: its count, latest actor, message and timestamp are
+# updated instead of adding a row. The row keeps its id, and so its place in the
+# newest-first list and in cursors, until it is read or the window passes.
+NOTIFICATION_COALESCE_WINDOW_MINUTES = 30
+
+
+def get_notification_read_watermark(db, user_id):
+    """Returns the id up to which all of a user's notifications count as read (see mark-all-read)."""
+    row = db.execute(
+        "SELECT read_up_to_id FROM notification_read_state WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return row['read_up_to_id'] if row else 0
+
+
+def send_system_notification(receiver_id, message, link=None, type='system_message',
+                             group_key=None, digest_message=None, actor_id=None):
+    """Sends a notification. With group_key it may be coalesced (see above); digest_message(count)
+    then returns the message for a row standing for count events, and defaults to message.
+    Nothing is written if the receiver turned this type of notification off."""
+    if not wants_notification(receiver_id, type):
+        return
     db = get_db()
+    now_utc = datetime.now(timezone.utc)
     try:
-        db.execute(
-            "INSERT INTO notifications (receiver_id, type, message, timestamp, link, is_read) VALUES (?, ?, ?, ?, ?, ?)",
-            (receiver_id, type, message, datetime.now(timezone.utc), link, 0)
-        )
+        existing = None
+        if group_key:
+            existing = db.execute(
+                """
+                SELECT id, event_count FROM notifications
+                WHERE receiver_id = ? AND group_key = ? AND type = ? AND is_read = 0 AND id > ? AND timestamp > ?
+                ORDER BY id DESC LIMIT 1
+                """,
+                (receiver_id, group_key, type, get_notification_read_watermark(db, receiver_id),
+                 now_utc - timedelta(minutes=NOTIFICATION_COALESCE_WINDOW_MINUTES))
+            ).fetchone()
+        if existing:
+            event_count = existing['event_count'] + 1
+            db.execute(
+                "UPDATE notifications SET message = ?, link = ?, timestamp = ?, event_count = ?, actor_id = ? WHERE id = ?",
+                (digest_message(event_count) if digest_message else message, link, now_utc, event_count, actor_id,
+                 existing['id'])
+            )
+        else:
+            db.execute(
+                """
+                INSERT INTO notifications (receiver_id, type, message, timestamp, link, is_read, group_key, actor_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (receiver_id, type, message, now_utc, link, 0, group_key, actor_id)
+            )
         db.commit()
         app.logger.info(f"System notification sent to user {receiver_id}: {message}")
     except Exception as e:
@@ -417,6 +1961,44 @@ def get_admin_user_id():
         return admin_user['id']
     return None
 
+# --- Conditional API Responses ---
+# Polled JSON endpoints tag their responses with an ETag built from the content_versions counters
+# of the tables they read (plus viewer, page and similar inputs) and answer a matching
+# If-None-Match with 304 before running their queries. The counters are per table, so any write
+# to posts changes every feed's tag; that costs a refetch, never a stale response.
+_CONTENT_VERSION_TAG_SALT = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:12]  # New code, new tags
+
+
+def content_version_tag(scope, tables, *parts):
+    """Returns the ETag for a `scope` response built from `tables` and the given inputs."""
+    placeholders = ', '.join('?' for _ in tables)
+    versions = get_db().execute(
+        f"SELECT table_name, version FROM content_versions WHERE table_name IN ({placeholders}) ORDER BY table_name",
+        list(tables)
+    ).fetchall()
+    key = [_CONTENT_VERSION_TAG_SALT, scope]
+    key += [f"{row['table_name']}={row['version']}" for row in versions]
+    key += [str(part) for part in parts]
+    return hashlib.sha256('|'.join(key).encode()).hexdigest()[:32]
+
+
+def tagged_response(response, etag):
+    response.set_etag(etag)
+    # Per-user bodies: browsers keep them but check back every time; shared caches don't store them
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified_response(etag):
+    """Returns a 304 if the client already holds the response tagged etag, otherwise None."""
+    # compress_response() suffixes the tag of compressed bodies with their encoding
+    for candidate in (etag, f'{etag}-gzip', f'{etag}-br'):
+        if request.if_none_match.contains_weak(candidate):
+            return tagged_response(make_response('', 304), candidate)
+    return None
+
+
 # --- ROUTES ---
 
 @app.route('/')
@@ -438,74 +2020,78 @@ def api_get_posts():
     per_page = request.args.get('per_page', 10, type=int)
     offset = (page - 1) * per_page
 
-    posts_query = """
+    etag = content_version_tag(
+        'get_posts', ('posts', 'users', 'members', 'friendships', 'media_blobs'), current_user.id, page, per_page
+    )
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        return not_modified
+
+    # Reposts are rows that only reference their original (original_post_id). Joining every
+    # row to its source post (itself for originals) expands reposts in the same query, so
+    # edits, deletions and visibility changes on the original always apply to its reposts.
+    posts_query = f"""
         SELECT
-            p.id,
-            p.user_id,
-            p.description,
-            p.media_path,
-            p.media_type,
+            src.id,
+            src.user_id,
+            src.description,
+            src.media_path,
+            src.media_type,
             p.timestamp,
-            p.likes_count,
-            p.comments_count,
+            src.timestamp AS original_timestamp,
+            src.likes_count,
+            src.comments_count,
+            src.reposts_count,
             u.username,
             u.originalName,
-            m.profilePhoto AS author_profile_pic
+            m.profilePhoto AS author_profile_pic,
+            CASE WHEN p.original_post_id IS NOT NULL THEN p.id END AS repost_id,
+            reposter.username AS reposted_by_username,
+            reposter.originalName AS reposted_by_original_name,
+            {VIDEO_METADATA_COLUMNS}
         FROM posts p
-        JOIN users u ON p.user_id = u.id
+        JOIN posts src ON src.id = COALESCE(p.original_post_id, p.id)
+        JOIN users u ON src.user_id = u.id
         LEFT JOIN members m ON u.id = m.user_id
+        LEFT JOIN users reposter ON p.original_post_id IS NOT NULL AND reposter.id = p.user_id
+        LEFT JOIN media_blobs mb ON mb.path = src.media_path
         WHERE (
-            p.visibility = 'public'
+            src.visibility = 'public'
             OR
-            (p.visibility = 'friends' AND EXISTS (
+            (src.visibility = 'friends' AND EXISTS (
                 SELECT 1 FROM friendships
-                WHERE ((user1_id = ? AND user2_id = p.user_id) OR (user1_id = p.user_id AND user2_id = ?))
+                WHERE ((user1_id = ? AND user2_id = src.user_id) OR (user1_id = src.user_id AND user2_id = ?))
                 AND status = 'accepted'
             ))
             OR
-            (p.visibility = 'private' AND p.user_id = ?)
+            (src.visibility = 'private' AND src.user_id = ?)
         )
         ORDER BY p.timestamp DESC
         LIMIT ? OFFSET ?
     """
     
-    # Execute the query to get posts for the current page
-    posts_data = db.execute(posts_query, (current_user.id, current_user.id, current_user.id, per_page, offset)).fetchall()
+    # Fetch one extra row to know whether there is a next page without counting the whole feed
+    posts_data = db.execute(posts_query, (current_user.id, current_user.id, current_user.id, per_page + 1, offset)).fetchall()
+    has_more = len(posts_data) > per_page
 
     posts_list = []
-    for post in posts_data:
+    for post in posts_data[:per_page]:
         post_dict = dict(post)
-        post_dict['profile_pic'] = get_member_profile_pic(post_dict['user_id'])
+        post_dict['profile_pic'] = profile_pic_url(post_dict['author_profile_pic'])
+        post_dict['media_url'] = media_variant_url(post_dict['media_path'], 'card')
+        post_dict.update(take_video_metadata(post_dict, post_dict['media_path']))
+        post_dict['is_repost'] = post_dict['repost_id'] is not None
         # Ensure timestamp is ISO format for moment.js
-        if post_dict['timestamp']:
-            post_dict['timestamp'] = datetime.fromisoformat(post_dict['timestamp']).isoformat()
-        posts_list.append(post_dict)
-
-    # Check if there are more posts for the next page
-    has_more_query = """
-        SELECT COUNT(*)
-        FROM posts p
-        JOIN users u ON p.user_id = u.id
-        LEFT JOIN members m ON u.id = m.user_id
-        WHERE (
-            p.visibility = 'public'
-            OR
-            (p.visibility = 'friends' AND EXISTS (
-                SELECT 1 FROM friendships
-                WHERE ((user1_id = ? AND user2_id = p.user_id) OR (user1_id = p.user_id AND user2_id = ?))
-                AND status = 'accepted'
-            ))
-            OR
-            (p.visibility = 'private' AND p.user_id = ?)
-        )
-    """
-    total_posts = db.execute(has_more_query, (current_user.id, current_user.id, current_user.id)).fetchone()[0]
-    has_more = (offset + per_page) < total_posts
+        if post_dict['timestamp']:
+            post_dict['timestamp'] = datetime.fromisoformat(post_dict['timestamp']).isoformat()
+        if post_dict['original_timestamp']:
+            post_dict['original_timestamp'] = datetime.fromisoformat(post_dict['original_timestamp']).isoformat()
+        posts_list.append(post_dict)
 
-    return jsonify({
+    return tagged_response(jsonify({
         'posts': posts_list,
         'has_more': has_more
-    })
+    }), etag)
 
 # --- API Routes for Post Actions ---
 
@@ -563,6 +2149,7 @@ def comment_on_post(post_id):
         # Increment the comments count on the post
         db.execute("UPDATE posts SET comments_count = comments_count + 1 WHERE id = ?", (post_id,))
         db.commit()
+        invalidate_first_comment_page(post_id)
         # Fetch the new comments count
         new_comments_count = db.execute("SELECT comments_count FROM posts WHERE id = ?", (post_id,)).fetchone()['comments_count']
         return jsonify({'success': True, 'message': 'Comment added successfully.', 'new_comments_count': new_comments_count})
@@ -572,28 +2159,182 @@ def comment_on_post(post_id):
         return jsonify({'success': False, 'message': 'Failed to add comment.'}), 500
 
 
+# --- Post Comment Threads ---
+# Comments are paged newest-first with keyset pagination over (post_id, id), which the
+# idx_comments_post_id_id index serves directly, so deep pages cost the same as the first.
+COMMENTS_PAGE_SIZE = 20
+COMMENTS_MAX_PAGE_SIZE = 100
+FIRST_COMMENT_PAGE_CACHE_SIZE = 1024  # Number of posts whose first page is kept in memory
+
+# post_id -> (comments_count, page). The first page is by far the most requested one, so it
+# is cached per worker. Entries are dropped when a comment is added through this worker and
+# are also tied to posts.comments_count, so comments added through other workers are picked up.
+_first_comment_page_cache = OrderedDict()
+_first_comment_page_lock = threading.Lock()
+
+
+def fetch_post_comments(post_id, before_id=None, limit=COMMENTS_PAGE_SIZE):
+    """Returns one page of comments (newest first) with their authors joined in the same query."""
+    db = get_db()
+    params = [post_id]
+    cursor_condition = ""
+    if before_id:
+        cursor_condition = "AND c.id < ?"
+        params.append(before_id)
+    params.append(limit + 1)  # Fetch one extra row to know whether another page exists
+
+    rows = db.execute(
+        f"""
+        SELECT c.id, c.post_id, c.user_id, c.comment_text, c.timestamp,
+               u.username, u.originalName, m.profilePhoto
+        FROM comments c
+        JOIN users u ON c.user_id = u.id
+        LEFT JOIN members m ON u.id = m.user_id
+        WHERE c.post_id = ? {cursor_condition}
+        ORDER BY c.id DESC
+        LIMIT ?
+        """,
+        params
+    ).fetchall()
+
+    has_more = len(rows) > limit
+    comments = []
+    for row in rows[:limit]:
+        comment = dict(row)
+        comment['profile_pic'] = profile_pic_url(comment.pop('profilePhoto'))
+        if comment['timestamp']:
+            comment['timestamp'] = datetime.fromisoformat(comment['timestamp']).isoformat()
+        comments.append(comment)
+
+    return {
+        'comments': comments,
+        'has_more': has_more,
+        'next_cursor': comments[-1]['id'] if has_more else None
+    }
+
+
+def get_first_comment_page(post_id, comments_count):
+    with _first_comment_page_lock:
+        cached = _first_comment_page_cache.get(post_id)
+        if cached and cached[0] == comments_count:
+            _first_comment_page_cache.move_to_end(post_id)
+            return cached[1]
+
+    page = fetch_post_comments(post_id)
+
+    with _first_comment_page_lock:
+        _first_comment_page_cache[post_id] = (comments_count, page)
+        _first_comment_page_cache.move_to_end(post_id)
+        while len(_first_comment_page_cache) > FIRST_COMMENT_PAGE_CACHE_SIZE:
+            _first_comment_page_cache.popitem(last=False)
+    return page
+
+
+def invalidate_first_comment_page(post_id):
+    with _first_comment_page_lock:
+        _first_comment_page_cache.pop(post_id, None)
+
+
+@app.route('/api/posts/<int:post_id>/comments', methods=['GET'])
+@login_required
+def api_get_post_comments(post_id):
+    db = get_db()
+    post = db.execute("SELECT id, user_id, visibility, comments_count FROM posts WHERE id = ?", (post_id,)).fetchone()
+    if not post or not can_view_post(post, current_user.id):
+        return jsonify({'success': False, 'message': 'Post not found.'}), 404
+
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', COMMENTS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, COMMENTS_MAX_PAGE_SIZE))
+
+    if before_id is None and limit == COMMENTS_PAGE_SIZE:
+        page = get_first_comment_page(post_id, post['comments_count'])
+    else:
+        page = fetch_post_comments(post_id, before_id=before_id, limit=limit)
+
+    return jsonify({
+        'success': True,
+        'comments_count': post['comments_count'],
+        'comments': page['comments'],
+        'has_more': page['has_more'],
+        'next_cursor': page['next_cursor']
+    })
+
+
+@app.route('/api/post-details/<int:post_id>', methods=['GET'])
+@login_required
+def api_post_details(post_id):
+    # Returns an HTML fragment for the post detail modals on the profile pages
+    db = get_db()
+    post = db.execute(
+        """
+        SELECT p.id, p.user_id, p.description, p.media_path, p.media_type, p.visibility, p.timestamp,
+               p.likes_count, p.comments_count, u.username, u.originalName, m.profilePhoto
+        FROM posts r
+        JOIN posts p ON p.id = COALESCE(r.original_post_id, r.id)
+        JOIN users u ON p.user_id = u.id
+        LEFT JOIN members m ON u.id = m.user_id
+        WHERE r.id = ?
+        """,
+        (post_id,)
+    ).fetchone()
+    if not post or not can_view_post(post, current_user.id):
+        return '<p class="text-danger text-center">Post not found.</p>', 404
+    post_id = post['id']  # Comments always belong to the original post
+
+    post_dict = dict(post)
+    post_dict['profile_pic'] = profile_pic_url(post_dict.pop('profilePhoto'))
+    post_dict['media_url'] = media_variant_url(post_dict['media_path'], 'full')
+    if post_dict['timestamp']:
+        post_dict['timestamp'] = datetime.fromisoformat(post_dict['timestamp']).isoformat()
+
+    comment_page = get_first_comment_page(post_id, post['comments_count'])
+    return render_template('includes/post_detail.html', post=post_dict, comment_page=comment_page)
+
+
 @app.route('/api/posts/<int:post_id>/repost', methods=['POST'])
 @login_required
 def repost_post(post_id):
     db = get_db()
     user_id = current_user.id
 
-    original_post = db.execute("SELECT * FROM posts WHERE id = ?", (post_id,)).fetchone()
-    if not original_post:
+    original_post = db.execute(
+        "SELECT id, user_id, visibility, original_post_id FROM posts WHERE id = ?", (post_id,)
+    ).fetchone()
+    if original_post and original_post['original_post_id']:
+        # Reposting a repost references the original post itself
+        original_post = db.execute(
+            "SELECT id, user_id, visibility, original_post_id FROM posts WHERE id = ?",
+            (original_post['original_post_id'],)
+        ).fetchone()
+    if not original_post or not can_view_post(original_post, user_id):
         return jsonify({'success': False, 'message': 'Original post not found.'}), 404
+    original_post_id = original_post['id']
+
+    existing_repost = db.execute(
+        "SELECT id FROM posts WHERE user_id = ? AND original_post_id = ?",
+        (user_id, original_post_id)
+    ).fetchone()
 
     try:
-        # Create a new post entry for the repost
-        db.execute(
-            """
-            INSERT INTO posts (user_id, description, media_path, media_type, visibility, timestamp, original_post_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, original_post['description'], original_post['media_path'],
-             original_post['media_type'], original_post['visibility'], datetime.now(timezone.utc), post_id)
-        )
+        if existing_repost:
+            # If already reposted, undo the repost
+            db.execute("DELETE FROM posts WHERE id = ?", (existing_repost['id'],))
+            db.execute("UPDATE posts SET reposts_count = reposts_count - 1 WHERE id = ?", (original_post_id,))
+            message = 'Repost removed.'
+            is_reposted = False
+        else:
+            # A repost is a reference row; its content is read from the original via the feed join
+            db.execute(
+                "INSERT INTO posts (user_id, visibility, timestamp, original_post_id) VALUES (?, ?, ?, ?)",
+                (user_id, original_post['visibility'], datetime.now(timezone.utc), original_post_id)
+            )
+            db.execute("UPDATE posts SET reposts_count = reposts_count + 1 WHERE id = ?", (original_post_id,))
+            message = 'Post reposted successfully.'
+            is_reposted = True
         db.commit()
-        return jsonify({'success': True, 'message': 'Post reposted successfully.'})
+        new_reposts_count = db.execute("SELECT reposts_count FROM posts WHERE id = ?", (original_post_id,)).fetchone()['reposts_count']
+        return jsonify({'success': True, 'message': message, 'is_reposted': is_reposted, 'new_reposts_count': new_reposts_count})
     except Exception as e:
         db.rollback()
         app.logger.error(f"Error reposting post: {e}")
@@ -821,9 +2562,18 @@ def api_get_stories():
     db = get_db()
     now_utc = datetime.now(timezone.utc)
 
+    # The earliest expiry is part of the tag, so the response changes when a story expires
+    next_expiry = db.execute("SELECT MIN(expires_at) FROM stories WHERE expires_at > ?", (now_utc,)).fetchone()[0]
+    etag = content_version_tag(
+        'get_stories', ('stories', 'users', 'members', 'friendships', 'media_blobs'), current_user.id, next_expiry
+    )
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        return not_modified
+
     # Fetch stories from the current user and their accepted friends
     # Filter by visibility and expiration time
-    stories_query = """
+    stories_query = f"""
         SELECT
             s.id,
             s.user_id,
@@ -836,10 +2586,12 @@ def api_get_stories():
             s.expires_at,
             u.username,
             u.originalName,
-            m.profilePhoto AS author_profile_pic
+            m.profilePhoto AS author_profile_pic,
+            {VIDEO_METADATA_COLUMNS}
         FROM stories s
         JOIN users u ON s.user_id = u.id
         LEFT JOIN members m ON u.id = m.user_id
+        LEFT JOIN media_blobs mb ON mb.path = s.media_path
         WHERE s.expires_at > ?
           AND (
                 s.user_id = ? -- Current user's own stories
@@ -865,11 +2617,12 @@ def api_get_stories():
         story_dict = dict(story)
         story_user_id = story_dict['user_id']
         
+        story_dict.update(take_video_metadata(story_dict, story_dict['media_path']))
         # Ensure media_path is properly formatted for URL
         if story_dict['media_path']:
-             story_dict['media_path'] = url_for('static', filename=story_dict['media_path'][len('static/'):])
+             story_dict['media_path'] = media_variant_url(story_dict['media_path'], 'full')
         if story_dict['background_audio_path']:
-             story_dict['background_audio_path'] = url_for('static', filename=story_dict['background_audio_path'][len('static/'):])
+             story_dict['background_audio_path'] = static_path_url(story_dict['background_audio_path'])
 
         story_dict['profile_pic'] = get_member_profile_pic(story_user_id)
         if story_dict['timestamp']:
@@ -888,7 +2641,7 @@ def api_get_stories():
     # Convert dictionary to list of user-story groups
     stories_list_for_json = list(grouped_stories.values())
 
-    return jsonify(stories_list_for_json)
+    return tagged_response(jsonify(stories_list_for_json), etag)
 
 
 # --- Authentication Routes ---
@@ -1145,6 +2898,7 @@ def my_profile():
         flash("Please complete your personal details first.", 'info')
         return redirect(url_for('edit_my_details'))
 
+    counts = get_user_counters(db, current_user.id)
     # Prepare current_user_profile for the template
     current_user_profile = {
         'id': current_user.id,
@@ -1167,12 +2921,11 @@ def my_profile():
         'spouse_fiancee_name': member['maritalStatus'] in ['Married', 'Engaged'] and (member['spouseNames'] or member['girlfriendNames']) or None,
         'personal_relationship_description': member['personalRelationshipDescription'],  # Added this line for the new field
         
-        # Placeholder counts - Replace with actual database queries
-        'friends_count': 0, 
-        'followers_count': 0,
-        'following_count': 0,
-        'likes_count': 0,
-        'posts_count': 0,
+        'friends_count': counts['friends'],
+        'followers_count': counts['followers'],
+        'following_count': counts['following'],
+        'likes_count': counts['likes'],
+        'posts_count': counts['posts'],
 
         # Determine if any additional info exists for the template
         'has_any_additional_info': any([
@@ -1276,10 +3029,11 @@ def edit_my_details():
 
 
         profile_photo_file = request.files.get('profilePhotoFile')  # Changed to profilePhotoFile for clarity in HTML
-        profilePhoto_path = member['profilePhoto'] if member else None
+        previous_profile_photo = member['profilePhoto'] if member else None
+        profilePhoto_path = previous_profile_photo
 
         if profile_photo_file and profile_photo_file.filename != '':
-            profilePhoto_path = save_uploaded_file(profile_photo_file, app.config['PROFILE_PHOTOS_FOLDER'])
+            profilePhoto_path = save_uploaded_file(profile_photo_file)
             if not profilePhoto_path:
                 flash('Invalid profile photo file type.', 'danger')
                 form_data = request.form.to_dict()
@@ -1313,7 +3067,11 @@ def edit_my_details():
                      pronouns, workInfo, university, secondary, location, socialLink, websiteLink)
                 )
                 flash('Your personal details have been added successfully!', 'success')
+            released = None
+            if profilePhoto_path != previous_profile_photo:
+                released = release_stored_media(previous_profile_photo, db)
             db.commit()
+            remove_released_media([released], db)
             return redirect(url_for('my_profile'))
         except Exception as e:
             flash(f'An error occurred while saving your details: {e}', 'danger')
@@ -2183,12 +3941,12 @@ def api_send_chat_message(chat_room_id):
         return jsonify({'success': False, 'message': 'You are not a member of this chat room.'}), 403
 
     content = request.form.get('content')
-    media_file = request.files.get('media_file')
+    media_file = request_media_file('media_file')
     media_path = None
     media_type = None
 
     if media_file and media_file.filename != '':
-        media_path = save_uploaded_file(media_file, app.config['CHAT_MEDIA_FOLDER'])
+        media_path = save_uploaded_file(media_file)
         if media_path:
             if media_file.filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS:
                 media_type = 'image'
@@ -2221,15 +3979,23 @@ def api_send_chat_message(chat_room_id):
             "SELECT user_id FROM chat_room_members WHERE chat_room_id = ? AND user_id != ?",
             (chat_room_id, current_user.id)
         ).fetchall()
+        # Construct a snippet of the message for notification
+        notif_content = content if content else f"sent a {media_type}"
+        load_notification_preferences([member['user_id'] for member in other_members])  # One query for the room
+        message_text = f"<strong>{current_user.original_name}</strong> sent a message in your chat: {notif_content[:50]}"
         for member in other_members:
-            # Construct a snippet of the message for notification
-            notif_content = content if content else f"sent a {media_type}"
-            message_text = f"<strong>{current_user.original_name}</strong> sent a message in your chat: {notif_content[:50]}"
+            # A busy room makes one notification per member, counting its new messages
             send_system_notification(
                 member['user_id'],
                 message_text,
                 link=url_for('view_chat', chat_room_id=chat_room_id),
-                type='message_received'
+                type='message_received',
+                group_key=f'chat_room:{chat_room_id}',
+                digest_message=lambda count: (
+                    f"{count} new messages in your chat. Latest from "
+                    f"<strong>{current_user.original_name}</strong>: {notif_content[:50]}"
+                ),
+                actor_id=current_user.id
             )
 
         return jsonify({'success': True, 'message': dict(new_message)})
@@ -2279,12 +4045,13 @@ def create_group():
         profile_photo_path = None
 
         if group_profile_pic_file and group_profile_pic_file.filename != '':
-            profile_photo_path = save_uploaded_file(group_profile_pic_file, app.config['PROFILE_PHOTOS_FOLDER'])
+            profile_photo_path = save_uploaded_file(group_profile_pic_file)
             if not profile_photo_path:
                 flash('Invalid group profile photo file type.', 'danger')
                 return render_template('create_group.html', friends=friends_with_pics, form_data=request.form.to_dict(), current_year=current_year)
 
         if not group_name:
+            db.rollback()  # Drops the reference save_uploaded_file() took to the photo
             flash('Group name is required.', 'danger')
             return render_template('create_group.html', friends=friends_with_pics, form_data=request.form.to_dict(), current_year=current_year)
 
@@ -2508,6 +4275,775 @@ def api_leave_group(group_id):
         return jsonify({'success': False, 'message': 'Failed to leave group.'}), 500
 
 
+# --- Resumable Uploads ---
+# Large media can be sent in chunks: create a session, PUT chunks at increasing offsets, then
+# finalize. The chunk data lives in RESUMABLE_UPLOADS_FOLDER and the session in upload_sessions,
+# so an interrupted upload (or a restarted worker) resumes from the bytes already on disk.
+# upload_sessions.received_bytes is the offset the next chunk must start at; a PUT claims its
+# byte range by advancing it with a conditional UPDATE before writing, so two requests racing for
+# the same offset can't both append.
+# create_post, create_reel, create_story and api_send_chat_message accept a finalized upload in
+# place of a file via the '<field>_upload_id' form field.
+RESUMABLE_UPLOAD_MAX_CHUNK_BYTES = 8 * 1024 * 1024
+RESUMABLE_UPLOAD_TTL_HOURS = 24  # Sessions untouched for this long are garbage collected
+RESUMABLE_UPLOAD_GC_INTERVAL_SECONDS = 15 * 60
+
+_last_upload_session_gc = 0.0
+
+
+def _resumable_upload_path(upload_id):
+    return os.path.join(app.config['RESUMABLE_UPLOADS_FOLDER'], upload_id + '.part')
+
+
+def _get_upload_session(upload_id, user_id):
+    return get_db().execute(
+        "SELECT * FROM upload_sessions WHERE id = ? AND user_id = ?", (upload_id, user_id)
+    ).fetchone()
+
+
+def _upload_session_status(upload_session):
+    return {
+        'success': True,
+        'upload_id': upload_session['id'],
+        'offset': upload_session['received_bytes'],
+        'size': upload_session['total_size'],
+        'status': upload_session['status']
+    }
+
+
+def delete_upload_session(upload_id):
+    db = get_db()
+    db.execute("DELETE FROM upload_sessions WHERE id = ?", (upload_id,))
+    db.commit()
+    try:
+        os.remove(_resumable_upload_path(upload_id))
+    except OSError:
+        pass
+
+
+def purge_abandoned_upload_sessions():
+    """Deletes sessions (and their chunk files) not touched within RESUMABLE_UPLOAD_TTL_HOURS."""
+    db = get_db()
+    stale_ids = [row['id'] for row in db.execute(
+        "SELECT id FROM upload_sessions WHERE updated_at < datetime('now', ?)",
+        (f'-{RESUMABLE_UPLOAD_TTL_HOURS} hours',)
+    ).fetchall()]
+    for upload_id in stale_ids:
+        delete_upload_session(upload_id)
+
+    # Chunk files whose session row is gone (e.g. a crash between the two deletes)
+    cutoff = time.time() - RESUMABLE_UPLOAD_TTL_HOURS * 3600
+    folder = app.config['RESUMABLE_UPLOADS_FOLDER']
+    known_ids = {row['id'] for row in db.execute("SELECT id FROM upload_sessions").fetchall()}
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith('.part') and name[:-len('.part')] not in known_ids and os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return len(stale_ids)
+
+
+def _maybe_purge_abandoned_upload_sessions():
+    global _last_upload_session_gc
+    if time.time() - _last_upload_session_gc < RESUMABLE_UPLOAD_GC_INTERVAL_SECONDS:
+        return
+    _last_upload_session_gc = time.time()
+    try:
+        purge_abandoned_upload_sessions()
+    except Exception as e:
+        app.logger.error(f"Error purging abandoned upload sessions: {e}")
+
+
+def request_media_file(field_name):
+    """Returns the file uploaded as field_name, or the finalized resumable upload named by the
+    '<field_name>_upload_id' form field. Returns None if neither is present.
+
+    A resumable upload is only consumed when save_uploaded_file() stores it, in the transaction
+    that stores the referencing row, so it can be retried after a validation error.
+    """
+    file = request.files.get(field_name)
+    if file and file.filename != '':
+        return file
+    upload_id = request.form.get(f'{field_name}_upload_id')
+    if not upload_id:
+        return file
+    upload_session = _get_upload_session(upload_id, current_user.id)
+    if not upload_session or upload_session['status'] != 'complete':
+        return None
+    return ResumableUpload(upload_session)
+
+
+class ResumableUpload(FileStorage):
+    """A finalized resumable upload, passed to save_uploaded_file() like an uploaded file."""
+
+    def __init__(self, upload_session):
+        super().__init__(filename=upload_session['filename'])
+        self.upload_session = upload_session
+
+
+def store_resumable_upload(upload_session):
+    """Moves a finalized upload's chunk file into the media store and consumes its session, in
+    the open transaction on get_db(). Returns the stored path, or None if the session was
+    consumed in the meantime.
+
+    If that transaction rolls back, the session is kept while its file has already moved into
+    the store; a retry takes its reference from there.
+    """
+    db = get_db()
+    # Deleting the row first takes the write lock, so concurrent submits can't both consume it
+    consumed = db.execute(
+        "DELETE FROM upload_sessions WHERE id = ? AND status = 'complete'", (upload_session['id'],)
+    ).rowcount
+    if not consumed:
+        return None
+    extension = upload_session['filename'].rsplit('.', 1)[-1].lower()
+    incoming_path = os.path.join(static_path_filesystem(MEDIA_STORE_PATH), f'.incoming-{uuid.uuid4().hex}')
+    try:
+        os.replace(_resumable_upload_path(upload_session['id']), incoming_path)
+    except FileNotFoundError:
+        incoming_path = None  # Moved by an earlier submit that rolled back
+    return store_media_file(incoming_path, upload_session['sha256'], upload_session['total_size'], extension, db)
+
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def api_create_upload_session():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename') or ''))
+    total_size = data.get('size')
+    if not allowed_file(filename, ALLOWED_IMAGE_EXTENSIONS | ALLOWED_VIDEO_EXTENSIONS | ALLOWED_AUDIO_EXTENSIONS):
+        return jsonify({'success': False, 'message': 'Invalid file type.'}), 400
+    if not isinstance(total_size, int) or isinstance(total_size, bool) or total_size <= 0:
+        return jsonify({'success': False, 'message': 'size must be a positive number of bytes.'}), 400
+    max_bytes = upload_size_limit(filename)
+    if total_size > max_bytes:
+        return jsonify({'success': False, 'message': f'File is too large. The limit for this file type is {max_bytes // (1024 * 1024)} MB.'}), 413
+
+    _maybe_purge_abandoned_upload_sessions()
+
+    upload_id = uuid.uuid4().hex
+    db = get_db()
+    try:
+        open(_resumable_upload_path(upload_id), 'wb').close()
+        db.execute(
+            "INSERT INTO upload_sessions (id, user_id, filename, total_size) VALUES (?, ?, ?, ?)",
+            (upload_id, current_user.id, filename, total_size)
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        app.logger.error(f"Error creating upload session: {e}")
+        return jsonify({'success': False, 'message': 'Failed to start upload.'}), 500
+
+    return jsonify({**_upload_session_status(_get_upload_session(upload_id, current_user.id)),
+                    'max_chunk_size': RESUMABLE_UPLOAD_MAX_CHUNK_BYTES}), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@login_required
+def api_get_upload_session(upload_id):
+    upload_session = _get_upload_session(upload_id, current_user.id)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload not found.'}), 404
+    return jsonify(_upload_session_status(upload_session))
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def api_put_upload_chunk(upload_id):
+    upload_session = _get_upload_session(upload_id, current_user.id)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload not found.'}), 404
+    if upload_session['status'] != 'active':
+        return jsonify({'success': False, 'message': 'Upload is already finalized.'}), 409
+
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'message': 'An Upload-Offset header (or offset parameter) is required.'}), 400
+    length = request.content_length
+    if length is None or length > RESUMABLE_UPLOAD_MAX_CHUNK_BYTES:
+        return jsonify({'success': False, 'message': f'Chunks must declare a Content-Length of at most {RESUMABLE_UPLOAD_MAX_CHUNK_BYTES} bytes.'}), 413
+    if offset + length > upload_session['total_size']:
+        return jsonify({'success': False, 'message': 'Chunk extends past the declared upload size.'}), 400
+
+    # Claim the byte range: only one request can advance received_bytes from this offset
+    db = get_db()
+    claimed = db.execute(
+        """
+        UPDATE upload_sessions SET received_bytes = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'active' AND received_bytes = ?
+        """,
+        (offset + length, upload_session['id'], offset)
+    ).rowcount
+    db.commit()
+    if not claimed:
+        # The client must resume from exactly what was received; report it so it can realign
+        return jsonify({**_upload_session_status(_get_upload_session(upload_id, current_user.id)),
+                        'success': False, 'message': 'Offset does not match the bytes received.'}), 409
+
+    written = 0
+    try:
+        with open(_resumable_upload_path(upload_session['id']), 'r+b') as chunk_file:
+            chunk_file.seek(offset)
+            # Bytes are written as they arrive, so a dropped connection keeps everything received so far
+            while written < length:
+                chunk = request.stream.read(min(UPLOAD_CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                chunk_file.write(chunk)
+                written += len(chunk)
+            chunk_file.truncate(offset + written)
+    finally:
+        if written != length:
+            # Give back the part of the claim that never arrived
+            db.execute(
+                "UPDATE upload_sessions SET received_bytes = ? WHERE id = ? AND received_bytes = ?",
+                (offset + written, upload_session['id'], offset + length)
+            )
+            db.commit()
+
+    return jsonify(_upload_session_status(_get_upload_session(upload_id, current_user.id)))
+
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def api_finalize_upload(upload_id):
+    upload_session = _get_upload_session(upload_id, current_user.id)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload not found.'}), 404
+    if upload_session['status'] == 'complete':
+        return jsonify({**_upload_session_status(upload_session), 'sha256': upload_session['sha256']})
+    if upload_session['received_bytes'] != upload_session['total_size']:
+        return jsonify({**_upload_session_status(upload_session),
+                        'success': False, 'message': 'Upload is incomplete.'}), 409
+    try:
+        bytes_on_disk = os.path.getsize(_resumable_upload_path(upload_session['id']))
+    except OSError:
+        bytes_on_disk = 0
+    if bytes_on_disk != upload_session['total_size']:
+        # A worker died mid-chunk after claiming it; have the client resume from what's on disk
+        db = get_db()
+        db.execute("UPDATE upload_sessions SET received_bytes = ? WHERE id = ?", (bytes_on_disk, upload_session['id']))
+        db.commit()
+        return jsonify({**_upload_session_status(_get_upload_session(upload_id, current_user.id)),
+                        'success': False, 'message': 'Upload is incomplete.'}), 409
+
+    digest, _ = hash_file(_resumable_upload_path(upload_session['id']))
+    expected = (request.get_json(silent=True) or {}).get('sha256')
+    if expected and expected.lower() != digest:
+        # The bytes on disk are corrupt; start over rather than letting the client resume
+        delete_upload_session(upload_session['id'])
+        return jsonify({'success': False, 'message': 'Checksum mismatch. Please upload the file again.'}), 422
+
+    db = get_db()
+    db.execute(
+        "UPDATE upload_sessions SET status = 'complete', sha256 = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (digest, upload_session['id'])
+    )
+    db.commit()
+    return jsonify({**_upload_session_status(_get_upload_session(upload_id, current_user.id)), 'sha256': digest})
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def api_cancel_upload(upload_id):
+    upload_session = _get_upload_session(upload_id, current_user.id)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload not found.'}), 404
+    delete_upload_session(upload_session['id'])
+    return jsonify({'success': True})
+
+
+# --- Media Serving ---
+# Uploads are served from /media/ instead of Flask's static route. Files whose name identifies
+# their content (the content-addressed store and its derivatives, and legacy uuid-named uploads)
+# never change under that name, so they get a strong ETag and a year-long immutable
+# Cache-Control. send_file answers Range requests with 206 and passes the file to the WSGI
+# server's file wrapper (sendfile under gunicorn). With MEDIA_X_ACCEL_PREFIX set, only headers
+# are returned along with X-Accel-Redirect, and a fronting nginx sends the bytes itself.
+MEDIA_ROOT = os.path.join(app.root_path, 'static', 'uploads')
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# nginx 'internal' location aliased to static/uploads, e.g. '/_media_internal/'
+MEDIA_X_ACCEL_PREFIX = os.getenv('MEDIA_X_ACCEL_PREFIX')
+
+_CONTENT_ADDRESSED_NAME_RE = re.compile(r'^[0-9a-f]{64}(\.[a-z]+)?\.[a-z0-9]+$')
+_UUID_UPLOAD_NAME_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_')
+
+
+def immutable_media_etag(filename):
+    """Returns a strong ETag for uploads whose name identifies their content, otherwise None."""
+    name = os.path.basename(filename)
+    if filename.startswith('media/') and _CONTENT_ADDRESSED_NAME_RE.match(name):
+        return name
+    if _UUID_UPLOAD_NAME_RE.match(name):
+        return name
+    return None
+
+
+@app.route('/media/<path:filename>')
+def media_file(filename):
+    # Plain 404s: the app-wide 404 handler redirects, which makes no sense for an <img> or <video>
+    name = os.path.basename(filename)
+    if name.startswith('.') or name.endswith('.part'):  # Uploads still being written
+        return '', 404
+    file_path = safe_join(MEDIA_ROOT, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        return '', 404
+
+    etag = immutable_media_etag(filename)
+    if MEDIA_X_ACCEL_PREFIX:
+        # nginx handles Range, conditional requests and its own ETag for the internal location
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = MEDIA_X_ACCEL_PREFIX.rstrip('/') + '/' + filename
+        response.headers['Content-Type'] = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    else:
+        response = send_file(file_path, conditional=True, etag=etag or True,
+                             max_age=MEDIA_IMMUTABLE_MAX_AGE if etag else None)
+
+    if etag:
+        response.cache_control.public = True
+        response.cache_control.max_age = MEDIA_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # May be replaced in place, so clients revalidate against the ETag each time
+        response.cache_control.no_cache = True
+    return response
+
+
+# --- Static Assets ---
+# At startup (and with 'flask assets build') every file under STATIC_ASSET_FOLDERS is copied into
+# ASSET_BUILD_FOLDER under a name carrying a hash of its content (css/style.<hash>.css), next to
+# gzip and, if the brotli module is installed, brotli versions made at maximum compression.
+# Templates link them with asset_url(), which takes the same arguments as url_for(). The
+# /assets/ route picks the smallest encoding the client accepts; since a changed file gets a new
+# name, responses are cacheable for a year. In debug mode asset_url() links the unbuilt file so
+# edits show up on reload.
+STATIC_ASSET_FOLDERS = ('css', 'js', 'img')
+STATIC_ASSET_COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.ico'}
+STATIC_ASSET_FINGERPRINT_LENGTH = 12
+
+_static_asset_manifest = {}  # {'css/style.css': 'css/style.<hash>.css'}
+_built_static_assets = set()
+
+
+def _write_static_asset(target_path, data):
+    if os.path.exists(target_path):
+        return
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    temp_path = f'{target_path}.{uuid.uuid4().hex}.part'  # Other workers may build at the same time
+    with open(temp_path, 'wb') as target:
+        target.write(data)
+    os.replace(temp_path, target_path)
+
+
+def build_static_assets():
+    """Writes the fingerprinted and precompressed copy of each static asset that doesn't have one
+    yet and loads the manifest asset_url() reads. Returns the number of assets."""
+    manifest = {}
+    build_folder = app.config['ASSET_BUILD_FOLDER']
+    for folder in STATIC_ASSET_FOLDERS:
+        for directory, _, names in os.walk(os.path.join(app.static_folder, folder)):
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                source_path = os.path.join(directory, name)
+                filename = os.path.relpath(source_path, app.static_folder).replace(os.sep, '/')
+                with open(source_path, 'rb') as source:
+                    data = source.read()
+                root, extension = os.path.splitext(filename)
+                digest = hashlib.sha256(data).hexdigest()[:STATIC_ASSET_FINGERPRINT_LENGTH]
+                built_name = f'{root}.{digest}{extension}'
+                target_path = os.path.join(build_folder, *built_name.split('/'))
+
+                _write_static_asset(target_path, data)
+                if extension.lower() in STATIC_ASSET_COMPRESSIBLE_EXTENSIONS:
+                    # Only kept when smaller; tiny files can grow
+                    if not os.path.exists(target_path + '.gz'):
+                        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                        if len(compressed) < len(data):
+                            _write_static_asset(target_path + '.gz', compressed)
+                    if brotli is not None and not os.path.exists(target_path + '.br'):
+                        compressed = brotli.compress(data, quality=11)
+                        if len(compressed) < len(data):
+                            _write_static_asset(target_path + '.br', compressed)
+                manifest[filename] = built_name
+
+    _static_asset_manifest.clear()
+    _static_asset_manifest.update(manifest)
+    _built_static_assets.clear()
+    _built_static_assets.update(manifest.values())
+    return len(manifest)
+
+
+def asset_url(endpoint, **values):
+    """url_for() that links static assets by their fingerprinted name."""
+    built_name = _static_asset_manifest.get(values.get('filename')) if endpoint == 'static' else None
+    if built_name is None or app.debug:
+        return url_for(endpoint, **values)
+    values['filename'] = built_name
+    return url_for('static_asset', **values)
+
+
+app.add_template_global(asset_url)
+
+
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    if filename not in _built_static_assets:
+        return '', 404
+    file_path = safe_join(app.config['ASSET_BUILD_FOLDER'], filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    content_encoding = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.exists(file_path + suffix):
+            content_encoding = encoding
+            file_path += suffix
+            break
+
+    response = send_file(file_path, mimetype=mimetype, conditional=True, max_age=MEDIA_IMMUTABLE_MAX_AGE)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+assets_cli = AppGroup('assets', help='Manage static assets.')
+app.cli.add_command(assets_cli)
+
+
+@assets_cli.command('build')
+def assets_build_command():
+    """Fingerprints and precompresses static assets."""
+    count = build_static_assets()
+    click.echo(f"Built {count} static assets into {app.config['ASSET_BUILD_FOLDER']}.")
+
+
+try:
+    build_static_assets()
+except OSError as e:  # Pages still render, linking the unbuilt files
+    app.logger.error(f"Error building static assets: {e}")
+
+
+# --- Response Compression ---
+# HTML and JSON responses (feed, inbox, search, the admin dashboard) are compressed on the way
+# out: brotli when the client accepts it and the module is installed, otherwise gzip. Bodies below
+# COMPRESSION_MIN_SIZE aren't worth it. Streamed responses are compressed chunk by chunk, flushing
+# after each so the client still receives every chunk as it is produced. File responses (uploads
+# on /media/, prebuilt /assets/) pass through untouched: media is already compressed and assets
+# carry their own encoding.
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))  # Bytes
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))  # 1-9
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))  # 0-11
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+    'application/json', 'application/xml', 'text/xml', 'image/svg+xml',
+}
+
+
+def _compress_chunks(original, encoding):
+    """Compresses a streamed body, flushing after each chunk."""
+    chunks = (chunk.encode() if isinstance(chunk, str) else chunk for chunk in original)
+    try:
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+            for chunk in chunks:
+                yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+    finally:
+        if hasattr(original, 'close'):  # e.g. stream_with_context generators
+            original.close()
+
+
+@app.after_request
+def compress_response(response):
+    if (
+        response.direct_passthrough  # send_file
+        or response.status_code < 200 or response.status_code in (204, 206, 304)
+        or 'Content-Encoding' in response.headers
+        or request.path.startswith('/static/uploads/')
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if brotli is not None and request.accept_encodings['br']:
+        encoding = 'br'
+    elif request.accept_encodings['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_SIZE:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0))
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:  # The compressed body is a different representation
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+
+# --- Orphaned Media Collection ---
+# Mark and sweep over static/uploads, run with 'flask media gc'. Rows deleted without releasing
+# their media (user and group deletion, replaced profile photos) leave files that nothing points
+# at any more. Expired stories are deleted first, releasing their media, so no row is left
+# pointing at a file the sweep removes. The mark phase reads every MEDIA_REFERENCE_COLUMNS column
+# (a cursor, never a fetchall); the sweep walks the upload tree lazily and removes, or moves into
+# MEDIA_QUARANTINE_FOLDER, files that are unreferenced and older than the grace period. Image
+# variants and video posters live and die with the upload they were made from.
+MEDIA_GC_GRACE_HOURS = 24  # Covers uploads whose row isn't committed yet
+MEDIA_GC_REPORT_LIMIT = 50  # Paths listed in the report; the counts always cover everything
+MEDIA_GC_EXTENSIONS = (
+    ALLOWED_IMAGE_EXTENSIONS | ALLOWED_VIDEO_EXTENSIONS | ALLOWED_AUDIO_EXTENSIONS | {'webp'}
+)
+
+_STORED_MEDIA_NAME_RE = re.compile(r'^([0-9a-f]{64})\.')
+
+
+def _stored_media_owner(stored_path):
+    """Returns 'static/uploads/media/ab/cd/<sha256>' for a stored file or anything derived from it
+    (variants, posters, their .part files), otherwise None."""
+    if not is_stored_media(stored_path):
+        return None
+    directory, name = stored_path.rsplit('/', 1)
+    match = _STORED_MEDIA_NAME_RE.match(name)
+    return f'{directory}/{match.group(1)}' if match else None
+
+
+def _mark_referenced_media(db):
+    """Returns (referenced paths, referenced stored media owners)."""
+    selects = []
+    for table, column in MEDIA_REFERENCE_COLUMNS:
+        if not (_table_exists(db, table) and _column_exists(db, table, column)):
+            continue
+        selects.append(f"SELECT {column} AS path FROM {table} WHERE {column} LIKE 'static/uploads/%'")
+
+    referenced_paths, referenced_owners = set(), set()
+    for row in db.execute(' UNION '.join(selects)):
+        referenced_paths.add(row['path'])
+        owner = _stored_media_owner(row['path'])
+        if owner:
+            referenced_owners.add(owner)
+    return referenced_paths, referenced_owners
+
+
+def purge_expired_stories(db, dry_run=False):
+    """Deletes stories that have expired, which are never shown again, and releases their media.
+    Returns the number of expired stories; with dry_run nothing is touched."""
+    expired = db.execute(
+        "SELECT id, media_path, background_audio_path FROM stories WHERE expires_at <= ?",
+        (datetime.now(timezone.utc),)
+    ).fetchall()
+    if dry_run or not expired:
+        return len(expired)
+    db.executemany("DELETE FROM stories WHERE id = ?", [(row['id'],) for row in expired])
+    released = [
+        release_stored_media(stored_path, db)
+        for row in expired
+        for stored_path in (row['media_path'], row['background_audio_path'])
+        if stored_path
+    ]
+    db.commit()
+    remove_released_media(released, db)
+    return len(expired)
+
+
+def _walk_upload_files(directory, stored_prefix):
+    """Yields (stored path, os.DirEntry) for every file below directory, one directory at a time."""
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            stored_path = f'{stored_prefix}/{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_upload_files(entry.path, stored_path)
+            elif entry.is_file(follow_symlinks=False):
+                yield stored_path, entry
+
+
+def _is_collectable_upload(stored_path):
+    """Leaves alone files that were never uploads (e.g. the placeholder pages in each folder)."""
+    name = stored_path.rsplit('/', 1)[-1]
+    if is_stored_media(stored_path):
+        return name.startswith('.incoming-') or _STORED_MEDIA_NAME_RE.match(name) is not None
+    return name.rsplit('.', 1)[-1].lower() in MEDIA_GC_EXTENSIONS
+
+
+def collect_orphaned_media(grace_hours=MEDIA_GC_GRACE_HOURS, dry_run=True, quarantine=False):
+    """Deletes (or quarantines) uploads that no row references and that haven't been written for
+    grace_hours. Returns a report dict; with dry_run nothing is touched.
+
+    media_blobs rows for collected files are dropped in the same transaction, holding the write
+    lock that store_media_file() takes first, so a concurrent upload of the same content either
+    refreshed the file's mtime before the check or places a fresh copy afterwards.
+    """
+    db = get_db()
+    expired_stories = purge_expired_stories(db, dry_run=dry_run)
+    referenced_paths, referenced_owners = _mark_referenced_media(db)
+    cutoff = time.time() - grace_hours * 3600
+    quarantine_root = os.path.join(
+        app.config['MEDIA_QUARANTINE_FOLDER'], datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    )
+    report = {
+        'dry_run': dry_run,
+        'action': 'quarantine' if quarantine else 'delete',
+        'expired_stories': expired_stories,
+        'scanned_files': 0,
+        'orphaned_files': 0,
+        'orphaned_bytes': 0,
+        'skipped_recent': 0,
+        'failed': 0,
+        'paths': []
+    }
+
+    upload_root = app.config['UPLOAD_FOLDER'].replace(os.sep, '/')
+    for stored_path, entry in _walk_upload_files(static_path_filesystem(upload_root), upload_root):
+        if not _is_collectable_upload(stored_path):
+            continue
+        report['scanned_files'] += 1
+        owner = _stored_media_owner(stored_path)
+        if stored_path in referenced_paths or (owner and owner in referenced_owners):
+            continue
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue  # Removed since the directory was listed
+        if stat.st_mtime > cutoff:
+            report['skipped_recent'] += 1
+            continue
+
+        if not dry_run:
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                if os.path.getmtime(entry.path) > cutoff:  # Re-uploaded while we were sweeping
+                    db.rollback()
+                    report['skipped_recent'] += 1
+                    continue
+                db.execute("DELETE FROM media_blobs WHERE path = ?", (stored_path,))
+                if quarantine:
+                    target_path = os.path.join(quarantine_root, *stored_path.split('/'))
+                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    shutil.move(entry.path, target_path)
+                else:
+                    os.remove(entry.path)
+                db.commit()
+            except OSError as e:
+                db.rollback()
+                report['failed'] += 1
+                app.logger.error(f"Error collecting orphaned media {stored_path}: {e}")
+                continue
+
+        report['orphaned_files'] += 1
+        report['orphaned_bytes'] += stat.st_size
+        if len(report['paths']) < MEDIA_GC_REPORT_LIMIT:
+            report['paths'].append(stored_path)
+
+    if not dry_run:
+        app.logger.info(
+            f"Orphaned media collection: {report['orphaned_files']} files "
+            f"({report['orphaned_bytes']} bytes) {report['action']}d"
+        )
+    return report
+
+
+media_cli = AppGroup('media', help='Manage uploaded media.')
+app.cli.add_command(media_cli)
+
+
+@media_cli.command('gc')
+@click.option('--grace-hours', default=MEDIA_GC_GRACE_HOURS, show_default=True, type=click.IntRange(min=0),
+              help='Only collect files last written longer ago than this.')
+@click.option('--dry-run', is_flag=True, help='Report what would be collected without touching anything.')
+@click.option('--quarantine', is_flag=True,
+              help="Move files into MEDIA_QUARANTINE_FOLDER instead of deleting them.")
+def media_gc_command(grace_hours, dry_run, quarantine):
+    """Collects uploaded files that nothing references any more."""
+    report = collect_orphaned_media(grace_hours=grace_hours, dry_run=dry_run, quarantine=quarantine)
+    verb = f"would be {report['action']}d" if dry_run else f"{report['action']}d"
+    if report['expired_stories']:
+        click.echo(f"{report['expired_stories']} expired stories {'would be ' if dry_run else ''}deleted.")
+    click.echo(f"Scanned {report['scanned_files']} uploaded files.")
+    click.echo(f"{report['orphaned_files']} orphaned files ({report['orphaned_bytes']} bytes) {verb}.")
+    if report['skipped_recent']:
+        click.echo(f"{report['skipped_recent']} unreferenced files are inside the {grace_hours}h grace period.")
+    if report['failed']:
+        click.echo(f"{report['failed']} files could not be collected; see the log.")
+    for stored_path in report['paths']:
+        click.echo(f"  {stored_path}")
+    if report['orphaned_files'] > len(report['paths']):
+        click.echo(f"  ... and {report['orphaned_files'] - len(report['paths'])} more")
+
+
+def enqueue_missing_image_variants():
+    """Queues image_variants for every stored image missing a variant. Returns the number queued."""
+    db = get_db()
+    queued = 0
+    for row in db.execute("SELECT path FROM media_blobs WHERE path LIKE ?", (MEDIA_STORE_PATH + '/%',)).fetchall():
+        stored_path = row['path']
+        if not supports_image_variants(stored_path):
+            continue
+        if all(os.path.exists(static_path_filesystem(image_variant_path(stored_path, size_class)))
+               for size_class in IMAGE_VARIANT_SIZES):
+            continue
+        if enqueue_image_variants(stored_path):
+            queued += 1
+    db.commit()
+    return queued
+
+
+@media_cli.command('variants')
+def media_variants_command():
+    """Queues image variants for stored images that are missing any."""
+    queued = enqueue_missing_image_variants()
+    click.echo(f"Queued image variants for {queued} stored images.")
+
+
+def enqueue_unprobed_videos():
+    """Queues video_metadata for every stored video never probed. Returns the number queued."""
+    db = get_db()
+    queued = 0
+    for row in db.execute(
+        "SELECT path FROM media_blobs WHERE path LIKE ? AND probed_at IS NULL", (MEDIA_STORE_PATH + '/%',)
+    ).fetchall():
+        if supports_video_metadata(row['path']) and enqueue_media_job('video_metadata', row['path']):
+            queued += 1
+    db.commit()
+    return queued
+
+
+@media_cli.command('probe')
+def media_probe_command():
+    """Queues metadata extraction for stored videos that were never probed."""
+    if FFPROBE_BIN is None:
+        click.echo("ffprobe isn't installed; videos are served without metadata.")
+        return
+    queued = enqueue_unprobed_videos()
+    click.echo(f"Queued metadata extraction for {queued} stored videos.")
+
+
 # --- Content Creation Routes ---
 
 @app.route('/add_to')
@@ -2538,22 +5074,21 @@ def create_post():
         if not os.path.exists(posts_folder):
             os.makedirs(posts_folder)
 
-        if 'mediaFile' in request.files:  # Changed from media_file to mediaFile to match HTML form
-            file = request.files['mediaFile']
-            if file and file.filename != '':
-                # Using the save_uploaded_file helper for consistency
-                media_path = save_uploaded_file(file, app.config['POSTS_FOLDER'])
-                if media_path:
-                    # Determine media_type based on file extension
-                    file_extension = file.filename.rsplit('.', 1)[1].lower()
-                    if file_extension in ALLOWED_IMAGE_EXTENSIONS:
-                        media_type = 'image'
-                    elif file_extension in ALLOWED_VIDEO_EXTENSIONS:
-                        media_type = 'video'
-                    # No else for audio, as posts typically don't directly embed audio for main media
-                else:
-                    flash('Invalid media file type.', 'danger')
-                    return render_template('create_post.html', title='Create Post', current_year=current_year)
+        file = request_media_file('mediaFile')  # Changed from media_file to mediaFile to match HTML form
+        if file and file.filename != '':
+            # Using the save_uploaded_file helper for consistency
+            media_path = save_uploaded_file(file)
+            if media_path:
+                # Determine media_type based on file extension
+                file_extension = file.filename.rsplit('.', 1)[1].lower()
+                if file_extension in ALLOWED_IMAGE_EXTENSIONS:
+                    media_type = 'image'
+                elif file_extension in ALLOWED_VIDEO_EXTENSIONS:
+                    media_type = 'video'
+                # No else for audio, as posts typically don't directly embed audio for main media
+            else:
+                flash('Invalid media file type.', 'danger')
+                return render_template('create_post.html', title='Create Post', current_year=current_year)
             
         if not post_content and not media_path:
             flash('Post cannot be empty. Please add text or media.', 'danger')
@@ -2593,15 +5128,15 @@ def create_reel():
         description = request.form.get('description', '').strip()
         # Visibility is fixed to public for reels as per requirements
         visibility = 'public'
-        media_file = request.files.get('mediaFile')
-        audio_file = request.files.get('audioFile')  # For photo reels
+        media_file = request_media_file('mediaFile')
+        audio_file = request_media_file('audioFile')  # For photo reels
 
         media_path = None
         media_type = None
         audio_path = None
 
         if media_file and media_file.filename != '':
-            media_path = save_uploaded_file(media_file, app.config['REEL_MEDIA_FOLDER'])
+            media_path = save_uploaded_file(media_file)
             if media_path:
                 if media_file.filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS:
                     media_type = 'image'
@@ -2615,13 +5150,14 @@ def create_reel():
             return render_template('create_reel.html', form_data=request.form.to_dict(), current_year=current_year)
 
         # If it's an image reel, handle optional audio
+        db = get_db()
         if media_type == 'image' and audio_file and audio_file.filename != '':
-            audio_path = save_uploaded_file(audio_file, app.config['VOICE_NOTES_FOLDER'])  # Reusing folder
+            audio_path = save_uploaded_file(audio_file)
             if not audio_path:
+                db.rollback()  # Drops the reference save_uploaded_file() took to the reel's media
                 flash('Invalid audio file type for reel.', 'danger')
                 return render_template('create_reel.html', form_data=request.form.to_dict(), current_year=current_year)
 
-        db = get_db()
         try:
             db.execute(
                 """
@@ -2634,56 +5170,343 @@ def create_reel():
             flash('Reel created successfully!', 'success')
             return redirect(url_for('home'))  # Redirect to reels feed
         except Exception as e:
-            flash(f'An error occurred while creating your reel: {e}', 'danger')
-            db.rollback()
-            return render_template('create_reel.html', form_data=request.form.to_dict(), current_year=current_year)
+            flash(f'An error occurred while creating your reel: {e}', 'danger')
+            db.rollback()
+            return render_template('create_reel.html', form_data=request.form.to_dict(), current_year=current_year)
+
+    return render_template('create_reel.html', current_year=current_year)
+
+
+# --- Reels Feed ---
+REELS_PAGE_SIZE = 8
+REELS_MAX_PAGE_SIZE = 30
+# Ranked mode scores only the most recent reels visible to the viewer, which keeps the cost of a
+# page bounded no matter how many reels exist. Older reels are still reachable in 'recent' mode.
+REELS_RANKING_POOL_SIZE = 500
+REELS_RANKING_GRAVITY = 1.5  # How quickly older reels sink in the ranked feed
+REELS_RANKING_SNAPSHOT_TTL_HOURS = 6  # Ranked cursors older than this start a fresh ranking
+# Number of upcoming reels described in the prefetch manifest; the client warms their videos from
+# it, and the reels page preloads their posters via a Link header
+REELS_PREFETCH_COUNT = 3
+
+REELS_VISIBILITY_CONDITION = """
+    (r.visibility = 'public' OR (r.visibility = 'friends' AND EXISTS (
+        SELECT 1 FROM friendships WHERE ((user1_id = ? AND user2_id = r.user_id) OR (user1_id = r.user_id AND user2_id = ?)) AND status = 'accepted'
+    )))
+"""
+
+REELS_SELECT = f"""
+    SELECT r.*, u.username, m.profilePhoto AS owner_profile_pic, u.originalName AS owner_original_name,
+           {VIDEO_METADATA_COLUMNS}
+    FROM reels r
+    JOIN users u ON r.user_id = u.id
+    LEFT JOIN members m ON u.id = m.user_id
+    LEFT JOIN media_blobs mb ON mb.path = r.media_path
+"""
+
+
+def encode_cursor(state):
+    """Encodes pagination state as an opaque, URL-safe cursor string."""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    if not cursor:
+        return {}
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return state if isinstance(state, dict) else {}
+    except (ValueError, UnicodeDecodeError):
+        return {}
+
+
+def get_followed_user_ids(follower_id, user_ids):
+    """Returns which of user_ids the follower follows, using a single query for the whole batch."""
+    user_ids = list({uid for uid in user_ids if uid != follower_id})
+    if not user_ids:
+        return set()
+    placeholders = ','.join('?' * len(user_ids))
+    rows = get_db().execute(
+        f"SELECT user2_id FROM friendships WHERE user1_id = ? AND status = 'accepted' AND user2_id IN ({placeholders})",
+        (follower_id, *user_ids)
+    ).fetchall()
+    return {row['user2_id'] for row in rows}
+
+
+def _parse_utc_timestamp(value):
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def reel_rank_score(reel, now_utc):
+    """Engagement-weighted score that decays with age, so fresh reels with traction rise to the top."""
+    age_hours = max((now_utc - _parse_utc_timestamp(reel['timestamp'])).total_seconds() / 3600, 0) if reel['timestamp'] else 0
+    engagement = 1 + (reel['likes_count'] or 0) * 2 + (reel['comments_count'] or 0) * 3 + (reel['views_count'] or 0) * 0.05
+    return engagement / ((age_hours + 2) ** REELS_RANKING_GRAVITY)
+
+
+def serialize_reel(reel_row, followed_ids):
+    reel_dict = dict(reel_row)
+    reel_dict.update(take_video_metadata(reel_dict, reel_dict['media_path']))
+    reel_dict['owner_profile_pic'] = profile_pic_url(reel_dict['owner_profile_pic'])
+    reel_dict['media_path'] = static_path_url(reel_dict['media_path'])
+    reel_dict['audio_path'] = static_path_url(reel_dict['audio_path'])
+    reel_dict['is_following_poster'] = reel_dict['user_id'] in followed_ids
+    if reel_dict['timestamp']:
+        reel_dict['timestamp'] = datetime.fromisoformat(reel_dict['timestamp']).isoformat()
+    return reel_dict
+
+
+def build_reel_prefetch_manifest(reel_rows, count=REELS_PREFETCH_COUNT):
+    """Describes the media of the next reels so the client can start downloading them early."""
+    manifest = []
+    for reel in reel_rows[:count]:
+        try:
+            size = os.path.getsize(static_path_filesystem(reel['media_path']))
+        except OSError:
+            size = None  # Missing file: still listed so the client falls back to normal loading
+        content_type = mimetypes.guess_type(reel['media_path'])[0]
+        if not content_type:
+            content_type = 'image/jpeg' if reel['media_type'] == 'image' else 'video/mp4'
+        media_url = static_path_url(reel['media_path'])
+        manifest.append({
+            'reel_id': reel['id'],
+            'url': media_url,
+            'content_type': content_type,
+            'size': size,
+            'poster': media_url if reel['media_type'] == 'image' else static_path_url(reel['video_poster_path'])
+        })
+    return manifest
+
+
+def reel_preload_link_header(manifest):
+    """Builds a Link header value with rel=preload hints for the images (photo reels and video
+    posters) of a prefetch manifest. Browsers don't support preloading as=video."""
+    links = []
+    for entry in manifest:
+        if entry['size'] is None or not entry['poster']:
+            continue
+        links.append(f'<{entry["poster"]}>; rel=preload; as=image')
+    return ', '.join(links)
+
+
+def fetch_reels_page(viewer_id, mode='recent', cursor=None, limit=REELS_PAGE_SIZE):
+    """Returns one page of the reels feed as {'reels', 'has_more', 'next_cursor', 'prefetch'}.
+
+    'recent' pages by reel id (newest first). 'ranked' scores the newest REELS_RANKING_POOL_SIZE
+    visible reels once, on the first page, and keeps the resulting order in reel_rank_snapshots;
+    later pages are read from that order by position, so changing counts and reels posted while
+    scrolling can't skip or repeat a reel. A cursor whose snapshot has expired starts over.
+    """
+    db = get_db()
+    state = decode_cursor(cursor)
+
+    if mode == 'ranked':
+        snapshot_id = state.get('snapshot') if isinstance(state.get('snapshot'), str) else None
+        offset = state.get('offset') if isinstance(state.get('offset'), int) and state['offset'] > 0 else 0
+        snapshot = db.execute(
+            "SELECT reel_ids FROM reel_rank_snapshots WHERE id = ? AND viewer_id = ?", (snapshot_id, viewer_id)
+        ).fetchone() if snapshot_id else None
+        if snapshot:
+            reel_ids = json.loads(snapshot['reel_ids'])
+            page_ids = reel_ids[offset:offset + limit]
+            # Reels deleted or made private since the snapshot was taken are left out
+            rows_by_id = {row['id']: row for row in db.execute(
+                f"{REELS_SELECT} WHERE r.id IN ({','.join('?' * len(page_ids))}) AND {REELS_VISIBILITY_CONDITION}",
+                (*page_ids, viewer_id, viewer_id)
+            ).fetchall()} if page_ids else {}
+            rows = [rows_by_id[reel_id] for reel_id in page_ids if reel_id in rows_by_id]
+            has_more = offset + limit < len(reel_ids)
+            next_state = {'snapshot': snapshot_id, 'offset': offset + limit}
+        else:
+            pool = db.execute(
+                f"{REELS_SELECT} WHERE {REELS_VISIBILITY_CONDITION} ORDER BY r.id DESC LIMIT ?",
+                (viewer_id, viewer_id, REELS_RANKING_POOL_SIZE)
+            ).fetchall()
+            now_utc = datetime.now(timezone.utc)
+            ranked = sorted(pool, key=lambda reel: (reel_rank_score(reel, now_utc), reel['id']), reverse=True)
+            rows = ranked[:limit]
+            has_more = len(ranked) > limit
+            next_state = {}
+            if has_more:
+                snapshot_id = uuid.uuid4().hex
+                db.execute(
+                    "DELETE FROM reel_rank_snapshots WHERE created_at < datetime('now', ?)",
+                    (f'-{REELS_RANKING_SNAPSHOT_TTL_HOURS} hours',)
+                )
+                db.execute(
+                    "INSERT INTO reel_rank_snapshots (id, viewer_id, reel_ids) VALUES (?, ?, ?)",
+                    (snapshot_id, viewer_id, json.dumps([reel['id'] for reel in ranked]))
+                )
+                db.commit()
+                next_state = {'snapshot': snapshot_id, 'offset': limit}
+    else:
+        before_id = state.get('before') if isinstance(state.get('before'), int) else None
+        before_condition = "AND r.id < ?" if before_id else ""
+        params = [viewer_id, viewer_id] + ([before_id] if before_id else []) + [limit + 1]
+        rows = db.execute(
+            f"{REELS_SELECT} WHERE {REELS_VISIBILITY_CONDITION} {before_condition} ORDER BY r.id DESC LIMIT ?",
+            params
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_state = {'before': rows[-1]['id']} if rows else {}
+
+    followed_ids = get_followed_user_ids(viewer_id, [row['user_id'] for row in rows])
+    return {
+        'reels': [serialize_reel(row, followed_ids) for row in rows],
+        'has_more': has_more,
+        'next_cursor': encode_cursor(next_state) if has_more else None,
+        'prefetch': build_reel_prefetch_manifest(rows)
+    }
+
+
+@app.route('/reels')  # This is now exclusively for viewing reels
+@login_required
+def reels():
+    mode = request.args.get('mode', 'ranked')
+    if mode not in ('recent', 'ranked'):
+        mode = 'ranked'
+    # Only the first page is rendered here; the page fetches the rest from /api/reels while scrolling
+    first_page = fetch_reels_page(current_user.id, mode=mode)
+
+    # Pass the current year to the template
+    current_year = datetime.now(timezone.utc).year
+    response = make_response(render_template(
+        'reels.html',
+        reels=first_page['reels'],
+        reels_mode=mode,
+        next_cursor=first_page['next_cursor'],
+        current_year=current_year
+    ))
+    link_header = reel_preload_link_header(first_page['prefetch'])
+    if link_header:
+        response.headers['Link'] = link_header
+    return response
+
+
+@app.route('/api/reels', methods=['GET'])
+@login_required
+def api_get_reels():
+    mode = request.args.get('mode', 'ranked')
+    if mode not in ('recent', 'ranked'):
+        return jsonify({'success': False, 'message': 'Invalid reels mode.'}), 400
+    limit = request.args.get('limit', REELS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, REELS_MAX_PAGE_SIZE))
+
+    page = fetch_reels_page(current_user.id, mode=mode, cursor=request.args.get('cursor'), limit=limit)
+    # Link headers on fetch() responses aren't acted on; the client warms media from 'prefetch'
+    return jsonify({'success': True, 'mode': mode, **page})
+
+
+# --- Reel View Counting ---
+# Views are buffered in memory and written in a single transaction every few seconds rather than
+# one UPDATE per swipe. A view counts once per (viewer, reel, window): duplicates are collapsed in
+# the buffer, and each flushed key is also recorded in reel_views, so replays after a worker
+# restart (or the same viewer hitting another worker) are ignored by the database.
+REEL_VIEW_WINDOW_SECONDS = 6 * 60 * 60
+REEL_VIEW_FLUSH_INTERVAL_SECONDS = 5
+REEL_VIEW_MAX_BATCH = 50  # Max reel ids accepted per request
+REEL_VIEW_RETENTION_WINDOWS = 2  # reel_views rows older than this many windows are pruned on flush
+
+_pending_reel_views = set()  # {(viewer_id, reel_id, view_window)}
+_pending_reel_views_lock = threading.Lock()
+_reel_view_flusher = None
+_reel_view_flusher_lock = threading.Lock()
+
+
+def current_reel_view_window():
+    return int(time.time() // REEL_VIEW_WINDOW_SECONDS)
+
+
+def buffer_reel_views(viewer_id, reel_ids):
+    view_window = current_reel_view_window()
+    with _pending_reel_views_lock:
+        _pending_reel_views.update((viewer_id, reel_id, view_window) for reel_id in reel_ids)
+    _ensure_reel_view_flusher()
+
+
+def flush_reel_views():
+    """Writes buffered views to the database in one transaction. Returns the number of views counted."""
+    with _pending_reel_views_lock:
+        if not _pending_reel_views:
+            return 0
+        batch = list(_pending_reel_views)
+        _pending_reel_views.clear()
+
+    # Runs outside of a request (background thread / exit hook), so it can't use get_db()
+    db = sqlite3.connect(DATABASE, timeout=10)
+    try:
+        increments = {}
+        for viewer_id, reel_id, view_window in batch:
+            # Owners watching their own reels don't count, nor do reels that have since been deleted
+            cursor = db.execute(
+                """
+                INSERT OR IGNORE INTO reel_views (reel_id, viewer_id, view_window)
+                SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM reels WHERE id = ? AND user_id != ?)
+                """,
+                (reel_id, viewer_id, view_window, reel_id, viewer_id)
+            )
+            if cursor.rowcount:
+                increments[reel_id] = increments.get(reel_id, 0) + 1
+        db.executemany(
+            "UPDATE reels SET views_count = COALESCE(views_count, 0) + ? WHERE id = ?",
+            [(count, reel_id) for reel_id, count in increments.items()]
+        )
+        db.execute(
+            "DELETE FROM reel_views WHERE view_window < ?",
+            (current_reel_view_window() - REEL_VIEW_RETENTION_WINDOWS,)
+        )
+        db.commit()
+        return sum(increments.values())
+    except sqlite3.Error as e:
+        db.rollback()
+        # Nothing was written, so put the batch back for the next flush
+        with _pending_reel_views_lock:
+            _pending_reel_views.update(batch)
+        app.logger.error(f"Error flushing {len(batch)} buffered reel views: {e}")
+        return 0
+    finally:
+        db.close()
+
+
+def _reel_view_flush_loop():
+    while True:
+        time.sleep(REEL_VIEW_FLUSH_INTERVAL_SECONDS)
+        try:
+            flush_reel_views()
+        except Exception as e:
+            app.logger.error(f"Reel view flusher error: {e}")
 
-    return render_template('create_reel.html', current_year=current_year)
 
+def _ensure_reel_view_flusher():
+    # Started lazily on the first buffered view so CLI commands and the reloader's parent
+    # process don't spawn a flusher thread.
+    global _reel_view_flusher
+    with _reel_view_flusher_lock:
+        if _reel_view_flusher is None or not _reel_view_flusher.is_alive():
+            _reel_view_flusher = threading.Thread(target=_reel_view_flush_loop, name='reel-view-flusher', daemon=True)
+            _reel_view_flusher.start()
 
-@app.route('/reels')  # This is now exclusively for viewing reels
-@login_required
-def reels():
-    db = get_db()
-    
-    all_reels_data = db.execute(
-        """
-        SELECT r.*, u.username, m.profilePhoto AS owner_profile_pic, u.originalName AS owner_original_name
-        FROM reels r
-        JOIN users u ON r.user_id = u.id
-        LEFT JOIN members m ON u.id = m.user_id
-        WHERE r.visibility = 'public' OR (r.visibility = 'friends' AND EXISTS (
-            SELECT 1 FROM friendships WHERE ((user1_id = ? AND user2_id = r.user_id) OR (user1_id = r.user_id AND user2_id = ?)) AND status = 'accepted'
-        ))
-        ORDER BY r.timestamp DESC
-        """,
-        (current_user.id, current_user.id)
-    ).fetchall()
 
-    reels_to_display = []
-    for reel_item in all_reels_data:
-        reel_dict = dict(reel_item)
-        reel_dict['owner_profile_pic'] = get_member_profile_pic(reel_dict['user_id'])
-        
-        # Determine if current_user is following the reel's poster
-        is_following_poster = False
-        if current_user.id != reel_dict['user_id']:  # Cannot follow yourself
-            friendship_status = db.execute(
-                """
-                SELECT status FROM friendships
-                WHERE (user1_id = ? AND user2_id = ?)
-                """,
-                (current_user.id, reel_dict['user_id'])
-            ).fetchone()
-            if friendship_status and friendship_status['status'] == 'accepted':
-                is_following_poster = True
-        
-        reel_dict['is_following_poster'] = is_following_poster
-        reels_to_display.append(reel_dict)
+# Flush whatever is still buffered on a clean shutdown
+atexit.register(flush_reel_views)
 
-    # Pass the current year to the template
-    current_year = datetime.now(timezone.utc).year
-    return render_template('reels.html', reels=reels_to_display, current_year=current_year)
+
+@app.route('/api/reels/views', methods=['POST'])
+@login_required
+def api_record_reel_views():
+    data = request.get_json(silent=True) or {}
+    reel_ids = data.get('reel_ids')
+    if not isinstance(reel_ids, list) or not reel_ids:
+        return jsonify({'success': False, 'message': 'reel_ids must be a non-empty list.'}), 400
+
+    reel_ids = {
+        reel_id for reel_id in reel_ids[:REEL_VIEW_MAX_BATCH]
+        if isinstance(reel_id, int) and not isinstance(reel_id, bool) and reel_id > 0
+    }
+    buffer_reel_views(current_user.id, reel_ids)
+    return jsonify({'success': True, 'accepted': len(reel_ids)}), 202
 
 
 @app.route('/create_story', methods=['GET', 'POST'])
@@ -2698,15 +5521,16 @@ def create_story():
         media_type = None
         background_audio_path = None # Initialize to None.
 
-        file = request.files.get('file')
-        audio_file = request.files.get('audioFile')
+        file = request_media_file('file')
+        audio_file = request_media_file('audioFile')
 
         # First check if the main media file exists and has a filename
         if not file or file.filename == '':
             return jsonify({'success': False, 'message': 'Story requires a photo, video, or voice note.'}), 400
 
         # Save the main media file
-        media_path = save_uploaded_file(file, app.config['STORY_MEDIA_FOLDER'])
+        db = get_db()
+        media_path = save_uploaded_file(file)
         if not media_path:
             return jsonify({'success': False, 'message': 'Invalid uploaded media file type for story.'}), 400
 
@@ -2719,15 +5543,16 @@ def create_story():
         elif file_extension in ALLOWED_AUDIO_EXTENSIONS:
             media_type = 'audio'
         else:
+            db.rollback()  # Drops the reference save_uploaded_file() took to the file
             return jsonify({'success': False, 'message': 'Unsupported media type for story.'}), 400
         
         # If it's an image story, handle optional background audio
         if media_type == 'image' and audio_file and audio_file.filename != '':
-            background_audio_path = save_uploaded_file(audio_file, app.config['VOICE_NOTES_FOLDER'])
+            background_audio_path = save_uploaded_file(audio_file)
             if not background_audio_path:
+                db.rollback()  # Drops the reference save_uploaded_file() took to the story's media
                 return jsonify({'success': False, 'message': 'Invalid background audio file type for story.'}), 400
 
-        db = get_db()
         try:
             now_utc = datetime.now(timezone.utc)
             expires_at = now_utc + timedelta(hours=24)
@@ -2831,7 +5656,7 @@ def api_dynamic_search():
             post_dict = dict(post_data)
             post_dict['profilePhoto'] = get_member_profile_pic(post_dict['user_id'])
             if post_dict['media_path']:
-                post_dict['media_path'] = url_for('static', filename=post_dict['media_path'][len('static/'):])
+                post_dict['media_path'] = media_variant_url(post_dict['media_path'], 'card')
             return post_dict
         return None
 
@@ -2848,7 +5673,7 @@ def api_dynamic_search():
             reel_dict = dict(reel_data)
             reel_dict['profilePhoto'] = get_member_profile_pic(reel_dict['user_id'])
             if reel_dict['media_path']:
-                reel_dict['media_path'] = url_for('static', filename=reel_dict['media_path'][len('static/'):])
+                reel_dict['media_path'] = media_variant_url(reel_dict['media_path'], 'card')
             return reel_dict
         return None
 
@@ -3047,22 +5872,30 @@ def api_join_group_from_search(group_id):
 @login_required
 def api_get_single_post(post_id):
     db = get_db()
+    etag = content_version_tag('post', ('posts', 'users', 'members', 'friendships'), current_user.id, post_id)
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        return not_modified
+
     post_data = db.execute(
         """
-        SELECT p.id, p.user_id, p.description, p.media_path, p.media_type, p.timestamp, u.username, u.originalName
-        FROM posts p JOIN users u ON p.user_id = u.id
-        WHERE p.id = ?
+        SELECT p.id, p.user_id, p.description, p.media_path, p.media_type, p.visibility, p.timestamp,
+               p.reposts_count, u.username, u.originalName
+        FROM posts r
+        JOIN posts p ON p.id = COALESCE(r.original_post_id, r.id)
+        JOIN users u ON p.user_id = u.id
+        WHERE r.id = ?
         """,
         (post_id,)
     ).fetchone()
 
-    if post_data:
+    if post_data and can_view_post(post_data, current_user.id):
         post_dict = dict(post_data)
         post_dict['profile_pic'] = get_member_profile_pic(post_dict['user_id'])
         if post_dict['media_path']:
-            post_dict['media_path'] = url_for('static', filename=post_dict['media_path'][len('static/'):])
+            post_dict['media_path'] = static_path_url(post_dict['media_path'])
         post_dict['timestamp'] = datetime.fromisoformat(post_dict['timestamp']).isoformat() # Ensure ISO format
-        return jsonify({'success': True, 'post': post_dict})
+        return tagged_response(jsonify({'success': True, 'post': post_dict}), etag)
     return jsonify({'success': False, 'message': 'Post not found.'}), 404
 
 
@@ -3070,6 +5903,11 @@ def api_get_single_post(post_id):
 @login_required
 def api_get_single_reel(reel_id):
     db = get_db()
+    etag = content_version_tag('reel', ('reels', 'users', 'members'), reel_id)
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        return not_modified
+
     reel_data = db.execute(
         """
         SELECT r.id, r.user_id, r.description, r.media_path, r.media_type, r.audio_path, r.timestamp, u.username, u.originalName
@@ -3083,11 +5921,11 @@ def api_get_single_reel(reel_id):
         reel_dict = dict(reel_data)
         reel_dict['profile_pic'] = get_member_profile_pic(reel_dict['user_id'])
         if reel_dict['media_path']:
-            reel_dict['media_path'] = url_for('static', filename=reel_dict['media_path'][len('static/'):])
+            reel_dict['media_path'] = static_path_url(reel_dict['media_path'])
         if reel_dict['audio_path']:
-            reel_dict['audio_path'] = url_for('static', filename=reel_dict['audio_path'][len('static/'):])
+            reel_dict['audio_path'] = static_path_url(reel_dict['audio_path'])
         reel_dict['timestamp'] = datetime.fromisoformat(reel_dict['timestamp']).isoformat() # Ensure ISO format
-        return jsonify({'success': True, 'reel': reel_dict})
+        return tagged_response(jsonify({'success': True, 'reel': reel_dict}), etag)
     return jsonify({'success': False, 'message': 'Reel not found.'}), 404
 
 
@@ -3131,25 +5969,107 @@ def dashboard_redirect():
     return redirect(url_for('my_profile'))
 
 # --- Notifications ---
+# The page renders the newest NOTIFICATIONS_PAGE_SIZE notifications and loads older ones from
+# /api/notifications as the user scrolls, paging by id (newest first) on the (receiver_id, id) index.
+NOTIFICATIONS_PAGE_SIZE = 20
+NOTIFICATIONS_MAX_PAGE_SIZE = 100
+
+NOTIFICATION_ICONS = {
+    'system_message': 'fas fa-bullhorn',  # System message from admin
+    'warning': 'fas fa-exclamation-triangle',  # Warning from admin
+    'friend_request': 'fas fa-user-plus',  # Incoming friend request
+    'friend_accepted': 'fas fa-user-check',  # Friend request accepted
+    'post_liked': 'fas fa-heart',
+    'message_received': 'fas fa-comment-alt',
+    'group_invite': 'fas fa-user-friends',
+    'comment_received': 'fas fa-comments',  # New comment on your post/reel
+    'tagged': 'fas fa-at',  # Tagged in comment or bio
+}
+
+
+def fetch_notifications(receiver_id, before_id=None, limit=NOTIFICATIONS_PAGE_SIZE):
+    """Returns one page of a user's notifications, newest first."""
+    db = get_db()
+    params = [get_notification_read_watermark(db, receiver_id), receiver_id]
+    cursor_condition = ""
+    if before_id:
+        cursor_condition = "AND id < ?"
+        params.append(before_id)
+    params.append(limit + 1)  # Fetch one extra row to know whether another page exists
+
+    rows = db.execute(
+        f"""
+        SELECT id, type, message, link, timestamp, CASE WHEN is_read = 1 OR id <= ? THEN 1 ELSE 0 END AS is_read,
+               event_count
+        FROM notifications
+        WHERE receiver_id = ? {cursor_condition}
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        params
+    ).fetchall()
+
+    has_more = len(rows) > limit
+    notifications = []
+    for row in rows[:limit]:
+        notification = dict(row)
+        notification['icon'] = NOTIFICATION_ICONS.get(notification['type'], 'fas fa-bell')
+        if notification['timestamp']:
+            notification['timestamp'] = datetime.fromisoformat(str(notification['timestamp'])).isoformat()
+        notifications.append(notification)
+
+    return {
+        'notifications': notifications,
+        'has_more': has_more,
+        'next_cursor': notifications[-1]['id'] if has_more else None
+    }
+
+
 @app.route('/notifications')
 @login_required
 def notifications():
-    db = get_db()
-    user_notifications = db.execute(
-        "SELECT * FROM notifications WHERE receiver_id = ? ORDER BY timestamp DESC",
-        (current_user.id,)
-    ).fetchall()
+    page = fetch_notifications(current_user.id)
 
     # Pass the current year to the template
     current_year = datetime.now(timezone.utc).year
-    return render_template('notifications.html', notifications=user_notifications, current_year=current_year)
+    return render_template(
+        'notifications.html',
+        notifications=page['notifications'],
+        has_more=page['has_more'],
+        next_cursor=page['next_cursor'],
+        current_year=current_year
+    )
+
+
+@app.route('/api/notifications', methods=['GET'])
+@login_required
+def api_get_notifications():
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', NOTIFICATIONS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, NOTIFICATIONS_MAX_PAGE_SIZE))
+
+    page = fetch_notifications(current_user.id, before_id=before_id, limit=limit)
+    return jsonify({
+        'success': True,
+        'notifications': page['notifications'],
+        'has_more': page['has_more'],
+        'next_cursor': page['next_cursor']
+    })
 
 @app.route('/api/notifications/mark_all_read', methods=['POST'])
 @login_required
 def api_mark_all_notifications_read():
     db = get_db()
     try:
-        db.execute("UPDATE notifications SET is_read = 1 WHERE receiver_id = ?", (current_user.id,))
+        # Moves the user's read watermark instead of rewriting every notification row
+        db.execute(
+            """
+            INSERT INTO notification_read_state (user_id, read_up_to_id)
+            VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM notifications WHERE receiver_id = ?))
+            ON CONFLICT(user_id) DO UPDATE SET read_up_to_id = MAX(read_up_to_id, excluded.read_up_to_id)
+            """,
+            (current_user.id, current_user.id)
+        )
         db.commit()
         return jsonify({'success': True, 'message': 'All notifications marked as read.'})
     except Exception as e:
@@ -3171,6 +6091,74 @@ def api_mark_single_notification_read(notification_id):
         return jsonify({'success': False, 'message': 'Failed to mark notification as read.'}), 500
 
 
+# Read notifications older than NOTIFICATION_RETENTION_DAYS are moved into notifications_archive
+# (or deleted) by `flask notifications prune`, in batches so each write lock is held only briefly.
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+NOTIFICATION_RETENTION_BATCH_SIZE = 500
+
+
+def prune_notifications(retention_days=NOTIFICATION_RETENTION_DAYS, batch_size=NOTIFICATION_RETENTION_BATCH_SIZE,
+                        archive=True):
+    """Archives (or deletes) read notifications older than retention_days. Unread ones are kept
+    whatever their age. Returns the number of notifications moved."""
+    db = get_db()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    last_id = 0
+    pruned = 0
+    while True:
+        ids = [row['id'] for row in db.execute(
+            """
+            SELECT n.id
+            FROM notifications n
+            LEFT JOIN notification_read_state rs ON rs.user_id = n.receiver_id
+            WHERE n.id > ? AND n.timestamp < ? AND (n.is_read = 1 OR n.id <= COALESCE(rs.read_up_to_id, 0))
+            ORDER BY n.id
+            LIMIT ?
+            """,
+            (last_id, cutoff, batch_size)
+        ).fetchall()]
+        if not ids:
+            break
+        placeholders = ','.join('?' * len(ids))
+        try:
+            if archive:
+                db.execute(
+                    f"""
+                    INSERT OR IGNORE INTO notifications_archive (id, receiver_id, type, message, link, timestamp, event_count)
+                    SELECT id, receiver_id, type, message, link, timestamp, event_count
+                    FROM notifications WHERE id IN ({placeholders})
+                    """,
+                    ids
+                )
+            db.execute(f"DELETE FROM notifications WHERE id IN ({placeholders})", ids)
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            app.logger.error(f"Error pruning notifications after id {last_id}: {e}")
+            raise
+        pruned += len(ids)
+        last_id = ids[-1]
+
+    app.logger.info(f"Notification retention: {pruned} notifications {'archived' if archive else 'deleted'}")
+    return pruned
+
+
+notifications_cli = AppGroup('notifications', help='Manage notifications.')
+app.cli.add_command(notifications_cli)
+
+
+@notifications_cli.command('prune')
+@click.option('--older-than-days', default=NOTIFICATION_RETENTION_DAYS, show_default=True,
+              type=click.IntRange(min=0), help='Only prune read notifications older than this.')
+@click.option('--batch-size', default=NOTIFICATION_RETENTION_BATCH_SIZE, show_default=True,
+              type=click.IntRange(min=1), help='Notifications moved per transaction.')
+@click.option('--delete', 'delete', is_flag=True, help='Delete old notifications instead of archiving them.')
+def notifications_prune_command(older_than_days, batch_size, delete):
+    """Moves old read notifications out of the notifications table."""
+    pruned = prune_notifications(retention_days=older_than_days, batch_size=batch_size, archive=not delete)
+    click.echo(f"{pruned} read notifications older than {older_than_days} days {'deleted' if delete else 'archived'}.")
+
+
 # --- Menu & Settings ---
 @app.route('/menu')
 @login_required
@@ -3245,10 +6233,12 @@ def support_inbox():
         chat_room_id = cursor.lastrowid
         db.execute("INSERT INTO chat_room_members (chat_room_id, user_id) VALUES (?, ?)", (chat_room_id, current_user.id))
         db.execute("INSERT INTO chat_room_members (chat_room_id, user_id) VALUES (?, ?)", (chat_room_id, admin_user_id))
+        open_support_threads(db, admin_user_id, chat_room_id)
         db.commit()
         flash('A new support ticket has been opened.', 'info')
     else:
         chat_room_id = chat_room_id_row['id']
+        open_support_threads(db, admin_user_id, chat_room_id)  # E.g. a direct chat with the admin from before
 
     # Fetch messages for this support chat
     messages = db.execute(
@@ -3283,16 +6273,10 @@ def api_send_support_message_user(chat_id):
     if not admin_user_id:
         return jsonify({'success': False, 'message': 'Support system not configured.'}), 500
 
-    # Ensure this chat is indeed a 1-on-1 chat between current_user and admin
+    # Ensure this chat is the current user's support chat with the admin
     is_valid_support_chat = db.execute(
-        """
-        SELECT COUNT(*)
-        FROM chat_room_members crm1
-        JOIN chat_room_members crm2 ON crm1.chat_room_id = crm2.chat_room_id
-        WHERE crm1.chat_room_id = ? AND crm1.user_id = ? AND crm2.user_id = ?
-        """,
-        (chat_id, current_user.id, admin_user_id)
-    ).fetchone()[0] == 2
+        "SELECT 1 FROM support_threads WHERE chat_room_id = ? AND user_id = ?", (chat_id, current_user.id)
+    ).fetchone() is not None
 
     if not is_valid_support_chat:
         return jsonify({'success': False, 'message': 'Invalid support chat ID.'}), 403
@@ -3321,7 +6305,13 @@ def api_send_support_message_user(chat_id):
                 admin_user_id,
                 message_text,
                 link=url_for('admin_support_chat', chat_id=chat_id),
-                type='message_received'
+                type='message_received',
+                group_key=f'support_chat:{chat_id}',
+                digest_message=lambda count: (
+                    f"<strong>{current_user.original_name}</strong> sent {count} new support messages. "
+                    f"Latest: {content[:50]}"
+                ),
+                actor_id=current_user.id
             )
 
         return jsonify({'success': True, 'message': dict(new_message)})
@@ -3394,6 +6384,68 @@ def settings():
     )
 
 
+# Settings form field -> users column. Boolean fields are stored as 0/1.
+USER_SETTINGS_FIELDS = {
+    'language': 'language',
+    'theme': 'theme_preference',
+    'profileLocking': 'profile_locking',
+    'postsVisibility': 'posts_visibility',
+    'allowPostSharing': 'allow_post_sharing',
+    'allowPostComments': 'allow_post_comments',
+    'reelsVisibility': 'reels_visibility',
+    'allowReelSharing': 'allow_reel_sharing',
+    'allowReelComments': 'allow_reel_comments',
+    'notifyFriendRequests': 'notify_friend_requests',
+    'notifyFriendAcceptance': 'notify_friend_acceptance',
+    'notifyPostLikes': 'notify_post_likes',
+    'notifyNewMessages': 'notify_new_messages',
+    'notifyGroupInvites': 'notify_group_invites',
+    'notifyComments': 'notify_comments',
+    'notifyTags': 'notify_tags',
+}
+USER_SETTINGS_CHOICES = {
+    'language': ['en', 'es', 'fr'],
+    'theme_preference': ['light', 'dark'],
+    'posts_visibility': ['public', 'friends', 'private'],
+    'reels_visibility': ['public', 'friends', 'private'],
+}
+
+
+@app.route('/api/settings/update', methods=['POST'])
+@login_required
+def api_update_settings():
+    data = request.get_json(silent=True) or {}
+    updates = {}
+    for field, column in USER_SETTINGS_FIELDS.items():
+        if field not in data:
+            continue
+        value = data[field]
+        if column in USER_SETTINGS_CHOICES:
+            if value not in USER_SETTINGS_CHOICES[column]:
+                return jsonify({'success': False, 'message': f'Invalid value for {field}.'}), 400
+            updates[column] = value
+        else:
+            updates[column] = 1 if value else 0
+    if not updates:
+        return jsonify({'success': False, 'message': 'No settings to update.'}), 400
+
+    db = get_db()
+    try:
+        db.execute(
+            f"UPDATE users SET {', '.join(f'{column} = ?' for column in updates)} WHERE id = ?",
+            (*updates.values(), current_user.id)
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        app.logger.error(f"Error updating settings for user {current_user.id}: {e}")
+        return jsonify({'success': False, 'message': 'Failed to save settings.'}), 500
+
+    if any(column in NOTIFICATION_PREFERENCE_BITS for column in updates):
+        invalidate_notification_preferences(current_user.id)
+    return jsonify({'success': True, 'message': 'Settings saved successfully.'})
+
+
 @app.route('/blocked_users')
 @login_required
 def blocked_users():
@@ -3479,128 +6531,456 @@ def api_unblock_user(user_id_to_unblock):
 
 # --- Admin Dashboard Routes ---
 
+# --- Admin Background Jobs ---
+# Fan-out and deletion work queued by the admin actions below (see "Background Jobs").
+@job_handler('broadcast_notification')
+def broadcast_notification_job(message, link):
+    """Sends a system message to every non-admin user in one statement."""
+    db = get_db()
+    db.execute(
+        """
+        INSERT INTO notifications (receiver_id, type, message, timestamp, link, is_read)
+        SELECT id, 'system_message', ?, ?, ?, 0 FROM users WHERE is_admin = 0
+        """,
+        (message, datetime.now(timezone.utc), link)
+    )
+    db.commit()
+
+
+@job_handler('chat_room_notification')
+def chat_room_notification_job(chat_room_id, message, link, type):
+    """Notifies every member of a chat room (e.g. of a group being banned)."""
+    members = get_db().execute(
+        "SELECT user_id FROM chat_room_members WHERE chat_room_id = ?", (chat_room_id,)
+    ).fetchall()
+    load_notification_preferences([member['user_id'] for member in members])
+    for member in members:
+        send_system_notification(member['user_id'], message, link=link, type=type)
+
+
+@job_handler('moderation_notifications')
+def moderation_notifications_job(notifications, chat_rooms):
+    """Writes the notifications of a batch of moderation actions in one transaction.
+    notifications are [user_id, message, link, type]; chat_rooms are [chat_room_id, message, link,
+    type] and go to every member of the room."""
+    db = get_db()
+    rows = [tuple(notification) for notification in notifications]
+    for chat_room_id, message, link, type in chat_rooms:
+        rows += [(member['user_id'], message, link, type) for member in db.execute(
+            "SELECT user_id FROM chat_room_members WHERE chat_room_id = ?", (chat_room_id,)
+        ).fetchall()]
+    load_notification_preferences([row[0] for row in rows])  # One query; wants_notification() hits the cache
+    now_utc = datetime.now(timezone.utc)
+    db.executemany(
+        "INSERT INTO notifications (receiver_id, type, message, timestamp, link, is_read) VALUES (?, ?, ?, ?, ?, 0)",
+        [(receiver_id, type, message, now_utc, link)
+         for receiver_id, message, link, type in rows if wants_notification(receiver_id, type)]
+    )
+    db.commit()
+
+
+# --- Account Deletion ---
+# Deleting an account removes its dependent rows table by table, USER_DELETION_BATCH_SIZE rows per
+# transaction, releasing the media they reference, so other requests only ever wait for one small
+# batch. Each step below is (table, condition on the user id, media columns); the conditions
+# take the user id once per "?". Steps run in order so children go before their parents, and the
+# connection enables foreign_keys so anything left (e.g. comments on reposts) still cascades.
+# Progress is kept in user_deletions; a run stops after USER_DELETION_TIME_BUDGET_SECONDS and is
+# requeued, which keeps it well inside the job lease.
+USER_DELETION_BATCH_SIZE = 500
+USER_DELETION_BATCH_PAUSE_SECONDS = 0.05
+USER_DELETION_TIME_BUDGET_SECONDS = 60
+USER_DELETION_STEPS = [
+    ('chat_messages', 'sender_id = ?', ['media_path']),
+    ('comments', 'user_id = ?', []),
+    ('comments', 'post_id IN (SELECT id FROM posts WHERE user_id = ?)', []),
+    ('likes', 'user_id = ? OR post_id IN (SELECT id FROM posts WHERE user_id = ?)', []),
+    ('saved_posts', 'user_id = ? OR post_id IN (SELECT id FROM posts WHERE user_id = ?)', []),
+    ('hidden_posts', 'user_id = ? OR post_id IN (SELECT id FROM posts WHERE user_id = ?)', []),
+    ('post_notifications', 'user_id = ? OR post_id IN (SELECT id FROM posts WHERE user_id = ?)', []),
+    ('posts', 'original_post_id IN (SELECT id FROM posts WHERE user_id = ?)', ['media_path']),  # Reposts by others
+    ('posts', 'user_id = ?', ['media_path']),
+    ('reel_views', 'viewer_id = ? OR reel_id IN (SELECT id FROM reels WHERE user_id = ?)', []),
+    ('reel_rank_snapshots', 'viewer_id = ?', []),
+    ('reels', 'user_id = ?', ['media_path', 'audio_path']),
+    ('stories', 'user_id = ?', ['media_path', 'background_audio_path']),
+    ('notifications', 'receiver_id = ?', []),
+    ('notifications_archive', 'receiver_id = ?', []),
+    ('notification_read_state', 'user_id = ?', []),
+    ('friendships', 'user1_id = ? OR user2_id = ?', []),
+    ('blocked_users', 'blocker_id = ? OR blocked_id = ?', []),
+    ('chat_room_members', 'user_id = ?', []),
+    ('support_threads', 'user_id = ?', []),
+    ('warnings', 'user_id = ?', []),
+    ('reports', "reported_by_user_id = ? OR (reported_item_type = 'user' AND reported_item_id = ?)", []),
+    ('upload_sessions', 'user_id = ?', []),
+    ('members', 'user_id = ?', ['profilePhoto']),
+    ('user_counters', 'user_id = ?', []),  # After the friendships and posts steps, whose triggers write here
+    ('users', 'id = ?', ['chat_background_image_path']),
+]
+
+
+USER_DELETION_ROW_KEYS = {  # WITHOUT ROWID tables
+    'reel_views': 'reel_id, viewer_id, view_window',
+    'user_counters': 'user_id, name',
+}
+
+# Rows counted on the post they point at: table -> (post id column, posts counter column). The
+# counters of posts that outlive the account are decremented in the batch that deletes the rows.
+USER_DELETION_POST_COUNTERS = {
+    'likes': ('post_id', 'likes_count'),
+    'comments': ('post_id', 'comments_count'),
+    'posts': ('original_post_id', 'reposts_count'),
+}
+
+
+def _delete_user_rows_batch(db, user_id, table, condition, media_columns):
+    """Deletes one batch of a step, adjusts the counters of the posts its rows were counted on and
+    releases its media. Returns the number of rows deleted."""
+    params = [user_id] * condition.count('?')
+    post_counter = USER_DELETION_POST_COUNTERS.get(table)
+    rows = []
+    if media_columns or post_counter:
+        columns = media_columns + [post_counter[0]] if post_counter else media_columns
+        rows = db.execute(
+            f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE {condition} LIMIT ?",
+            (*params, USER_DELETION_BATCH_SIZE)
+        ).fetchall()
+        if post_counter:
+            post_column, counter_column = post_counter
+            counts = Counter(row[post_column] for row in rows if row[post_column] is not None)
+            db.executemany(
+                f"UPDATE posts SET {counter_column} = {counter_column} - ? WHERE id = ?",
+                [(count, post_id) for post_id, count in counts.items()]
+            )
+        deleted = db.execute(
+            f"DELETE FROM {table} WHERE rowid IN ({','.join('?' * len(rows))})", [row[0] for row in rows]
+        ).rowcount if rows else 0
+    else:
+        key = USER_DELETION_ROW_KEYS.get(table, 'rowid')
+        deleted = db.execute(
+            f"DELETE FROM {table} WHERE ({key}) IN (SELECT {key} FROM {table} WHERE {condition} LIMIT ?)",
+            (*params, USER_DELETION_BATCH_SIZE)
+        ).rowcount
+    if not deleted:
+        db.rollback()
+        return 0
+    db.execute(
+        "UPDATE user_deletions SET current_step = ?, rows_deleted = rows_deleted + ? WHERE user_id = ?",
+        (table, deleted, user_id)
+    )
+    released = [
+        release_stored_media(row[column], db)
+        for row in rows
+        for column in media_columns
+        if row[column]
+    ]
+    db.commit()
+    remove_released_media(released, db)
+    return deleted
+
+
+@job_handler('delete_user')
+def delete_user_job(user_id):
+    db = get_db()
+    db.execute("PRAGMA foreign_keys = ON")
+    db.execute("UPDATE user_deletions SET status = 'running' WHERE user_id = ?", (user_id,))
+    # Rooms and groups the user created are kept for their other members
+    admin_user_id = get_admin_user_id()
+    db.execute("UPDATE chat_rooms SET created_by = ? WHERE created_by = ?", (admin_user_id, user_id))
+    db.execute("UPDATE groups SET created_by = ? WHERE created_by = ?", (admin_user_id, user_id))
+    db.commit()
+
+    started = time.monotonic()
+    for table, condition, media_columns in USER_DELETION_STEPS:
+        if not _table_exists(db, table):
+            continue
+        while _delete_user_rows_batch(db, user_id, table, condition, media_columns):
+            if time.monotonic() - started > USER_DELETION_TIME_BUDGET_SECONDS:
+                raise RequeueJob()
+            time.sleep(USER_DELETION_BATCH_PAUSE_SECONDS)  # Let waiting writers in between batches
+
+    db.execute(
+        "UPDATE user_deletions SET status = 'done', current_step = NULL, finished_at = ? WHERE user_id = ?",
+        (datetime.now(timezone.utc), user_id)
+    )
+    db.commit()
+    invalidate_notification_preferences(user_id)
+    app.logger.info(f"Deleted user {user_id} and their data.")
+
+
+@app.route('/api/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@admin_required
+def api_admin_retry_job(job_id):
+    db = get_db()
+    try:
+        cursor = db.execute(
+            "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ? WHERE id = ? AND status = 'failed'",
+            (datetime.now(timezone.utc), job_id)
+        )
+        db.commit()
+        if cursor.rowcount == 0:
+            return jsonify({'success': False, 'message': 'Failed job not found.'}), 404
+        _ensure_job_worker()
+        _job_wakeup.set()
+        return jsonify({'success': True, 'message': 'Job queued again.'})
+    except sqlite3.IntegrityError:
+        db.rollback()  # The key was queued again since this job failed
+        return jsonify({'success': False, 'message': 'A newer job with the same key is already queued.'}), 409
+    except Exception as e:
+        db.rollback()
+        app.logger.error(f"Error retrying job {job_id}: {e}")
+        return jsonify({'success': False, 'message': 'Failed to retry job.'}), 500
+
+
 @app.route('/admin_dashboard')
 @admin_required
 def admin_dashboard():
     db = get_db()
 
     # --- Overview Counts ---
-    user_count = db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-    group_count = db.execute("SELECT COUNT(*) FROM groups").fetchone()[0]
-    post_count = db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
-    reel_count = db.execute("SELECT COUNT(*) FROM reels").fetchone()[0]
-    story_count = db.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
-    pending_reports_count = db.execute("SELECT COUNT(*) FROM reports WHERE status = 'pending'").fetchone()[0]
-    active_warnings_count = db.execute("SELECT COUNT(*) FROM warnings WHERE status = 'active'").fetchone()[0]
-    active_bans_count = db.execute("SELECT COUNT(*) FROM users WHERE ban_status != 'none'").fetchone()[0]
-    
+    counters = get_counters(db, COUNTER_DEFINITIONS)
     counts = {
-        'user_count': user_count,
-        'group_count': group_count,
-        'post_count': post_count,
-        'reel_count': reel_count,
-        'story_count': story_count,
-        'pending_reports_count': pending_reports_count,
-        'active_warnings_count': active_warnings_count,
-        'active_bans_count': active_bans_count
+        'user_count': counters['users'],
+        'group_count': counters['groups'],
+        'post_count': counters['posts'],
+        'reel_count': counters['reels'],
+        'story_count': counters['stories'],
+        'pending_reports_count': counters['pending_reports'],
+        'active_warnings_count': counters['active_warnings'],
+        'active_bans_count': counters['active_bans']
     }
 
-    # --- All Users for Management ---
-    all_users_data = db.execute(
-        """
-        SELECT u.id, u.username, u.originalName AS real_name, m.profilePhoto,
-               u.ban_status AS is_banned_status,
+    # Users and groups are listed page by page from /api/admin/users and /api/admin/groups
+
+    # Pending reports are listed grouped by target from /api/admin/moderation_queue
+    # Support chats are listed page by page from /api/admin/support_threads
+
+    # --- Background Job Queue ---
+    job_queue = job_queue_stats(db)
+    failed_jobs = [dict(job) for job in db.execute(
+        "SELECT id, type, attempts, last_error, run_at FROM jobs WHERE status = 'failed' ORDER BY id DESC LIMIT ?",
+        (FAILED_JOBS_SHOWN,)
+    ).fetchall()]
+
+    # Pass the current year to the template
+    current_year = datetime.now(timezone.utc).year
+    return render_template(
+        'admin_dashboard.html',
+        counts=counts,
+        job_queue=job_queue,
+        failed_jobs=failed_jobs,
+        current_year=current_year
+    )
+
+
+# --- Admin User & Group Tables ---
+# The dashboard's user and group tables are paged, sorted and filtered here. Sorting is limited to
+# columns that can be read in order without counting anything for every row; the per-row counts
+# (warnings, members, reports) are only worked out for the rows on the page.
+ADMIN_TABLE_PAGE_SIZE = 25
+ADMIN_TABLE_MAX_PAGE_SIZE = 100
+# Each sort is served by an index (usernames are unique; names are indexed with the id as tie-break)
+ADMIN_USER_SORTS = {'username': 'u.username', 'name': ('u.originalName', 'u.id'), 'joined': 'u.id'}
+ADMIN_GROUP_SORTS = {'name': ('g.name', 'g.id'), 'created': 'g.id'}
+
+
+def admin_table_args(sorts, default_sort):
+    """Reads page, per_page, sort, order, q and status from the query string. A sort maps to a
+    column, or to a tuple of columns that are all ordered in the requested direction."""
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', ADMIN_TABLE_PAGE_SIZE, type=int), ADMIN_TABLE_MAX_PAGE_SIZE))
+    sort = request.args.get('sort', default_sort)
+    if sort not in sorts:
+        sort = default_sort
+    order = 'DESC' if request.args.get('order') == 'desc' else 'ASC'
+    columns = sorts[sort] if isinstance(sorts[sort], tuple) else (sorts[sort],)
+    return {
+        'page': page,
+        'per_page': per_page,
+        'order_by': ', '.join(f"{column} {order}" for column in columns),
+        'q': request.args.get('q', '').strip(),
+        'status': request.args.get('status', 'all')
+    }
+
+
+def admin_table_response(key, rows, args):
+    """Trims the extra row fetched to detect a next page and wraps a page of results."""
+    return jsonify({
+        'success': True,
+        key: rows[:args['per_page']],
+        'page': args['page'],
+        'per_page': args['per_page'],
+        'has_more': len(rows) > args['per_page']
+    })
+
+
+@app.route('/api/admin/users', methods=['GET'])
+@admin_required
+def api_admin_users():
+    args = admin_table_args(ADMIN_USER_SORTS, 'username')
+    conditions = []
+    params = []
+    if args['q']:
+        conditions.append("(u.username LIKE ? OR u.originalName LIKE ?)")
+        params += [f"%{args['q']}%"] * 2
+    if args['status'] == 'banned':
+        conditions.append("u.ban_status != 'none'")
+    elif args['status'] == 'active':
+        conditions.append("(u.ban_status = 'none' OR u.ban_status IS NULL)")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    rows = get_db().execute(
+        f"""
+        SELECT u.id, u.username, u.originalName AS real_name, m.profilePhoto, u.ban_status,
                (SELECT COUNT(*) FROM warnings WHERE user_id = u.id AND status = 'active') AS warnings_count
         FROM users u
         LEFT JOIN members m ON u.id = m.user_id
-        ORDER BY u.username
-        """
+        {where}
+        ORDER BY {args['order_by']}
+        LIMIT ? OFFSET ?
+        """,
+        (*params, args['per_page'] + 1, (args['page'] - 1) * args['per_page'])
     ).fetchall()
-    all_users = []
-    for user_data in all_users_data:
-        user_dict = dict(user_data)
-        user_dict['profile_pic'] = get_member_profile_pic(user_dict['id'])
-        user_dict['is_banned'] = user_dict['is_banned_status'] != 'none'
-        all_users.append(user_dict)
+    users = []
+    for row in rows:
+        user = dict(row)
+        user['profile_pic'] = profile_pic_url(user.pop('profilePhoto'))
+        user['is_banned'] = user.pop('ban_status') not in (None, 'none')
+        user['profile_url'] = url_for('profile', username=user['username'])
+        users.append(user)
+    return admin_table_response('users', users, args)
 
 
-    # --- All Groups for Management ---
-    all_groups_data = db.execute(
-        """
-        SELECT g.id, g.name, g.profilePhoto,
+@app.route('/api/admin/groups', methods=['GET'])
+@admin_required
+def api_admin_groups():
+    args = admin_table_args(ADMIN_GROUP_SORTS, 'name')
+    conditions = []
+    params = []
+    if args['q']:
+        conditions.append("g.name LIKE ?")
+        params.append(f"%{args['q']}%")
+    if args['status'] == 'banned':
+        conditions.append("g.ban_status != 'none'")
+    elif args['status'] == 'active':
+        conditions.append("(g.ban_status = 'none' OR g.ban_status IS NULL)")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    rows = get_db().execute(
+        f"""
+        SELECT g.id, g.name, g.profilePhoto, g.ban_status,
                (SELECT COUNT(*) FROM chat_room_members WHERE chat_room_id = g.chat_room_id) AS member_count,
-               g.ban_status AS is_banned_status,
                (SELECT COUNT(*) FROM reports WHERE reported_item_type = 'group' AND reported_item_id = g.id AND status = 'pending') AS reports_count
         FROM groups g
-        ORDER BY g.name
-        """
+        {where}
+        ORDER BY {args['order_by']}
+        LIMIT ? OFFSET ?
+        """,
+        (*params, args['per_page'] + 1, (args['page'] - 1) * args['per_page'])
     ).fetchall()
-    all_groups = []
-    for group_data in all_groups_data:
-        group_dict = dict(group_data)
-        group_dict['profile_pic'] = group_dict['profilePhoto'] or url_for('static', filename='img/default_group.png')
-        group_dict['is_banned'] = group_dict['is_banned_status'] != 'none'
-        all_groups.append(group_dict)
-
-    # --- Pending Reports ---
-    pending_reports_data = db.execute(
-        """
-        SELECT r.*,
-               u_reporter.username AS reported_by_username,
-               u_item.username AS reported_item_username,
-               g_item.name AS reported_item_name
-        FROM reports r
-        LEFT JOIN users u_reporter ON r.reported_by_user_id = u_reporter.id
-        LEFT JOIN users u_item ON (r.reported_item_type = 'user' AND r.reported_item_id = u_item.id)
-        LEFT JOIN groups g_item ON (r.reported_item_type = 'group' AND r.reported_item_id = g_item.id)
-        WHERE r.status = 'pending'
-        ORDER BY r.timestamp DESC
-        """
+    groups = []
+    for row in rows:
+        group = dict(row)
+        group['profile_pic'] = group.pop('profilePhoto') or url_for('static', filename='img/default_group.png')
+        group['is_banned'] = group.pop('ban_status') not in (None, 'none')
+        groups.append(group)
+    return admin_table_response('groups', groups, args)
+
+
+# --- Admin Support Inbox ---
+# One support_threads row per support chat holds its last message, last activity and the number
+# of user messages the admin hasn't read. The support_threads_message trigger keeps it current on
+# every chat message, so listing the inbox reads a page of rows in index order.
+SUPPORT_THREAD_SORTS = {
+    'activity': ('t.last_activity_at', 't.chat_room_id'),
+    'unread': ('t.unread_for_admin', 't.last_activity_at', 't.chat_room_id'),
+}
+
+
+@app.route('/api/admin/support_threads', methods=['GET'])
+@admin_required
+def api_admin_support_threads():
+    args = admin_table_args(SUPPORT_THREAD_SORTS, 'activity')
+    conditions = []
+    params = []
+    if args['q']:
+        conditions.append("(u.username LIKE ? OR u.originalName LIKE ?)")
+        params += [f"%{args['q']}%"] * 2
+    if args['status'] == 'unread':
+        conditions.append("t.unread_for_admin > 0")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    rows = get_db().execute(
+        f"""
+        SELECT t.chat_room_id AS chat_id, t.user_id, t.last_activity_at, t.unread_for_admin AS unread_count,
+               u.username AS user_username, u.originalName AS user_real_name, m.profilePhoto,
+               cm.content AS last_message_content
+        FROM support_threads t
+        JOIN users u ON t.user_id = u.id
+        LEFT JOIN members m ON u.id = m.user_id
+        LEFT JOIN chat_messages cm ON cm.id = t.last_message_id
+        {where}
+        ORDER BY {args['order_by']}
+        LIMIT ? OFFSET ?
+        """,
+        (*params, args['per_page'] + 1, (args['page'] - 1) * args['per_page'])
     ).fetchall()
-    pending_reports = [dict(rep) for rep in pending_reports_data]
-
-
-    # --- Support Chats Overview ---
+    threads = []
+    for row in rows:
+        thread = dict(row)
+        thread['user_profile_pic'] = profile_pic_url(thread.pop('profilePhoto'))
+        content = thread.pop('last_message_content')
+        thread['last_message_snippet'] = (content[:50] + '...') if content and len(content) > 50 else (content or "No messages yet.")
+        thread['chat_url'] = url_for('admin_support_chat', chat_id=thread['chat_id'])
+        threads.append(thread)
+    return admin_table_response('threads', threads, args)
+
+
+@app.route('/admin/support_chat/<int:chat_id>')
+@admin_required
+def admin_support_chat(chat_id):
+    db = get_db()
     admin_user_id = get_admin_user_id()
-    support_chats_overview_data = []
-    if admin_user_id:
-        support_chats_overview_data = db.execute(
-            """
-            SELECT
-                cr.id AS chat_id,
-                u_other.id AS user_id,
-                u_other.username AS user_username,
-                u_other.originalName AS user_real_name,
-                m_other.profilePhoto AS user_profile_pic,
-                (SELECT content FROM chat_messages WHERE chat_room_id = cr.id ORDER BY timestamp DESC LIMIT 1) AS last_message_content,
-                (SELECT COUNT(*) FROM chat_messages cm JOIN chat_room_members crm ON cm.chat_room_id = crm.chat_room_id WHERE crm.chat_room_id = cr.id AND cm.sender_id != ? AND cm.timestamp > crm.last_read_message_timestamp AND crm.user_id = ?) AS unread_admin_messages_count
-            FROM chat_rooms cr
-            JOIN chat_room_members crm_admin ON cr.id = crm_admin.chat_room_id AND crm_admin.user_id = ?
-            JOIN chat_room_members crm_user ON cr.id = crm_user.chat_room_id AND crm_user.user_id != ?
-            JOIN users u_other ON crm_user.user_id = u_other.id
-            LEFT JOIN members m_other ON u_other.id = m_other.user_id
-            WHERE cr.is_group = 0
-            ORDER BY (SELECT MAX(timestamp) FROM chat_messages WHERE chat_room_id = cr.id) DESC
-            """,
-            (admin_user_id, admin_user_id, admin_user_id, admin_user_id)  # The subquery needs the admin_user_id for sender_id != ? and crm.user_id = ?
-        ).fetchall()
+    thread = db.execute(
+        """
+        SELECT t.user_id, u.username, u.originalName, m.fullName, m.profilePhoto
+        FROM support_threads t
+        JOIN users u ON t.user_id = u.id
+        LEFT JOIN members m ON u.id = m.user_id
+        WHERE t.chat_room_id = ?
+        """,
+        (chat_id,)
+    ).fetchone()
+    if not thread:
+        flash('Support chat not found.', 'danger')
+        return redirect(url_for('admin_dashboard'))
 
-    support_chats_overview = []
-    for chat in support_chats_overview_data:
-        chat_dict = dict(chat)
-        chat_dict['user_profile_pic'] = get_member_profile_pic(chat_dict['user_id'])
-        chat_dict['last_message_snippet'] = (chat_dict['last_message_content'][:50] + '...') if chat_dict['last_message_content'] and len(chat_dict['last_message_content']) > 50 else (chat_dict['last_message_content'] or "No messages yet.")
-        support_chats_overview.append(chat_dict)
+    chat_messages = db.execute(
+        "SELECT id, sender_id, content, timestamp FROM chat_messages WHERE chat_room_id = ? ORDER BY id",
+        (chat_id,)
+    ).fetchall()
 
-    # Pass the current year to the template
+    # Opening the chat reads it
+    db.execute(
+        "UPDATE chat_room_members SET last_read_message_timestamp = ? WHERE chat_room_id = ? AND user_id = ?",
+        (datetime.now(timezone.utc), chat_id, admin_user_id)
+    )
+    db.execute("UPDATE support_threads SET unread_for_admin = 0 WHERE chat_room_id = ?", (chat_id,))
+    db.commit()
+
+    user_for_chat = {
+        'username': thread['username'],
+        'real_name': thread['fullName'] or thread['originalName'],
+        'profile_pic': profile_pic_url(thread['profilePhoto'])
+    }
     current_year = datetime.now(timezone.utc).year
     return render_template(
-        'admin_dashboard.html',
-        counts=counts,
-        all_users=all_users,
-        all_groups=all_groups,
-        pending_reports=pending_reports,
-        support_chats_overview=support_chats_overview,
+        'admin_support_chat.html',
+        user_for_chat=user_for_chat,
+        chat_messages=chat_messages,
+        admin_user_id=admin_user_id,
+        chat_id=chat_id,
         current_year=current_year
     )
 
@@ -3777,20 +7157,37 @@ def api_admin_delete_user(user_id):
         return jsonify({'success': False, 'message': 'You cannot delete your own admin account through this interface.'}), 403
 
     try:
-        # Cascade deletes should handle most related data if defined in schema.sql
-        # Otherwise, explicit deletes would be needed for:
-        # members, friendships, chat_room_members, chat_messages (if sender_id),
-        # posts, reels, stories, reports (reporter or reported), warnings, blocked_users
-        db.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        # Recorded and queued in one transaction; the user is logged out from here on
+        db.execute(
+            "INSERT OR IGNORE INTO user_deletions (user_id, requested_by, requested_at) VALUES (?, ?, ?)",
+            (user_id, current_user.id, datetime.now(timezone.utc))
+        )
+        enqueue_job('delete_user', {'user_id': user_id}, unique_key=f'delete_user:{user_id}')
         db.commit()
         # No notification to a deleted user
-        return jsonify({'success': True, 'message': 'User account and all associated data deleted permanently.'})
+        return jsonify({
+            'success': True,
+            'message': 'User account deletion has been queued.',
+            'status_url': url_for('api_admin_delete_user_status', user_id=user_id)
+        })
     except Exception as e:
         db.rollback()
         app.logger.error(f"Error deleting user {user_id}: {e}")
         return jsonify({'success': False, 'message': 'Failed to delete user.'}), 500
 
 
+@app.route('/api/admin/delete_user/<int:user_id>/status', methods=['GET'])
+@admin_required
+def api_admin_delete_user_status(user_id):
+    deletion = get_db().execute(
+        "SELECT status, current_step, rows_deleted, requested_at, finished_at FROM user_deletions WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    if not deletion:
+        return jsonify({'success': False, 'message': 'No deletion was requested for this user.'}), 404
+    return jsonify({'success': True, **dict(deletion)})
+
+
 @app.route('/api/admin/ban_group/<int:group_id>', methods=['POST'])
 @admin_required
 def api_admin_ban_group(group_id):
@@ -3816,15 +7213,12 @@ def api_admin_ban_group(group_id):
         # Notify group members (optional but good practice)
         group = db.execute("SELECT name, chat_room_id FROM groups WHERE id = ?", (group_id,)).fetchone()
         if group:
-            members = db.execute("SELECT user_id FROM chat_room_members WHERE chat_room_id = ?", (group['chat_room_id'],)).fetchall()
-            for member in members:
-                message = f'The group "<strong>{group["name"]}</strong>" has been {ban_status}ly banned. Reason: {reason}.'
-                send_system_notification(
-                    member['user_id'],
-                    message,
-                    link=url_for('home'),
-                    type='danger'
-                )
+            enqueue_job('chat_room_notification', {
+                'chat_room_id': group['chat_room_id'],
+                'message': f'The group "<strong>{group["name"]}</strong>" has been {ban_status}ly banned. Reason: {reason}.',
+                'link': url_for('home'),
+                'type': 'danger'
+            })
         return jsonify({'success': True, 'message': 'Group banned successfully.'})
     except Exception as e:
         db.rollback()
@@ -3845,15 +7239,12 @@ def api_admin_unban_group(group_id):
         # Notify group members
         group = db.execute("SELECT name, chat_room_id FROM groups WHERE id = ?", (group_id,)).fetchone()
         if group:
-            members = db.execute("SELECT user_id FROM chat_room_members WHERE chat_room_id = ?", (group['chat_room_id'],)).fetchall()
-            for member in members:
-                message = f'The ban on group "<strong>{group["name"]}</strong>" has been lifted. You can now access it.'
-                send_system_notification(
-                    member['user_id'],
-                    message,
-                    link=url_for('view_group_profile', group_id=group_id),
-                    type='info'
-                )
+            enqueue_job('chat_room_notification', {
+                'chat_room_id': group['chat_room_id'],
+                'message': f'The ban on group "<strong>{group["name"]}</strong>" has been lifted. You can now access it.',
+                'link': url_for('view_group_profile', group_id=group_id),
+                'type': 'info'
+            })
         return jsonify({'success': True, 'message': 'Group unbanned successfully.'})
     except Exception as e:
         db.rollback()
@@ -3938,13 +7329,15 @@ def api_admin_handle_report(report_id, action):
                     "UPDATE groups SET ban_status = 'permanent', ban_reason = ?, ban_starts_at = ? WHERE id = ?",
                     (f'Banned due to report: {report_reason}', datetime.now(timezone.utc), reported_item_id)
                 )
-                 # Notify group members
+                 # Notify group members once the ban is committed
                  group = db.execute("SELECT name, chat_room_id FROM groups WHERE id = ?", (reported_item_id,)).fetchone()
                  if group:
-                    members = db.execute("SELECT user_id FROM chat_room_members WHERE chat_room_id = ?", (group['chat_room_id'],)).fetchall()
-                    for member in members:
-                        message = f'The group "<strong>{group["name"]}</strong>" has been permanently banned due to a report.'
-                        send_system_notification(member['user_id'], message, link=url_for('home'), type='danger')
+                    enqueue_job('chat_room_notification', {
+                        'chat_room_id': group['chat_room_id'],
+                        'message': f'The group "<strong>{group["name"]}</strong>" has been permanently banned due to a report.',
+                        'link': url_for('home'),
+                        'type': 'danger'
+                    })
             # Other content types (post, reel, story) would be deleted rather than banned
             db.execute("UPDATE reports SET status = 'handled', admin_notes = ? WHERE id = ?", ('Banned user/item.', report_id))
             db.commit()
@@ -3964,6 +7357,176 @@ def api_admin_handle_report(report_id, action):
         return jsonify({'success': False, 'message': 'Failed to handle report.'}), 500
 
 
+# --- Moderation Queue ---
+# Pending reports grouped by their target (item type + id), so a report storm against one post or
+# user is one row. An admin acts on whole groups, several at once, in a single transaction; the
+# notifications those actions cause are written afterwards by one 'moderation_notifications' job.
+# Each target carries the newest report id the admin saw, so reports filed meanwhile stay pending.
+MODERATION_QUEUE_SORTS = {
+    'reports': ('report_count', 'last_report_id'),
+    'latest': ('last_report_id',),
+    'oldest': ('first_report_id',),
+}
+MODERATION_ITEM_TYPES = {'user', 'group', 'post', 'reel', 'story'}
+MODERATION_ACTIONS = {  # action -> (report status, admin note)
+    'warn': ('handled', 'Warned user/item.'),
+    'ban': ('handled', 'Banned user/item.'),
+    'ignore': ('ignored', 'No action taken.'),
+}
+MODERATION_BATCH_MAX_TARGETS = 100
+
+
+@app.route('/api/admin/moderation_queue', methods=['GET'])
+@admin_required
+def api_admin_moderation_queue():
+    args = admin_table_args(MODERATION_QUEUE_SORTS, 'reports')
+    conditions = ["status = 'pending'"]
+    params = []
+    if args['status'] in MODERATION_ITEM_TYPES:
+        conditions.append("reported_item_type = ?")
+        params.append(args['status'])
+    if args['q']:
+        conditions.append("reason LIKE ?")
+        params.append(f"%{args['q']}%")
+
+    db = get_db()
+    rows = db.execute(
+        f"""
+        SELECT reported_item_type AS item_type, reported_item_id AS item_id, COUNT(*) AS report_count,
+               COUNT(DISTINCT reported_by_user_id) AS reporter_count, MIN(id) AS first_report_id,
+               MAX(id) AS last_report_id, MAX(timestamp) AS last_reported_at
+        FROM reports
+        WHERE {' AND '.join(conditions)}
+        GROUP BY reported_item_type, reported_item_id
+        ORDER BY {args['order_by']}
+        LIMIT ? OFFSET ?
+        """,
+        (*params, args['per_page'] + 1, (args['page'] - 1) * args['per_page'])
+    ).fetchall()
+    targets = [dict(row) for row in rows]
+
+    # Labels and latest reasons for the page only
+    def lookup(sql, ids):
+        if not ids:
+            return {}
+        return {row[0]: row[1] for row in db.execute(sql.format(','.join('?' * len(ids))), list(ids)).fetchall()}
+    usernames = lookup("SELECT id, username FROM users WHERE id IN ({})",
+                       {t['item_id'] for t in targets if t['item_type'] == 'user'})
+    group_names = lookup("SELECT id, name FROM groups WHERE id IN ({})",
+                         {t['item_id'] for t in targets if t['item_type'] == 'group'})
+    reasons = lookup("SELECT id, reason FROM reports WHERE id IN ({})", {t['last_report_id'] for t in targets})
+    for target in targets:
+        if target['item_type'] == 'user':
+            target['item_label'] = f"@{usernames.get(target['item_id'], target['item_id'])}"
+        elif target['item_type'] == 'group':
+            target['item_label'] = group_names.get(target['item_id'], f"Group {target['item_id']}")
+        else:
+            target['item_label'] = f"{target['item_type'].capitalize()} {target['item_id']}"
+        target['latest_reason'] = reasons.get(target['last_report_id'])
+    return admin_table_response('targets', targets, args)
+
+
+def resolve_report_target(db, item_type, item_id, up_to_report_id, action, reason, notifications, room_notifications):
+    """Applies action to one target and closes its pending reports up to up_to_report_id. The
+    notifications to send are appended to notifications (user ids) and room_notifications (chat
+    rooms) as [id, message, link, type]. Returns the number of reports closed. Doesn't commit."""
+    latest = db.execute(
+        """
+        SELECT reason FROM reports
+        WHERE status = 'pending' AND reported_item_type = ? AND reported_item_id = ? AND id <= ?
+        ORDER BY id DESC LIMIT 1
+        """,
+        (item_type, item_id, up_to_report_id)
+    ).fetchone()
+    if not latest:
+        return 0  # Already handled, e.g. by another admin
+    reason = reason or latest['reason']
+    now_utc = datetime.now(timezone.utc)
+
+    if action == 'warn' and item_type == 'user':
+        db.execute(
+            "INSERT INTO warnings (user_id, title, description, timestamp, status) VALUES (?, ?, ?, ?, 'active')",
+            (item_id, 'Reported Content Violation', f'User reported for: {reason}', now_utc)
+        )
+        notifications.append([item_id, f'You received a warning due to a report: {reason[:50]}...',
+                              url_for('account_status'), 'warning'])
+    elif action == 'ban' and item_type == 'user':
+        db.execute(
+            "UPDATE users SET ban_status = 'permanent', ban_reason = ?, ban_starts_at = ? WHERE id = ?",
+            (f'Banned due to report: {reason}', now_utc, item_id)
+        )
+        notifications.append([item_id, f'Your account has been permanently banned due to a report: {reason[:50]}...',
+                              url_for('account_status'), 'danger'])
+    elif action == 'ban' and item_type == 'group':
+        db.execute(
+            "UPDATE groups SET ban_status = 'permanent', ban_reason = ?, ban_starts_at = ? WHERE id = ?",
+            (f'Banned due to report: {reason}', now_utc, item_id)
+        )
+        group = db.execute("SELECT name, chat_room_id FROM groups WHERE id = ?", (item_id,)).fetchone()
+        if group:
+            room_notifications.append([
+                group['chat_room_id'],
+                f'The group "<strong>{group["name"]}</strong>" has been permanently banned due to a report.',
+                url_for('home'), 'danger'
+            ])
+    # Other content types (post, reel, story) only have their reports closed, as before
+
+    status, admin_notes = MODERATION_ACTIONS[action]
+    return db.execute(
+        """
+        UPDATE reports SET status = ?, admin_notes = ?
+        WHERE status = 'pending' AND reported_item_type = ? AND reported_item_id = ? AND id <= ?
+        """,
+        (status, admin_notes, item_type, item_id, up_to_report_id)
+    ).rowcount
+
+
+@app.route('/api/admin/moderation_queue/resolve', methods=['POST'])
+@admin_required
+def api_admin_resolve_reports():
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    targets = data.get('targets')
+    reason = (data.get('reason') or '').strip() or None
+    if action not in MODERATION_ACTIONS:
+        return jsonify({'success': False, 'message': 'Invalid action for report handling.'}), 400
+    if not isinstance(targets, list) or not targets:
+        return jsonify({'success': False, 'message': 'No reports selected.'}), 400
+    if len(targets) > MODERATION_BATCH_MAX_TARGETS:
+        return jsonify({'success': False, 'message': f'At most {MODERATION_BATCH_MAX_TARGETS} targets can be handled at once.'}), 400
+    try:
+        targets = [
+            (target['item_type'], int(target['item_id']), int(target['up_to_report_id']))
+            for target in targets
+        ]
+    except (TypeError, KeyError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid report target.'}), 400
+    if any(item_type not in MODERATION_ITEM_TYPES for item_type, _, _ in targets):
+        return jsonify({'success': False, 'message': 'Invalid report target.'}), 400
+
+    db = get_db()
+    notifications = []
+    room_notifications = []
+    try:
+        resolved = sum(
+            resolve_report_target(db, item_type, item_id, up_to_report_id, action, reason, notifications, room_notifications)
+            for item_type, item_id, up_to_report_id in targets
+        )
+        if notifications or room_notifications:
+            # Joins this transaction, so notifications go out only if the actions commit
+            enqueue_job('moderation_notifications', {'notifications': notifications, 'chat_rooms': room_notifications})
+        db.commit()
+        return jsonify({
+            'success': True,
+            'message': f'Handled {resolved} reports on {len(targets)} items.',
+            'resolved_reports': resolved
+        })
+    except Exception as e:
+        db.rollback()
+        app.logger.error(f"Error handling reports in bulk with action {action}: {e}")
+        return jsonify({'success': False, 'message': 'Failed to handle reports.'}), 500
+
+
 @app.route('/api/admin/broadcast_message', methods=['POST'])
 @admin_required
 def api_admin_broadcast_message():
@@ -3974,16 +7537,11 @@ def api_admin_broadcast_message():
         return jsonify({'success': False, 'message': 'Broadcast message cannot be empty.'}), 400
 
     try:
-        all_users = db.execute("SELECT id FROM users WHERE is_admin = 0").fetchall()  # Exclude admin users
-        for user in all_users:
-            send_system_notification(
-                user['id'],
-                f'<strong>SociaFam Update:</strong> {message_content}',
-                link=url_for('notifications'),
-                type='system_message'
-            )
-        db.commit()  # Commit all notifications
-        return jsonify({'success': True, 'message': 'Broadcast message sent to all users.'})
+        enqueue_job('broadcast_notification', {
+            'message': f'<strong>SociaFam Update:</strong> {message_content}',
+            'link': url_for('notifications')
+        })
+        return jsonify({'success': True, 'message': 'Broadcast message queued for all users.'})
     except Exception as e:
         db.rollback()
         app.logger.error(f"Error broadcasting message: {e}")
@@ -4000,7 +7558,7 @@ def api_admin_post_sociafam_story():
     if not media_file or media_file.filename == '':
         return jsonify({'success': False, 'message': 'Media file is required for SociaFam Story.'}), 400
 
-    media_path = save_uploaded_file(media_file, app.config['STORY_MEDIA_FOLDER'])
+    media_path = save_uploaded_file(media_file)
     if not media_path:
         return jsonify({'success': False, 'message': 'Invalid media file type for SociaFam Story.'}), 400
 
@@ -4011,6 +7569,7 @@ def api_admin_post_sociafam_story():
         media_type = 'video'
     else:
         # Should be caught by save_uploaded_file, but as a fallback
+        db.rollback()  # Drops the reference save_uploaded_file() took to the file
         return jsonify({'success': False, 'message': 'Unsupported media type.'}), 400
 
     try:
@@ -4018,6 +7577,7 @@ def api_admin_post_sociafam_story():
         # Assuming admin's own user_id for simplicity, but a distinct 'SociaFam' user could be created.
         admin_user = db.execute("SELECT id FROM users WHERE username = ?", (config.ADMIN_USERNAME,)).fetchone()
         if not admin_user:
+            db.rollback()
             return jsonify({'success': False, 'message': 'Admin user for story posting not found.'}), 500
 
         # Stories expire in 24 hours
@@ -4050,6 +7610,18 @@ def forbidden(e):
     flash('You do not have permission to access this resource.', 'danger')
     return redirect(url_for('home'))
 
+@app.errorhandler(413)
+def request_entity_too_large(e):
+    if isinstance(e, UploadTooLargeError):
+        message = e.description
+    else:
+        message = f'Upload is too large. The maximum upload size is {app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)} MB.'
+    # Upload endpoints are called with fetch() (Accept: */*) and expect JSON; form posts get a flash
+    if request.path.startswith('/api/') or request.accept_mimetypes.best_match(['application/json', 'text/html']) != 'text/html':
+        return jsonify({'success': False, 'message': message}), 413
+    flash(message, 'danger')
+    return redirect(request.referrer or url_for('home'))
+
 
 # Run the app
 if __name__ == '__main__':
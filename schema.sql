@@ -2,6 +2,19 @@
 
 -- Drop existing tables (order matters due to foreign key constraints)
 -- Dropping tables in reverse order of creation to respect foreign key dependencies.
+DROP TABLE IF EXISTS support_threads;
+DROP TABLE IF EXISTS user_counters;
+DROP TABLE IF EXISTS counters;
+DROP TABLE IF EXISTS user_deletions;
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS content_versions;
+DROP TABLE IF EXISTS notifications_archive;
+DROP TABLE IF EXISTS notification_read_state;
+DROP TABLE IF EXISTS media_blobs;
+DROP TABLE IF EXISTS upload_sessions;
+DROP TABLE IF EXISTS reel_rank_snapshots;
+DROP TABLE IF EXISTS reel_views;
+DROP TABLE IF EXISTS comments;
 DROP TABLE IF EXISTS blocked_users;
 DROP TABLE IF EXISTS reports;
 DROP TABLE IF EXISTS warnings;
@@ -57,6 +70,7 @@ CREATE TABLE users (
     notify_comments INTEGER DEFAULT 1,      -- 0 for disabled, 1 for enabled
     notify_tags INTEGER DEFAULT 1           -- 0 for disabled, 1 for enabled
 );
+CREATE INDEX IF NOT EXISTS idx_users_original_name ON users (originalName);
 
 -- Table: members
 -- Stores extended profile details, linked to a user.
@@ -159,6 +173,7 @@ CREATE TABLE groups (
     FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE NO ACTION,
     FOREIGN KEY (chat_room_id) REFERENCES chat_rooms(id) ON DELETE CASCADE
 );
+CREATE INDEX IF NOT EXISTS idx_groups_name ON groups (name);
 
 -- Table: posts
 -- Stores user-generated posts with text and optional media.
@@ -172,8 +187,14 @@ CREATE TABLE posts (
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     likes_count INTEGER DEFAULT 0,          -- Number of likes on the post
     comments_count INTEGER DEFAULT 0,       -- Number of comments on the post
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    original_post_id INTEGER,               -- Set on reposts: the post being reposted (content lives only on the original)
+    reposts_count INTEGER DEFAULT 0,        -- Number of reposts of this post
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (original_post_id) REFERENCES posts(id) ON DELETE CASCADE
 );
+CREATE INDEX IF NOT EXISTS idx_posts_original_post_id ON posts (original_post_id);
+-- A user can repost a given post only once
+CREATE UNIQUE INDEX IF NOT EXISTS idx_posts_unique_repost ON posts (user_id, original_post_id) WHERE original_post_id IS NOT NULL;
 
 -- Table: reels
 -- Stores user-generated short video/image reels.
@@ -207,6 +228,7 @@ CREATE TABLE stories (
     is_sociafam_story INTEGER DEFAULT 0,    -- 1 if this is a special story posted by the Admin
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
+CREATE INDEX IF NOT EXISTS idx_stories_expires_at ON stories (expires_at);
 
 -- Table: notifications
 -- Stores all system and user-generated notifications for users.
@@ -218,6 +240,32 @@ CREATE TABLE notifications (
     link TEXT,                              -- Optional URL to redirect user upon clicking notification
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_read INTEGER DEFAULT 0,              -- 0 for unread, 1 for read
+    group_key TEXT,                         -- Target that repeat events are coalesced by, e.g. 'chat_room:12'
+    event_count INTEGER NOT NULL DEFAULT 1, -- Number of events this row stands for
+    actor_id INTEGER,                       -- User behind the latest event
+    FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_receiver_id ON notifications (receiver_id, id);
+CREATE INDEX IF NOT EXISTS idx_notifications_group_key ON notifications (receiver_id, group_key) WHERE group_key IS NOT NULL;
+
+-- Table: notification_read_state
+-- Read watermark per user: every notification with an id up to read_up_to_id counts as read.
+CREATE TABLE notification_read_state (
+    user_id INTEGER PRIMARY KEY,
+    read_up_to_id INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Table: notifications_archive
+-- Read notifications moved out of the notifications table once they pass the retention age.
+CREATE TABLE notifications_archive (
+    id INTEGER PRIMARY KEY,                 -- Same id the notification had
+    receiver_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    message TEXT NOT NULL,
+    link TEXT,
+    timestamp TIMESTAMP,
+    event_count INTEGER NOT NULL DEFAULT 1,
     FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -246,6 +294,8 @@ CREATE TABLE reports (
     admin_notes TEXT,                       -- Notes added by an admin after reviewing the report
     FOREIGN KEY (reported_by_user_id) REFERENCES users(id) ON DELETE CASCADE
 );
+-- Pending reports by target, for the grouped moderation queue
+CREATE INDEX IF NOT EXISTS idx_reports_pending_target ON reports (reported_item_type, reported_item_id) WHERE status = 'pending';
 
 -- Table: blocked_users
 -- Records users who have been blocked by other users.
@@ -258,3 +308,298 @@ CREATE TABLE blocked_users (
     FOREIGN KEY (blocked_id) REFERENCES users(id) ON DELETE CASCADE,
     UNIQUE (blocker_id, blocked_id)         -- Ensures a user can only block another user once
 );
+
+-- Table: comments
+-- Stores comments left on posts. Threads are paged with keyset pagination over (post_id, id).
+CREATE TABLE comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,               -- The user who wrote the comment
+    post_id INTEGER NOT NULL,               -- The post being commented on
+    comment_text TEXT NOT NULL,             -- The content of the comment
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_comments_post_id_id ON comments (post_id, id);
+
+-- Table: reel_views
+-- Records which viewer has already been counted for a reel in a given time window
+-- (view_window = unix time // window length), so buffered view flushes never double-count.
+CREATE TABLE reel_views (
+    reel_id INTEGER NOT NULL,
+    viewer_id INTEGER NOT NULL,
+    view_window INTEGER NOT NULL,
+    PRIMARY KEY (reel_id, viewer_id, view_window),
+    FOREIGN KEY (reel_id) REFERENCES reels(id) ON DELETE CASCADE,
+    FOREIGN KEY (viewer_id) REFERENCES users(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_reel_views_view_window ON reel_views (view_window);
+
+-- Table: reel_rank_snapshots
+-- The ranked reels order computed on a viewer's first page, read by position by later pages so
+-- the order can't shift while they scroll. Rows older than a few hours are pruned.
+CREATE TABLE reel_rank_snapshots (
+    id TEXT PRIMARY KEY,                    -- Random id carried in the feed cursor
+    viewer_id INTEGER NOT NULL,
+    reel_ids TEXT NOT NULL,                 -- JSON array of reel ids, best ranked first
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (viewer_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_reel_rank_snapshots_created_at ON reel_rank_snapshots (created_at);
+
+-- Table: upload_sessions
+-- Tracks resumable (chunked) uploads. The received bytes live in resumable_uploads/<id>.part.
+CREATE TABLE upload_sessions (
+    id TEXT PRIMARY KEY,                    -- Random upload id handed to the client
+    user_id INTEGER NOT NULL,               -- The uploader; sessions are private to them
+    filename TEXT NOT NULL,                 -- Sanitized original filename (its extension decides the media type)
+    total_size INTEGER NOT NULL,            -- Declared size of the complete file in bytes
+    status TEXT DEFAULT 'active',           -- 'active' while receiving chunks, 'complete' once finalized
+    sha256 TEXT,                            -- Digest of the complete file, set on finalize
+    received_bytes INTEGER NOT NULL DEFAULT 0, -- Offset the next chunk must start at
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Last chunk received; abandoned sessions are purged by age
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at ON upload_sessions (updated_at);
+
+-- Table: media_blobs
+-- Content-addressed media store: one row per distinct stored file
+-- (static/uploads/media/ab/cd/<sha256>.<ext>). ref_count is the number of rows in the path
+-- columns (posts.media_path, members.profilePhoto, ...) that point at it.
+CREATE TABLE media_blobs (
+    path TEXT PRIMARY KEY,                  -- Stored path, as saved in the referencing columns
+    sha256 TEXT NOT NULL,                   -- Digest of the file content
+    size INTEGER NOT NULL,                  -- File size in bytes
+    ref_count INTEGER NOT NULL DEFAULT 0,   -- The file is deleted when this drops to zero
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Video metadata, filled in by the background ffprobe/ffmpeg job
+    poster_path TEXT,                       -- Stored path of the extracted poster frame (JPEG)
+    duration_seconds REAL,
+    width INTEGER,
+    height INTEGER,
+    bitrate INTEGER,                        -- Bits per second
+    probed_at TIMESTAMP                     -- When extraction was attempted; NULL means not yet probed
+);
+
+-- Table: jobs
+-- Durable background job queue (see "Background Jobs" in app.py). Finished jobs are deleted;
+-- jobs that used up their attempts stay with status 'failed'.
+CREATE TABLE jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,                     -- Handler name, e.g. 'image_variants', 'broadcast_notification'
+    payload TEXT NOT NULL DEFAULT '{}',     -- JSON keyword arguments for the handler
+    unique_key TEXT,                        -- Optional; at most one unfinished (not failed) job per key
+    status TEXT NOT NULL DEFAULT 'queued',  -- 'queued', 'running' or 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMP NOT NULL,              -- Not claimed before this (retries are pushed back)
+    locked_by TEXT,                         -- Worker holding the job while it runs
+    locked_until TIMESTAMP,                 -- Lease end; an expired lease makes the job claimable again
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_unique_key ON jobs (unique_key) WHERE unique_key IS NOT NULL AND status != 'failed';
+
+-- Table: user_deletions
+-- Accounts being deleted by the background 'delete_user' job, with its progress. The row stays
+-- after the user is gone as a record of the deletion (so no foreign key to users).
+CREATE TABLE user_deletions (
+    user_id INTEGER PRIMARY KEY,
+    requested_by INTEGER,                   -- Admin who requested the deletion
+    status TEXT NOT NULL DEFAULT 'queued',  -- 'queued', 'running' or 'done'
+    current_step TEXT,                      -- Table being cleared
+    rows_deleted INTEGER NOT NULL DEFAULT 0,
+    requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Table: content_versions
+-- One counter per table, bumped by the triggers below on every insert, update and delete. Polled
+-- API responses are tagged (ETag) from these counters so unchanged ones can be answered with 304.
+CREATE TABLE content_versions (
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO content_versions (table_name) VALUES
+    ('users'),
+    ('members'),
+    ('friendships'),
+    ('posts'),
+    ('reels'),
+    ('stories'),
+    ('media_blobs');
+
+CREATE TRIGGER users_content_version_insert AFTER INSERT ON users
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'users'; END;
+CREATE TRIGGER users_content_version_update AFTER UPDATE ON users
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'users'; END;
+CREATE TRIGGER users_content_version_delete AFTER DELETE ON users
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'users'; END;
+
+CREATE TRIGGER members_content_version_insert AFTER INSERT ON members
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'members'; END;
+CREATE TRIGGER members_content_version_update AFTER UPDATE ON members
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'members'; END;
+CREATE TRIGGER members_content_version_delete AFTER DELETE ON members
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'members'; END;
+
+CREATE TRIGGER friendships_content_version_insert AFTER INSERT ON friendships
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'friendships'; END;
+CREATE TRIGGER friendships_content_version_update AFTER UPDATE ON friendships
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'friendships'; END;
+CREATE TRIGGER friendships_content_version_delete AFTER DELETE ON friendships
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'friendships'; END;
+
+CREATE TRIGGER posts_content_version_insert AFTER INSERT ON posts
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'posts'; END;
+CREATE TRIGGER posts_content_version_update AFTER UPDATE ON posts
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'posts'; END;
+CREATE TRIGGER posts_content_version_delete AFTER DELETE ON posts
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'posts'; END;
+
+CREATE TRIGGER reels_content_version_insert AFTER INSERT ON reels
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'reels'; END;
+CREATE TRIGGER reels_content_version_update AFTER UPDATE ON reels
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'reels'; END;
+CREATE TRIGGER reels_content_version_delete AFTER DELETE ON reels
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'reels'; END;
+
+CREATE TRIGGER stories_content_version_insert AFTER INSERT ON stories
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'stories'; END;
+CREATE TRIGGER stories_content_version_update AFTER UPDATE ON stories
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'stories'; END;
+CREATE TRIGGER stories_content_version_delete AFTER DELETE ON stories
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'stories'; END;
+
+CREATE TRIGGER media_blobs_content_version_insert AFTER INSERT ON media_blobs
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'media_blobs'; END;
+CREATE TRIGGER media_blobs_content_version_update AFTER UPDATE ON media_blobs
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'media_blobs'; END;
+CREATE TRIGGER media_blobs_content_version_delete AFTER DELETE ON media_blobs
+BEGIN UPDATE content_versions SET version = version + 1 WHERE table_name = 'media_blobs'; END;
+
+-- Table: counters
+-- Headline numbers (admin dashboard) kept up to date by the triggers below, so reading one is a
+-- primary key lookup. See COUNTER_DEFINITIONS in app.py.
+CREATE TABLE counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO counters (name) VALUES
+    ('users'),
+    ('groups'),
+    ('posts'),
+    ('reels'),
+    ('stories'),
+    ('pending_reports'),
+    ('active_warnings'),
+    ('active_bans');
+CREATE TRIGGER counter_users_insert AFTER INSERT ON users
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'users'; END;
+CREATE TRIGGER counter_users_delete AFTER DELETE ON users
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'users'; END;
+CREATE TRIGGER counter_groups_insert AFTER INSERT ON groups
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'groups'; END;
+CREATE TRIGGER counter_groups_delete AFTER DELETE ON groups
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'groups'; END;
+CREATE TRIGGER counter_posts_insert AFTER INSERT ON posts WHEN IFNULL(NEW.original_post_id IS NULL, 0)
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'posts'; END;
+CREATE TRIGGER counter_posts_delete AFTER DELETE ON posts WHEN IFNULL(OLD.original_post_id IS NULL, 0)
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'posts'; END;
+CREATE TRIGGER counter_posts_update AFTER UPDATE OF original_post_id ON posts WHEN IFNULL(NEW.original_post_id IS NULL, 0) != IFNULL(OLD.original_post_id IS NULL, 0)
+BEGIN UPDATE counters SET value = value + IFNULL(NEW.original_post_id IS NULL, 0) - IFNULL(OLD.original_post_id IS NULL, 0) WHERE name = 'posts'; END;
+CREATE TRIGGER counter_reels_insert AFTER INSERT ON reels
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'reels'; END;
+CREATE TRIGGER counter_reels_delete AFTER DELETE ON reels
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'reels'; END;
+CREATE TRIGGER counter_stories_insert AFTER INSERT ON stories
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'stories'; END;
+CREATE TRIGGER counter_stories_delete AFTER DELETE ON stories
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'stories'; END;
+CREATE TRIGGER counter_pending_reports_insert AFTER INSERT ON reports WHEN IFNULL(NEW.status = 'pending', 0)
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'pending_reports'; END;
+CREATE TRIGGER counter_pending_reports_delete AFTER DELETE ON reports WHEN IFNULL(OLD.status = 'pending', 0)
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'pending_reports'; END;
+CREATE TRIGGER counter_pending_reports_update AFTER UPDATE OF status ON reports WHEN IFNULL(NEW.status = 'pending', 0) != IFNULL(OLD.status = 'pending', 0)
+BEGIN UPDATE counters SET value = value + IFNULL(NEW.status = 'pending', 0) - IFNULL(OLD.status = 'pending', 0) WHERE name = 'pending_reports'; END;
+CREATE TRIGGER counter_active_warnings_insert AFTER INSERT ON warnings WHEN IFNULL(NEW.status = 'active', 0)
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'active_warnings'; END;
+CREATE TRIGGER counter_active_warnings_delete AFTER DELETE ON warnings WHEN IFNULL(OLD.status = 'active', 0)
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'active_warnings'; END;
+CREATE TRIGGER counter_active_warnings_update AFTER UPDATE OF status ON warnings WHEN IFNULL(NEW.status = 'active', 0) != IFNULL(OLD.status = 'active', 0)
+BEGIN UPDATE counters SET value = value + IFNULL(NEW.status = 'active', 0) - IFNULL(OLD.status = 'active', 0) WHERE name = 'active_warnings'; END;
+CREATE TRIGGER counter_active_bans_insert AFTER INSERT ON users WHEN IFNULL(NEW.ban_status != 'none', 0)
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'active_bans'; END;
+CREATE TRIGGER counter_active_bans_delete AFTER DELETE ON users WHEN IFNULL(OLD.ban_status != 'none', 0)
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'active_bans'; END;
+CREATE TRIGGER counter_active_bans_update AFTER UPDATE OF ban_status ON users WHEN IFNULL(NEW.ban_status != 'none', 0) != IFNULL(OLD.ban_status != 'none', 0)
+BEGIN UPDATE counters SET value = value + IFNULL(NEW.ban_status != 'none', 0) - IFNULL(OLD.ban_status != 'none', 0) WHERE name = 'active_bans'; END;
+
+-- Table: user_counters
+-- Per user counts shown on profiles (friends, followers, following, posts, likes received), kept up
+-- to date by the triggers below. See USER_COUNTER_DEFINITIONS in app.py.
+CREATE TABLE user_counters (
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,                     -- 'friends', 'followers', 'following', 'posts' or 'likes'
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, name)
+) WITHOUT ROWID;
+CREATE TRIGGER user_counter_friends_friendships_user1_id_insert AFTER INSERT ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user1_id, 'friends', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_friends_friendships_user1_id_delete AFTER DELETE ON friendships WHEN (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user1_id, 'friends', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_friends_friendships_user1_id_update AFTER UPDATE ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) OR NEW.user1_id != OLD.user1_id
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user1_id, 'friends', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user1_id, 'friends', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_friends_friendships_user2_id_insert AFTER INSERT ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user2_id, 'friends', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_friends_friendships_user2_id_delete AFTER DELETE ON friendships WHEN (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user2_id, 'friends', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_friends_friendships_user2_id_update AFTER UPDATE ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) OR NEW.user2_id != OLD.user2_id
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user2_id, 'friends', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user2_id, 'friends', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_following_friendships_user1_id_insert AFTER INSERT ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user1_id, 'following', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_following_friendships_user1_id_delete AFTER DELETE ON friendships WHEN (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user1_id, 'following', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_following_friendships_user1_id_update AFTER UPDATE ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) OR NEW.user1_id != OLD.user1_id
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user1_id, 'following', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user1_id, 'following', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_followers_friendships_user2_id_insert AFTER INSERT ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user2_id, 'followers', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_followers_friendships_user2_id_delete AFTER DELETE ON friendships WHEN (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user2_id, 'followers', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_followers_friendships_user2_id_update AFTER UPDATE ON friendships WHEN (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END) != (CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END) OR NEW.user2_id != OLD.user2_id
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user2_id, 'followers', -(CASE WHEN OLD.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user2_id, 'followers', (CASE WHEN NEW.status = 'accepted' THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_posts_posts_user_id_insert AFTER INSERT ON posts WHEN (CASE WHEN NEW.original_post_id IS NULL THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user_id, 'posts', (CASE WHEN NEW.original_post_id IS NULL THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_posts_posts_user_id_delete AFTER DELETE ON posts WHEN (CASE WHEN OLD.original_post_id IS NULL THEN 1 ELSE 0 END) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user_id, 'posts', -(CASE WHEN OLD.original_post_id IS NULL THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_posts_posts_user_id_update AFTER UPDATE ON posts WHEN (CASE WHEN NEW.original_post_id IS NULL THEN 1 ELSE 0 END) != (CASE WHEN OLD.original_post_id IS NULL THEN 1 ELSE 0 END) OR NEW.user_id != OLD.user_id
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user_id, 'posts', -(CASE WHEN OLD.original_post_id IS NULL THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user_id, 'posts', (CASE WHEN NEW.original_post_id IS NULL THEN 1 ELSE 0 END)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_likes_posts_user_id_insert AFTER INSERT ON posts WHEN IFNULL(NEW.likes_count, 0) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user_id, 'likes', IFNULL(NEW.likes_count, 0)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_likes_posts_user_id_delete AFTER DELETE ON posts WHEN IFNULL(OLD.likes_count, 0) != 0
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user_id, 'likes', -IFNULL(OLD.likes_count, 0)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+CREATE TRIGGER user_counter_likes_posts_user_id_update AFTER UPDATE ON posts WHEN IFNULL(NEW.likes_count, 0) != IFNULL(OLD.likes_count, 0) OR NEW.user_id != OLD.user_id
+BEGIN INSERT INTO user_counters (user_id, name, value) VALUES (OLD.user_id, 'likes', -IFNULL(OLD.likes_count, 0)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; INSERT INTO user_counters (user_id, name, value) VALUES (NEW.user_id, 'likes', IFNULL(NEW.likes_count, 0)) ON CONFLICT (user_id, name) DO UPDATE SET value = value + excluded.value; END;
+
+-- Table: support_threads
+-- One row per support chat (a 1-on-1 chat room with the admin) for the admin's support inbox,
+-- kept current by the trigger below so the inbox never scans chat_messages.
+CREATE TABLE support_threads (
+    chat_room_id INTEGER PRIMARY KEY,       -- The support chat room
+    user_id INTEGER NOT NULL,               -- The user on the other side of the chat
+    last_message_id INTEGER,                -- Latest message in the room, if any
+    last_activity_at TIMESTAMP,             -- Time of the latest message, or when the room was opened
+    unread_for_admin INTEGER NOT NULL DEFAULT 0 -- User messages since the admin last read or replied
+);
+CREATE INDEX IF NOT EXISTS idx_support_threads_activity ON support_threads (last_activity_at);
+CREATE INDEX IF NOT EXISTS idx_support_threads_unread ON support_threads (unread_for_admin, last_activity_at);
+CREATE TRIGGER support_threads_message AFTER INSERT ON chat_messages
+BEGIN
+    UPDATE support_threads
+    SET last_message_id = NEW.id,
+        last_activity_at = NEW.timestamp,
+        unread_for_admin = CASE WHEN NEW.sender_id = user_id THEN unread_for_admin + 1 ELSE 0 END
+    WHERE chat_room_id = NEW.chat_room_id;
+END;
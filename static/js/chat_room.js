@@ -0,0 +1,166 @@
+// Behaviour shared by the one-to-one and group chat pages (view_chat.html, view_group_chat.html).
+// Each page passes the API URLs for its room; page-specific actions stay in the template.
+
+function initChatComposer() {
+    const chatMessageArea = document.getElementById('chatMessageArea');
+    const messageInput = document.getElementById('messageInput');
+    const sendBtn = document.querySelector('.send-btn');
+
+    // Scroll to bottom on load
+    chatMessageArea.scrollTop = chatMessageArea.scrollHeight;
+
+    // Auto-resize textarea
+    messageInput.addEventListener('input', function() {
+        this.style.height = 'auto';
+        this.style.height = (this.scrollHeight) + 'px';
+    });
+
+    function sendMessage() {
+        const messageContent = messageInput.value.trim();
+        if (messageContent) {
+            // TODO: Send message via AJAX to Flask backend
+            console.log('Sending message:', messageContent);
+
+            messageInput.value = ''; // Clear input immediately
+            messageInput.style.height = 'auto'; // Reset height
+            chatMessageArea.scrollTop = chatMessageArea.scrollHeight; // Scroll to bottom
+        }
+    }
+
+    // Send message button click (or Enter key)
+    sendBtn.addEventListener('click', sendMessage);
+    messageInput.addEventListener('keydown', function(event) {
+        if (event.key === 'Enter' && !event.shiftKey) {
+            event.preventDefault(); // Prevent new line in textarea
+            sendMessage();
+        }
+    });
+}
+
+function initChatWallpaperForm(url) {
+    document.getElementById('saveWallpaperBtn').addEventListener('click', function() {
+        const wallpaperFileInput = document.getElementById('wallpaperFileInput');
+        const clearWallpaper = document.getElementById('clearWallpaperCheckbox').checked;
+        const formData = new FormData();
+
+        if (clearWallpaper) {
+            formData.append('action', 'clear');
+        } else if (wallpaperFileInput.files.length > 0) {
+            formData.append('wallpaperFile', wallpaperFileInput.files[0]);
+            formData.append('action', 'upload');
+        } else {
+            alert('Please select a file or choose to clear.');
+            return;
+        }
+
+        fetch(url, {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                alert(data.message); // Replace with custom modal
+                location.reload(); // To apply new wallpaper
+            } else {
+                alert('Failed to change wallpaper: ' + data.message);
+            }
+        })
+        .catch(error => console.error('Error changing wallpaper:', error));
+    });
+}
+
+// Client-side search over the messages on the page. describeMessage(bubble) returns
+// { content, sender }; sender is optional and shown in bold before the content.
+function initChatMessageSearch(describeMessage) {
+    const allChatMessages = [];
+    document.querySelectorAll('.message-bubble').forEach(bubble => {
+        const message = describeMessage(bubble);
+        message.timestamp = bubble.querySelector('.message-timestamp')?.textContent || '';
+        message.element = bubble;
+        allChatMessages.push(message);
+    });
+
+    document.getElementById('chatSearchInput').addEventListener('input', function() {
+        const searchTerm = this.value.toLowerCase();
+        const resultsContainer = document.getElementById('chatSearchResults');
+        resultsContainer.innerHTML = ''; // Clear previous results
+
+        if (searchTerm.length < 2) {
+            resultsContainer.innerHTML = `<p class="text-muted text-center">Start typing to see results.</p>`;
+            return;
+        }
+
+        const filteredMessages = allChatMessages.filter(msg => msg.content.toLowerCase().includes(searchTerm));
+
+        if (filteredMessages.length > 0) {
+            filteredMessages.forEach(msg => {
+                const resultItem = document.createElement('a');
+                resultItem.href = '#'; // Link to scroll to message
+                resultItem.classList.add('list-group-item', 'list-group-item-action');
+                resultItem.innerHTML = `
+                    ${msg.sender ? `<strong>${msg.sender}:</strong> ` : ''}${msg.content} <br>
+                    <small class="text-muted">${msg.timestamp}</small>
+                `;
+                resultItem.addEventListener('click', function(e) {
+                    e.preventDefault();
+                    msg.element.scrollIntoView({ behavior: 'smooth', block: 'center' });
+                    // Highlight the message temporarily
+                    msg.element.style.backgroundColor = 'rgba(255, 255, 0, 0.3)'; // Yellow highlight
+                    setTimeout(() => msg.element.style.backgroundColor = '', 2000);
+                    bootstrap.Modal.getInstance(document.getElementById('searchChatMessagesModal')).hide();
+                });
+                resultsContainer.appendChild(resultItem);
+            });
+        } else {
+            resultsContainer.innerHTML = `<p class="text-muted text-center">No messages found.</p>`;
+        }
+    });
+}
+
+function initDisappearingMessagesForm(url, successMessage) {
+    document.getElementById('saveDisappearingSettingsBtn').addEventListener('click', function() {
+        const selectedTime = document.querySelector('input[name="disappearingTime"]:checked').value;
+        fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ setting: selectedTime })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                alert(successMessage); // Replace with custom modal
+            } else {
+                alert('Failed to save setting: ' + data.message);
+            }
+        })
+        .catch(error => console.error('Error saving disappearing message setting:', error));
+    });
+}
+
+function initChatMediaUpload(url, successMessage) {
+    document.getElementById('uploadMediaBtn').addEventListener('click', function() {
+        const mediaFileInput = document.getElementById('mediaFileInput');
+        if (mediaFileInput.files.length > 0) {
+            const formData = new FormData();
+            formData.append('mediaFile', mediaFileInput.files[0]);
+
+            fetch(url, {
+                method: 'POST',
+                body: formData
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    alert(successMessage); // Replace with custom modal
+                    location.reload(); // To show new media
+                } else {
+                    alert('Failed to send media: ' + data.message);
+                }
+            })
+            .catch(error => console.error('Error sending media:', error));
+        } else {
+            alert('Please select a file to send.');
+        }
+    });
+}
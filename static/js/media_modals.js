@@ -0,0 +1,168 @@
+// Post detail and reel viewer modals used by the profile and group profile galleries
+// (my_profile.html, profile.html, view_group_profile.html).
+
+// Loads the post detail fragment for the gallery item that opened #postDetailModal and wires up
+// comment paging and posting inside it.
+function initPostDetailModal() {
+    const postDetailModalElement = document.getElementById('postDetailModal');
+    const postDetailModalBody = document.getElementById('postDetailModalBody');
+    if (!postDetailModalElement || !postDetailModalBody) {
+        return;
+    }
+
+    postDetailModalElement.addEventListener('show.bs.modal', function (event) {
+        const button = event.relatedTarget; // Gallery item that triggered the modal
+        // data-item-id is used by the saved/reposts/liked tabs and the group media grid
+        const postId = button.getAttribute('data-post-id') || button.getAttribute('data-item-id');
+
+        postDetailModalBody.innerHTML = `
+            <div class="text-center py-5">
+                <div class="spinner-border text-primary" role="status">
+                    <span class="visually-hidden">Loading post...</span>
+                </div>
+            </div>`;
+
+        fetch(`/api/post-details/${postId}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error('Network response was not ok');
+                }
+                return response.text();
+            })
+            .then(html => {
+                postDetailModalBody.innerHTML = html;
+            })
+            .catch(error => {
+                console.error('Error fetching post details:', error);
+                postDetailModalBody.innerHTML = `<p class="text-danger text-center">Failed to load post. Please try again.</p>`;
+            });
+    });
+    postDetailModalElement.addEventListener('hidden.bs.modal', function () {
+        postDetailModalBody.innerHTML = '';
+    });
+
+    // Comment thread paging and posting inside the post detail fragment
+    function renderCommentItem(comment) {
+        const item = document.createElement('li');
+        item.className = 'd-flex mb-2';
+        item.dataset.commentId = comment.id;
+        const pic = document.createElement('img');
+        pic.src = comment.profile_pic;
+        pic.alt = comment.username + ' Profile';
+        pic.className = 'rounded-circle me-2';
+        pic.width = 32;
+        pic.height = 32;
+        const body = document.createElement('div');
+        const author = document.createElement('a');
+        author.href = `/profile/${comment.username}`;
+        author.className = 'fw-bold text-decoration-none';
+        author.textContent = '@' + comment.username;
+        const text = document.createElement('span');
+        text.textContent = ' ' + comment.comment_text;
+        const time = document.createElement('div');
+        time.className = 'text-muted small';
+        time.textContent = comment.timestamp ? comment.timestamp.substring(0, 10) : '';
+        body.append(author, text, time);
+        item.append(pic, body);
+        return item;
+    }
+
+    postDetailModalBody.addEventListener('click', function (event) {
+        const loadMoreButton = event.target.closest('.post-detail-load-more');
+        if (!loadMoreButton) return;
+        const postId = loadMoreButton.dataset.postId;
+        const cursor = loadMoreButton.dataset.nextCursor;
+        loadMoreButton.disabled = true;
+        fetch(`/api/posts/${postId}/comments?before_id=${cursor}`)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) throw new Error(data.message);
+                const list = postDetailModalBody.querySelector('.post-detail-comments');
+                data.comments.forEach(comment => list.appendChild(renderCommentItem(comment)));
+                if (data.has_more) {
+                    loadMoreButton.dataset.nextCursor = data.next_cursor;
+                    loadMoreButton.disabled = false;
+                } else {
+                    loadMoreButton.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading comments:', error);
+                loadMoreButton.disabled = false;
+            });
+    });
+
+    postDetailModalBody.addEventListener('submit', function (event) {
+        const form = event.target.closest('.post-detail-comment-form');
+        if (!form) return;
+        event.preventDefault();
+        const input = form.querySelector('input[name="comment_text"]');
+        const postId = form.dataset.postId;
+        fetch(`/api/posts/${postId}/comment`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ comment_text: input.value })
+        })
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) throw new Error(data.message);
+                input.value = '';
+                postDetailModalBody.querySelector('.post-detail-comments-count').textContent = data.new_comments_count;
+                // Reload the first page so the new comment shows up at the top
+                return fetch(`/api/posts/${postId}/comments`).then(response => response.json());
+            })
+            .then(data => {
+                const list = postDetailModalBody.querySelector('.post-detail-comments');
+                list.innerHTML = '';
+                data.comments.forEach(comment => list.appendChild(renderCommentItem(comment)));
+            })
+            .catch(error => console.error('Error adding comment:', error));
+    });
+}
+
+// Plays a reel in #reelViewerModal. findReel(button) receives the gallery item that opened the
+// modal and returns { videoUrl, ownerProfilePic, ownerUsername }, or null if it isn't known.
+function initReelViewerModal(findReel) {
+    const reelViewerModalElement = document.getElementById('reelViewerModal');
+    const reelViewerVideo = document.getElementById('reelViewerVideo');
+    const reelOwnerProfilePic = document.getElementById('reelOwnerProfilePic');
+    const reelOwnerUsername = document.getElementById('reelOwnerUsername');
+    if (!reelViewerModalElement || !reelViewerVideo) {
+        return;
+    }
+
+    reelViewerModalElement.addEventListener('show.bs.modal', function (event) {
+        const button = event.relatedTarget;
+        const reel = findReel(button);
+
+        if (reel && reel.videoUrl) {
+            reelViewerVideo.src = reel.videoUrl;
+            reelOwnerProfilePic.src = reel.ownerProfilePic;
+            reelOwnerUsername.textContent = '@' + reel.ownerUsername;
+            reelViewerVideo.style.display = 'block';
+            reelViewerVideo.play().catch(e => console.error("Video autoplay error:", e));
+        } else {
+            console.error("Reel not found for ID:", button.getAttribute('data-reel-id') || button.getAttribute('data-item-id'));
+        }
+    });
+
+    reelViewerModalElement.addEventListener('hidden.bs.modal', function () {
+        reelViewerVideo.pause();
+        reelViewerVideo.currentTime = 0;
+        reelViewerVideo.src = '';
+        reelViewerVideo.style.display = 'none';
+        reelOwnerProfilePic.src = '';
+        reelOwnerUsername.textContent = '';
+    });
+
+    // Tap to play/pause
+    reelViewerModalElement.addEventListener('click', function(e) {
+        if (e.target === reelViewerVideo) {
+            if (reelViewerVideo.paused) {
+                reelViewerVideo.play();
+            } else {
+                reelViewerVideo.pause();
+            }
+        }
+    });
+}
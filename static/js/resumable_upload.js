@@ -0,0 +1,87 @@
+// Resumable uploads for large media (see the /api/uploads routes in app.py).
+// The file is sent in chunks; after a dropped connection or a page reload the upload
+// continues from the offset the server already has instead of starting over.
+
+const RESUMABLE_CHUNK_SIZE = 4 * 1024 * 1024;
+const RESUMABLE_MAX_RETRIES = 5;
+
+function resumableUploadKey(file) {
+    return `resumable_upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function resumableUploadRequest(url, options) {
+    const response = await fetch(url, options);
+    const data = await response.json().catch(() => ({}));
+    return { response, data };
+}
+
+async function startOrResumeUploadSession(file) {
+    // Reuse the session from a previous attempt at the same file if the server still has it
+    const savedId = localStorage.getItem(resumableUploadKey(file));
+    if (savedId) {
+        const { response, data } = await resumableUploadRequest(`/api/uploads/${savedId}`);
+        if (response.ok) {
+            return data;
+        }
+        localStorage.removeItem(resumableUploadKey(file));
+    }
+
+    const { response, data } = await resumableUploadRequest('/api/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    if (!response.ok) {
+        throw new Error(data.message || 'Failed to start upload.');
+    }
+    localStorage.setItem(resumableUploadKey(file), data.upload_id);
+    return data;
+}
+
+// Uploads `file` and returns the finalized upload id. onProgress receives a fraction from 0 to 1.
+async function resumableUpload(file, onProgress) {
+    let session = await startOrResumeUploadSession(file);
+    let offset = session.offset;
+    let retries = 0;
+
+    while (session.status === 'active' && offset < file.size) {
+        try {
+            const { response, data } = await resumableUploadRequest(`/api/uploads/${session.upload_id}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(offset) },
+                body: file.slice(offset, offset + RESUMABLE_CHUNK_SIZE)
+            });
+            if (!response.ok && response.status !== 409) {
+                throw new Error(data.message || 'Chunk upload failed.');
+            }
+            // On 409 the server reports the offset it actually has; continue from there
+            offset = data.offset;
+            retries = 0;
+        } catch (error) {
+            if (++retries > RESUMABLE_MAX_RETRIES) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** retries));
+            // Part of the failed chunk may have arrived; ask where to resume
+            const { response, data } = await resumableUploadRequest(`/api/uploads/${session.upload_id}`);
+            if (response.ok) {
+                offset = data.offset;
+            }
+        }
+        if (onProgress) {
+            onProgress(offset / file.size);
+        }
+    }
+
+    const { response, data } = await resumableUploadRequest(`/api/uploads/${session.upload_id}/finalize`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({})
+    });
+    if (!response.ok) {
+        localStorage.removeItem(resumableUploadKey(file));
+        throw new Error(data.message || 'Failed to finalize upload.');
+    }
+    localStorage.removeItem(resumableUploadKey(file));
+    return session.upload_id;
+}